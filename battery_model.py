@@ -3,15 +3,26 @@ Zenobe Coding Interview
 Obed Sims
 Email - obedsims97@yahoo.com
 """
+import numpy as np
 import pandas as pd
-from pyomo.environ import NonNegativeReals, ConcreteModel, Binary, Constraint, Var, Param, maximize, Set
+from pyomo.environ import NonNegativeReals, ConcreteModel, Binary, Constraint, Var, Param, maximize, Set, value
 from pyomo.opt import SolverStatus, TerminationCondition, SolverFactory
+from pyomo.solvers.plugins.solvers.persistent_solver import PersistentSolver
 import logging
-import os
+import math
+import time
+
+from matrix_model import BatteryMatrixModel, CHARGE, DISCHARGE, CHARGE_BOOL, DISCHARGE_BOOL, ENERGY, \
+    DISPATCH_TOLERANCE, service_directions, max_service_volumes, check_segment_costs
+from solvers import pyomo_solver, DEFAULT_PYOMO_SOLVER
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Pyomo persistent interfaces keep the model loaded in the solver between horizons
+PERSISTENT_SOLVERS = {"cplex": "cplex_persistent",
+                      "highs": "appsi_highs"}
+
 
 class Battery(ConcreteModel):
 
@@ -22,15 +33,53 @@ class Battery(ConcreteModel):
                  discharging_eff: float,
                  import_grid_lim: float | int,
                  export_grid_lim: float | int,
-                 import_rate: pd.DataFrame,
-                 export_rate: pd.DataFrame,
+                 import_rate: pd.Series | np.ndarray,
+                 export_rate: pd.Series | np.ndarray,
                  min_soc: float | int,
                  max_soc: float | int,
                  init_charge: float | int,
+                 backend: str = "pyomo",
+                 persistent: bool = False,
+                 relax_binaries: bool = False,
+                 interval_length: float = 0.5,
                  ):
+        """
+        :param import_rate: Import prices of the horizon in period order, e.g. a horizon view of
+                            tools.price_inputs.PriceInputs
+        :param export_rate: Export prices of the horizon in period order
+        :param backend: "pyomo" builds the model from indexed Pyomo rules, "matrix" builds the same formulation as
+                        sparse coefficient matrices (see matrix_model.py) which is much faster for long horizons
+        :param persistent: Build the prices and initial SoC as mutable params so the same model can be re-solved for
+                           the next horizon with update_horizon, driving the solver through a persistent interface
+        :param relax_binaries: Solve the pure LP without the charge/discharge binaries and only bring them back for
+                               the periods where the LP charges and discharges at the same time. With lossy
+                               efficiencies and non-negative prices that is never profitable, so usually one LP
+                               solve is enough.
+        :param interval_length: Duration of a dispatch period in hours, e.g. 0.25 for a 15-minute market or 1 for an
+                                hourly pre-screen
+        """
 
         ConcreteModel.__init__(self)
 
+        if backend not in ("pyomo", "matrix"):
+            raise ValueError(f"Unknown model backend '{backend}', expected 'pyomo' or 'matrix'")
+        self.backend = backend
+        self.persistent = persistent
+        self.relax_binaries = relax_binaries
+        # Periods solved with their binaries, the rest were solved as a pure LP
+        self.binary_periods = None
+        # Per-solve instrumentation, see solve_problem
+        self.metrics = {}
+        # Set by add_degradation_cost
+        self.segment_costs = None
+        # Set by add_ancillary_services
+        self.service_names = None
+        self.period_block = None
+        self.cycle_penalty = 0.0
+        self.n_periods = len(import_rate)
+        self._persistent_solver = None
+        self._horizons_solved = 0
+
         self.battery_cap = battery_capacity
         self.dis_p = discharge_power
         self.charge_p = charge_power
@@ -43,7 +92,24 @@ class Battery(ConcreteModel):
         self.init_charge = init_charge
 
         # Duration of a market dispatch time interval
-        self.M = 0.5  # 1 = 1 hour, 0.5 = 30min, 0.25 = 15 min
+        self.M = interval_length  # 1 = 1 hour, 0.5 = 30min, 0.25 = 15 min
+
+        if self.backend == "matrix":
+            # The matrix backend holds its own vectorised copy of the formulation, no Pyomo components are built
+            self.matrix_model = BatteryMatrixModel(battery_capacity=battery_capacity,
+                                                   discharge_power=discharge_power,
+                                                   charge_power=charge_power,
+                                                   charging_eff=charging_eff,
+                                                   discharging_eff=discharging_eff,
+                                                   import_grid_lim=import_grid_lim,
+                                                   export_grid_lim=export_grid_lim,
+                                                   import_rate=import_rate,
+                                                   export_rate=export_rate,
+                                                   min_soc=min_soc,
+                                                   max_soc=max_soc,
+                                                   init_charge=init_charge,
+                                                   interval_length=interval_length)
+            return
 
         #######################################################################################################
         # Sets
@@ -55,8 +121,11 @@ class Battery(ConcreteModel):
         #######################################################################################################
         # Params
         #######################################################################################################
-        self.import_rate = Param(self.time_horizon_range, initialize=import_rate.to_dict())
-        self.export_rate = Param(self.time_horizon_range, initialize=export_rate.to_dict())
+        self.import_rate = Param(self.time_horizon_range, initialize=self._period_values(import_rate),
+                                 mutable=persistent)
+        self.export_rate = Param(self.time_horizon_range, initialize=self._period_values(export_rate),
+                                 mutable=persistent)
+        self.initial_energy = Param(initialize=init_charge, mutable=persistent)
 
         #######################################################################################################
         # Variables
@@ -72,12 +141,170 @@ class Battery(ConcreteModel):
         self.charge_bool = Var(self.time_horizon_range, within=Binary, name="Charge Bool")  # Bool for charging
         self.discharge_bool = Var(self.time_horizon_range, within=Binary, name="Discharge Bool")  # Bool for discharging
 
-    def add_objective_function(self):
+    def add_objective_function(self, cycle_penalty: float = 0.0):
+        """
+        :param cycle_penalty: Optional penalty per MWh discharged (£/MWh), used to price the cycle budget instead of
+                              enforcing it with add_max_cycles_constraint
+        :return:
+        """
+
+        if self.backend == "matrix":
+            self.matrix_model.add_objective_function(cycle_penalty=cycle_penalty)
+            return
+
+        self.cycle_penalty = cycle_penalty
 
         @self.Objective(sense=maximize)
         def obj_function(model):
-            return sum(model.M * (model.export_rate[i] * model.discharge[i]) -
-                       model.M * (model.import_rate[i] * model.charge[i]) for i in model.time_horizon_range)
+            return sum(model.M * ((model.export_rate[i] - cycle_penalty) * model.discharge[i]) -
+                       model.M * (model.import_rate[i] * model.charge[i]) for i in model.time_horizon_range) - \
+                model.degradation_cost_expression() + model.availability_revenue_expression()
+
+    def availability_revenue_expression(self):
+        """
+        :return: Availability revenue of the horizon (£), 0 unless add_ancillary_services was called
+        """
+        if self.service_names is None:
+            return 0
+        return sum(self.M * self.availability_price[s, i] * self.availability[s, self.period_block[i - 1]]
+                   for s in self.services for i in self.time_horizon_range)
+
+    def add_ancillary_services(self, services: dict, availability_prices: dict, settlement_blocks: np.ndarray):
+        """
+        Stack availability in frequency response or reserve services on top of the arbitrage, see
+        tools.ancillary_services. The availability of a service is held for a whole settlement block (e.g. a 4-hour
+        EFA block) and paid per MW and hour. In every period of the block the contracted MW must fit in the power
+        headroom the energy dispatch leaves in the direction of the service, and the SoC must hold the energy to
+        deliver it for the service's duration. The model grows by one variable per service and block and four
+        constraints per period, however many services are stacked.
+        :param services: Mapping of service name to its specification: direction ("up", "down" or "both"),
+                         duration of full delivery in hours and an optional max_volume in MW
+        :param availability_prices: Mapping of service name to its availability price of every period (£/MW/h)
+        :param settlement_blocks: Settlement block of every period, non-decreasing
+        :return:
+        """
+
+        if self.backend == "matrix":
+            self.matrix_model.add_ancillary_services(services, availability_prices, settlement_blocks)
+            self.service_names = self.matrix_model.service_names
+            return
+
+        self.service_names = list(services)
+        _, self.period_block = np.unique(settlement_blocks, return_inverse=True)
+        up, down = service_directions(services)
+        up_limit = min(self.dis_p, self.export_grid_lim)
+        down_limit = min(self.charge_p, self.import_grid_lim)
+        max_volume = dict(zip(self.service_names, max_service_volumes(services, up_limit, down_limit).tolist()))
+        up_energy = {name: services[name]["duration"] / self.discharge_eff
+                     for name, flag in zip(self.service_names, up) if flag}
+        down_energy = {name: services[name]["duration"] * self.charge_eff
+                       for name, flag in zip(self.service_names, down) if flag}
+
+        self.services = Set(initialize=self.service_names)
+        self.settlement_blocks = Set(initialize=range(self.period_block[-1] + 1))
+        self.availability_price = Param(self.services, self.time_horizon_range,
+                                        initialize=self._availability_values(availability_prices),
+                                        mutable=self.persistent)
+        self.availability = Var(self.services, self.settlement_blocks,
+                                bounds=lambda model, s, b: (0, max_volume[s]))
+
+        def block_availability(model, i, weights):
+            return sum(weight * model.availability[s, self.period_block[i - 1]] for s, weight in weights.items())
+
+        @self.Constraint(self.time_horizon_range)
+        def up_headroom_constraint(model, i):
+            return model.discharge[i] - model.charge[i] + \
+                block_availability(model, i, dict.fromkeys(up_energy, 1)) <= up_limit
+
+        @self.Constraint(self.time_horizon_range)
+        def down_headroom_constraint(model, i):
+            return model.charge[i] - model.discharge[i] + \
+                block_availability(model, i, dict.fromkeys(down_energy, 1)) <= down_limit
+
+        @self.Constraint(self.time_horizon_range)
+        def up_energy_reserve_constraint(model, i):
+            return model.LevelofEnergy[i] - block_availability(model, i, up_energy) >= model.battery_cap * model.min_soc
+
+        @self.Constraint(self.time_horizon_range)
+        def down_energy_reserve_constraint(model, i):
+            return model.LevelofEnergy[i] + block_availability(model, i, down_energy) <= \
+                model.battery_cap * model.max_soc
+
+        # The objective is rebuilt with the availability term if it was already added
+        if hasattr(self, "obj_function"):
+            self.del_component(self.obj_function)
+            self.add_objective_function(cycle_penalty=self.cycle_penalty)
+
+    def _availability_values(self, availability_prices: dict) -> dict:
+        """
+        :param availability_prices: Mapping of service name to its availability price of every period (£/MW/h)
+        :return: Prices keyed by (service, period) like the availability_price param
+        """
+        return {(name, i): price for name in self.service_names
+                for i, price in self._period_values(availability_prices[name]).items()}
+
+    def degradation_cost_expression(self):
+        """
+        :return: Degradation cost of the horizon (£), 0 unless add_degradation_cost was called
+        """
+        if self.segment_costs is None:
+            return 0
+        return sum(self.M * self.segment_costs[k] * self.segment_discharge[k, i]
+                   for k in self.segments for i in self.time_horizon_range)
+
+    def add_degradation_cost(self, segment_costs: np.ndarray):
+        """
+        Charge a depth-of-discharge dependent cost per MWh discharged, see tools.degradation for the cost curve. The
+        capacity is split into equal SoC segments with their own energy, charge and discharge variables, and every MWh
+        discharged from a segment costs that segment's price. Deeper segments must cost more (a convex curve), then
+        the cheapest segments are always used first without any extra binaries, so the model only grows by three
+        variables and one constraint per segment and period. Charging may top up any segment, so this segment model
+        can cost a dispatch less than the SoC band model of the dp backend, see DynamicProgrammingBattery.
+        :param segment_costs: Cost per MWh discharged from each segment (£/MWh), from the bottom segment up
+        :return:
+        """
+
+        check_segment_costs(segment_costs)
+
+        if self.backend == "matrix":
+            self.matrix_model.add_degradation_cost(segment_costs)
+            return
+
+        self.segment_costs = [float(cost) for cost in segment_costs]
+        self.segment_size = self.battery_cap / len(segment_costs)
+        self.segments = Set(initialize=range(len(segment_costs)))
+        self.segment_initial_energy = Param(self.segments, initialize=self._segment_initial_energy(self.init_charge),
+                                            mutable=self.persistent)
+
+        self.segment_energy = Var(self.segments, self.time_horizon_range, bounds=(0, self.segment_size))
+        self.segment_charge = Var(self.segments, self.time_horizon_range, domain=NonNegativeReals)
+        self.segment_discharge = Var(self.segments, self.time_horizon_range, domain=NonNegativeReals)
+
+        @self.Constraint(self.segments, self.time_horizon_range)
+        def segment_balance_constraint(model, k, i):
+            previous = model.segment_initial_energy[k] if i == 1 else model.segment_energy[k, i - 1]
+            return model.segment_energy[k, i] == previous + \
+                model.M * (model.charge_eff * model.segment_charge[k, i] -
+                           model.segment_discharge[k, i] / model.discharge_eff)
+
+        @self.Constraint(self.time_horizon_range)
+        def segment_charge_constraint(model, i):
+            return sum(model.segment_charge[k, i] for k in model.segments) == model.charge[i]
+
+        @self.Constraint(self.time_horizon_range)
+        def segment_discharge_constraint(model, i):
+            return sum(model.segment_discharge[k, i] for k in model.segments) == model.discharge[i]
+
+        # The objective is rebuilt with the degradation term if it was already added
+        if hasattr(self, "obj_function"):
+            self.del_component(self.obj_function)
+            self.add_objective_function(cycle_penalty=self.cycle_penalty)
+
+    def _segment_initial_energy(self, init_charge: float | int) -> dict:
+        """
+        :return: Initial energy of every segment, the initial energy fills the segments from the bottom up
+        """
+        return {k: min(max(init_charge - k * self.segment_size, 0), self.segment_size) for k in self.segments}
 
     def add_max_cycles_constraint(self, max_daily_cycles: float | int, max_discharge: float | int = None):
         """
@@ -86,6 +313,10 @@ class Battery(ConcreteModel):
         :return:
         """
 
+        if self.backend == "matrix":
+            self.matrix_model.add_max_cycles_constraint(max_daily_cycles, max_discharge)
+            return
+
         @self.Constraint()
         def max_daily_discharge_constraint(model):
             # Maximum discharge throughput constraint. The sum of all discharge flow within a day cannot exceed this
@@ -94,12 +325,53 @@ class Battery(ConcreteModel):
                 return model.M * sum(model.discharge[i] for i in model.time_horizon_range) <= max_discharge
             return model.M * sum(model.discharge[i] for i in model.time_horizon_range) <= max_daily_cycles * self.battery_cap
 
+    def add_block_cycles_constraint(self, block_periods: int, max_discharge: float | int):
+        """
+        Cap the throughput of every consecutive block of periods in the horizon, e.g. of every day in a receding-horizon
+        window, so the committed periods keep to the same cycle budget as a fixed window of that length and the
+        lookahead periods can't promise more throughput than they will be allowed once committed
+        :param block_periods: Number of periods in a block, a shorter last block gets a pro rata limit
+        :param max_discharge: Discharge throughput limit of a full block in MWh
+        :return:
+        """
+
+        if self.backend == "matrix":
+            self.matrix_model.add_block_cycles_constraint(block_periods, max_discharge)
+            return
+
+        periods = list(self.time_horizon_range)
+        blocks = [periods[start:start + block_periods] for start in range(0, len(periods), block_periods)]
+
+        @self.Constraint(range(len(blocks)))
+        def block_discharge_constraint(model, b):
+            return model.M * sum(model.discharge[i] for i in blocks[b]) <= \
+                max_discharge * len(blocks[b]) / block_periods
+
+    def add_terminal_soc_constraint(self, final_charge: float | int):
+        """
+        Fix the energy level at the end of the horizon so independently solved blocks can be stitched together
+        :param final_charge: Required energy level in the final period (MWh)
+        :return:
+        """
+
+        if self.backend == "matrix":
+            self.matrix_model.add_terminal_soc_constraint(final_charge)
+            return
+
+        @self.Constraint()
+        def terminal_soc_constraint(model):
+            return model.LevelofEnergy[model.time_horizon_range.last()] == final_charge
+
     def add_storage_constraints(self):
         """
         This function adds all the general storage constraints
         :return:
         """
 
+        if self.backend == "matrix":
+            self.matrix_model.add_storage_constraints()
+            return
+
         # Grid import constraint
         @self.Constraint(self.time_horizon_range)
         def grid_import_constraint(model, i):
@@ -144,47 +416,238 @@ class Battery(ConcreteModel):
         def soc_balance_constraint(model, i):
             # Initial soc set at 50%
             if i == 1:
-                return model.LevelofEnergy[i] == model.init_charge + \
+                return model.LevelofEnergy[i] == model.initial_energy + \
                     model.M * (model.charge_eff * model.charge[i] - model.discharge[i] / model.discharge_eff)
             return model.LevelofEnergy[i] == model.LevelofEnergy[i - 1] + \
                 model.M * (model.charge_eff * model.charge[i] - model.discharge[i] / model.discharge_eff)
 
-    def solve_problem(self, solver_selection, day_count, mip_rel_gap, time_limit):
+    def update_horizon(self, import_rate: pd.Series | np.ndarray, export_rate: pd.Series | np.ndarray,
+                       init_charge: float | int, availability_prices: dict | None = None):
+        """
+        Update the prices and initial SoC in place so the already built model can be solved for the next horizon
+        :param import_rate: Import prices for the new horizon in period order
+        :param export_rate: Export prices for the new horizon in period order
+        :param init_charge: Energy level at the start of the new horizon (MWh)
+        :param availability_prices: Availability prices of every service for the new horizon, its settlement blocks
+                                    must line up with the periods as they did when the services were added
+        :return:
+        """
+        if len(import_rate) != self.n_periods:
+            raise ValueError(f"The model was built for {self.n_periods} periods, got {len(import_rate)}")
+
+        self.init_charge = init_charge
+
+        if self.backend == "matrix":
+            self.matrix_model.update_horizon(import_rate=import_rate, export_rate=export_rate,
+                                             init_charge=init_charge, availability_prices=availability_prices)
+            return
 
-        # Solve the optimization problem
-        executable = None
+        if not self.persistent:
+            raise ValueError("update_horizon requires the model to be built with persistent=True")
 
+        self.import_rate.store_values(self._period_values(import_rate))
+        self.export_rate.store_values(self._period_values(export_rate))
+        self.initial_energy.set_value(init_charge)
+        if self.segment_costs is not None:
+            self.segment_initial_energy.store_values(self._segment_initial_energy(init_charge))
+        if availability_prices is not None and self.service_names is not None:
+            self.availability_price.store_values(self._availability_values(availability_prices))
+
+    def shift_solution(self, periods: int):
+        """
+        Move the solved values forward by a number of periods so they can warm start the next overlapping horizon.
+        The freed periods at the end are left idle at the last energy level.
+        :param periods: Number of periods the horizon rolls forward by
+        :return:
+        """
+        if self.backend == "matrix":
+            # scipy.optimize.milp takes no MIP start, so there is nothing to carry over
+            return
+
+        for component, fill in ((self.LevelofEnergy, None), (self.charge, 0.0), (self.discharge, 0.0),
+                                (self.charge_bool, 0.0), (self.discharge_bool, 0.0)):
+            values = self._component_values(component)
+            if np.isnan(values).any():
+                return
+            shifted = np.r_[values[periods:], np.full(min(periods, len(values)),
+                                                      values[-1] if fill is None else fill)]
+            component.set_values(dict(zip(self.time_horizon_range, shifted.tolist())))
+
+    def _solve_persistent(self, solver_selection, mip_rel_gap, time_limit, threads):
+        """
+        Solve through a persistent solver interface, the model is only sent to the solver on the first call and
+        later calls only re-send the parts that depend on the updated params
+        :return: Pyomo results object
+        """
         if solver_selection == "cbc":
-            if day_count == 1:
-                executable = os.path.join(os.getcwd(), "solvers", "cbc.exe").replace("\\", "/")
-                # Check if the executable exists and is executable
-                if not os.path.exists(executable):
-                    print(f"Solver executable {executable} does not exist.")
-                elif not os.access(executable, os.X_OK):
-                    print(f"Solver executable {executable} is not executable.")
-            solver = SolverFactory("cbc",
-                                   executable=executable,
-                                   options={
-                                       'ratio': mip_rel_gap,
-                                       'sec': time_limit,
-                                   })
-        if solver_selection == "cplex":
-            if day_count == 1:
-                executable = os.path.join(os.getcwd(), "cplex.exe").replace("\\", "/")
-                # Check if the executable exists and is executable
-                if not os.path.exists(executable):
-                    print(f"Solver executable {executable} does not exist.")
-                elif not os.access(executable, os.X_OK):
-                    print(f"Solver executable {executable} is not executable.")
-            solver = SolverFactory("cplex",
-                                   executable=executable,
-                                   options={
-                                       'mip tolerances mipgap': mip_rel_gap,
-                                       'timelimit': time_limit,
-                                   })
-
-        results = solver.solve(self, tee=False)
+            # CBC has no persistent interface, so only the model build is reused and the previous solution is
+            # passed in as a warm start
+            solver = pyomo_solver("cbc", mip_rel_gap, time_limit, threads)
+            return solver.solve(self, tee=False, warmstart=self._horizons_solved > 0)
+
+        if solver_selection not in PERSISTENT_SOLVERS:
+            raise ValueError(f"No persistent interface for solver '{solver_selection}'")
+
+        solver = self._persistent_solver
+
+        if solver_selection == "highs":
+            # APPSI tracks mutable params itself and re-uses the loaded HiGHS model
+            if solver is None:
+                # The registry's HiGHS solver is already the APPSI interface
+                solver = pyomo_solver("highs", mip_rel_gap, time_limit, threads)
+                self._persistent_solver = solver
+            return solver.solve(self)
+
+        if solver is None:
+            solver = SolverFactory(PERSISTENT_SOLVERS[solver_selection])
+            solver.set_instance(self)
+            solver.options["mip_tolerances_mipgap"] = mip_rel_gap
+            solver.options["timelimit"] = time_limit
+            if threads:
+                solver.options["threads"] = threads
+            self._persistent_solver = solver
+            return solver.solve(tee=False)
+
+        # The objective and the first SoC balance hold the updated params, so only those are re-sent
+        solver.set_objective(self.obj_function)
+        solver.remove_constraint(self.soc_balance_constraint[1])
+        solver.add_constraint(self.soc_balance_constraint[1])
+        if self.segment_costs is not None:
+            for k in self.segments:
+                solver.remove_constraint(self.segment_balance_constraint[k, 1])
+                solver.add_constraint(self.segment_balance_constraint[k, 1])
+
+        # Warm start from the previous horizon's solution still held in the variables
+        return solver.solve(tee=False, warmstart=True)
+
+    def solve_problem(self, solver_selection, day_count, mip_rel_gap, time_limit, threads: int | None = None):
+        """
+        Solve the model and record the solve metrics in self.metrics: solver, termination, solve_time_s, objective,
+        mip_gap, n_variables, n_constraints and n_binaries
+        :param solver_selection: Solver name from the registry in solvers.py, the matrix backend uses its in-memory
+                                 solvers and falls back to scipy's milp for the Pyomo-only names. None picks the
+                                 backend's default solver
+        :param threads: Number of solver threads, the solver's default if None
+        """
+        tic = time.perf_counter()
+
+        if self.backend == "matrix":
+            # The coefficient matrices are passed in memory, so no model file is written
+            self.matrix_model.solve_problem(mip_rel_gap=mip_rel_gap, time_limit=time_limit,
+                                            relax_binaries=self.relax_binaries, solver=solver_selection,
+                                            threads=threads)
+            self.binary_periods = self.matrix_model.binary_periods
+            self.metrics = {"solve_time_s": time.perf_counter() - tic, **self.matrix_model.metrics}
+            return
+
+        solver_selection = solver_selection or DEFAULT_PYOMO_SOLVER
+        if self.relax_binaries:
+            results, relaxation_rounds = self._solve_relaxed(solver_selection, mip_rel_gap, time_limit, threads)
+        else:
+            self.binary_periods = np.ones(self.n_periods, dtype=bool)
+            results, relaxation_rounds = self._solve_once(solver_selection, mip_rel_gap, time_limit, threads), None
+            self._log_termination(results)
 
+        self.metrics = {"solve_time_s": time.perf_counter() - tic, "solver": solver_selection,
+                        **self._solve_metrics(results)}
+        if relaxation_rounds is not None:
+            self.metrics["relaxation_rounds"] = relaxation_rounds
+
+    def _solve_metrics(self, results) -> dict:
+        """
+        :param results: Pyomo results object of the last solve
+        :return: Dictionary of the termination condition, objective, MIP gap reached and model size
+        """
+        # The solver reports both bounds, the gap is relative to the incumbent like the mip_rel_gap option
+        try:
+            upper = float(results.problem.upper_bound)
+            lower = float(results.problem.lower_bound)
+            mip_gap = abs(upper - lower) / max(abs(upper), abs(lower), 1e-10)
+            if not math.isfinite(mip_gap):
+                mip_gap = None
+        except (AttributeError, TypeError, ValueError):
+            mip_gap = None
+
+        return {"termination": str(results.solver.termination_condition),
+                "objective": value(self.obj_function, exception=False),
+                "mip_gap": mip_gap,
+                "n_variables": self.nvariables(),
+                "n_constraints": self.nconstraints(),
+                "n_binaries": 2 * int(self.binary_periods.sum()),
+                **({"degradation_cost": value(self.degradation_cost_expression(), exception=False),
+                    "degradation_model": "segment"} if self.segment_costs is not None else {}),
+                **({"availability_revenue": value(self.availability_revenue_expression(), exception=False)}
+                   if self.service_names is not None else {}),
+                }
+
+    def _solve_relaxed(self, solver_selection, mip_rel_gap, time_limit, threads):
+        """
+        Solve the pure LP, then bring back the binaries of any period that charges and discharges at the same time
+        and re-solve until there are none
+        :return: Pyomo results object of the last solve and the number of solves
+        """
+        binary_periods = np.zeros(self.n_periods, dtype=bool)
+        relaxation_rounds = 0
+        while True:
+            relaxation_rounds += 1
+            self._set_binary_periods(binary_periods)
+            results = self._solve_once(solver_selection, mip_rel_gap, time_limit, threads)
+            self._log_termination(results)
+
+            simultaneous = (self._component_values(self.charge) > DISPATCH_TOLERANCE) & \
+                           (self._component_values(self.discharge) > DISPATCH_TOLERANCE) & ~binary_periods
+            if not simultaneous.any():
+                return results, relaxation_rounds
+
+            logging.info(f"{simultaneous.sum()} periods charge and discharge at the same time, re-solving with "
+                         f"their binaries")
+            binary_periods = binary_periods | simultaneous
+
+    def _set_binary_periods(self, binary_periods: np.ndarray):
+        """
+        Enforce the binaries only in the given periods. Elsewhere both bools are pinned at 1 and the constraints that
+        keep charging and discharging apart are deactivated, which leaves just the power ratings.
+        :param binary_periods: Boolean mask of the periods that keep their binaries
+        :return:
+        """
+        if self.binary_periods is not None and np.array_equal(binary_periods, self.binary_periods):
+            return
+
+        exclusive_constraints = (self.power_bool_constraint, self.max_charging_power_2, self.max_discharging_power_2)
+        for i, binary in zip(self.time_horizon_range, binary_periods):
+            for constraint in exclusive_constraints:
+                constraint[i].activate() if binary else constraint[i].deactivate()
+            # A lower bound of 1 pins the bool without fixing it, so the solver keeps it as an integer column
+            for bool_var in (self.charge_bool, self.discharge_bool):
+                bool_var[i].setlb(0 if binary else 1)
+
+        # APPSI picks up bound changes and deactivated constraints by itself, the older persistent interfaces are
+        # sent the model again
+        if isinstance(self._persistent_solver, PersistentSolver):
+            self._persistent_solver = None
+
+        self.binary_periods = binary_periods
+
+    def _solve_once(self, solver_selection, mip_rel_gap, time_limit, threads):
+        """
+        :return: Pyomo results object
+        """
+        if self.persistent:
+            results = self._solve_persistent(solver_selection, mip_rel_gap, time_limit, threads)
+            self._horizons_solved += 1
+            return results
+
+        # The registry finds the executable of file-based solvers once per process, "highs" is solved in-process
+        solver = pyomo_solver(solver_selection, mip_rel_gap, time_limit, threads)
+        return solver.solve(self, tee=False)
+
+    @staticmethod
+    def _log_termination(results):
+        """
+        Show a warning if an optimal solution was not found
+        :param results: Pyomo results object
+        :return:
+        """
         # Show a warning if an optimal solution was not found
         if (results.solver.status == SolverStatus.ok) and (results.solver.termination_condition ==
                                                            TerminationCondition.optimal):
@@ -195,28 +658,134 @@ class Battery(ConcreteModel):
             logging.info("Status = %s" % results.solver.termination_condition)
             # print(str(results.solver))
 
-    def collect_opt_results(self):
+    def collect_opt_columns(self) -> dict:
+        """
+        Pull the solved values out in bulk and build every result column as a NumPy array
+        :return: Dictionary of result column name to array, one element per period
+        """
+
+        if self.backend == "matrix":
+            matrix_model = self.matrix_model
+            # Round the relaxed integer values returned by HiGHS back to exact 0/1
+            return build_result_columns(charge=matrix_model.variable_values(CHARGE),
+                                        discharge=matrix_model.variable_values(DISCHARGE),
+                                        charge_bool=np.round(matrix_model.variable_values(CHARGE_BOOL)),
+                                        discharge_bool=np.round(matrix_model.variable_values(DISCHARGE_BOOL)),
+                                        energy=matrix_model.variable_values(ENERGY),
+                                        import_rate=matrix_model.import_rate,
+                                        export_rate=matrix_model.export_rate,
+                                        battery_cap=self.battery_cap,
+                                        M=self.M,
+                                        availability=None if self.service_names is None else
+                                        dict(zip(self.service_names, zip(matrix_model.availability_values(),
+                                                                         matrix_model.availability_price))))
+
+        charge = self._component_values(self.charge)
+        discharge = self._component_values(self.discharge)
+        charge_bool = self._component_values(self.charge_bool)
+        discharge_bool = self._component_values(self.discharge_bool)
+
+        # The bools of the periods solved as an LP were pinned at 1, so report them from the dispatch
+        relaxed = ~self.binary_periods
+        charge_bool[relaxed] = charge[relaxed] > DISPATCH_TOLERANCE
+        discharge_bool[relaxed] = discharge[relaxed] > DISPATCH_TOLERANCE
+
+        return build_result_columns(charge=charge,
+                                    discharge=discharge,
+                                    charge_bool=charge_bool,
+                                    discharge_bool=discharge_bool,
+                                    energy=self._component_values(self.LevelofEnergy),
+                                    import_rate=self._component_values(self.import_rate),
+                                    export_rate=self._component_values(self.export_rate),
+                                    battery_cap=self.battery_cap,
+                                    M=self.M,
+                                    availability=self._availability_columns())
+
+    def _availability_columns(self) -> dict | None:
+        """
+        :return: Mapping of service name to its solved availability and availability price of every period, None
+                 without ancillary services
+        """
+        if self.service_names is None:
+            return None
+        n_blocks = len(self.settlement_blocks)
+        availability = np.fromiter((value(v) if v is not None else np.nan
+                                    for v in self.availability.extract_values().values()),
+                                   dtype=np.float64, count=len(self.service_names) * n_blocks)
+        prices = np.fromiter((value(v) for v in self.availability_price.extract_values().values()),
+                             dtype=np.float64, count=len(self.service_names) * self.n_periods)
+        return {name: (block_values[self.period_block], period_prices) for name, block_values, period_prices in
+                zip(self.service_names, availability.reshape(-1, n_blocks), prices.reshape(-1, self.n_periods))}
+
+    def _period_values(self, values: pd.Series | np.ndarray) -> dict:
+        """
+        :param values: One value per period in period order
+        :return: Values keyed by the 1..T period index of the Pyomo components
+        """
+        return dict(zip(range(1, self.n_periods + 1), np.asarray(values, dtype=np.float64).tolist()))
+
+    def _component_values(self, component) -> np.ndarray:
+        """
+        :param component: Indexed Pyomo variable or param
+        :return: Values in index order, value() resolves params whether or not they are mutable
+        """
+        return np.fromiter((value(v) if v is not None else np.nan for v in component.extract_values().values()),
+                           dtype=np.float64, count=self.n_periods)
 
-        record_list = []
-        SOC_tracker = []
-
-        for i in self.time_horizon_range:
-            record = {"DC Charging power (MW)": self.charge[i].value,
-                      "DC Discharging power (MW)": self.discharge[i].value,
-                      "Charge Bool": self.charge_bool[i].value,
-                      "Discharge Bool": self.discharge_bool[i].value,
-                      "State of Energy (MWh)": self.LevelofEnergy[i].value,
-                      "State of Charge (%)": (self.LevelofEnergy[i].value / self.battery_cap) * 100,
-                      "Depth of Discharge (%)": (1 - self.LevelofEnergy[i].value / self.battery_cap) * 100,
-                      "Import Price (£/MWh)": self.import_rate[i],
-                      "Export Price (£/MWh)": self.export_rate[i],
-                      "Import Cost (£)": self.M * self.import_rate[i] * self.charge[i].value,
-                      "Export Value (£)": self.M * self.export_rate[i] * self.discharge[i].value,
-                      "Trading Profits (£)": self.M * ((self.export_rate[i] * self.discharge[i].value) -
-                                                       (self.import_rate[i] * self.charge[i].value)),
-                      }
-
-            record_list.append(record)
-            SOC_tracker.append(record["State of Energy (MWh)"])
-
-        return record_list, SOC_tracker
+    def collect_opt_results(self):
+        """
+        :return: record_list: List of HH result records
+                 SOC_tracker: Energy level at the end of every HH period
+        """
+        return records_from_columns(self.collect_opt_columns())
+
+
+def build_result_columns(charge: np.ndarray, discharge: np.ndarray, charge_bool: np.ndarray,
+                         discharge_bool: np.ndarray, energy: np.ndarray, import_rate: np.ndarray,
+                         export_rate: np.ndarray, battery_cap: float | int, M: float,
+                         availability: dict | None = None) -> dict:
+    """
+    Build the HH result columns from solved arrays, so every engine returns the same schema
+    :param availability: Optional mapping of service name to its (availability in MW, availability price in £/MW/h)
+                         of every period, each service adds an availability and an availability revenue column
+    :return: Dictionary of result column name to array
+    """
+    # Copied so later in-place price updates of a persistent model do not change collected results
+    import_rate = np.array(import_rate, dtype=np.float64)
+    export_rate = np.array(export_rate, dtype=np.float64)
+    import_cost = M * import_rate * charge
+    export_value = M * export_rate * discharge
+
+    columns = {"DC Charging power (MW)": charge,
+               "DC Discharging power (MW)": discharge,
+               "Charge Bool": charge_bool,
+               "Discharge Bool": discharge_bool,
+               "State of Energy (MWh)": energy,
+               "State of Charge (%)": (energy / battery_cap) * 100,
+               "Depth of Discharge (%)": (1 - energy / battery_cap) * 100,
+               "Import Price (£/MWh)": import_rate,
+               "Export Price (£/MWh)": export_rate,
+               "Import Cost (£)": import_cost,
+               "Export Value (£)": export_value,
+               "Trading Profits (£)": export_value - import_cost,
+               }
+
+    # The trading profit stays the energy arbitrage only, the services are reported next to it
+    for name, (service_availability, availability_price) in (availability or {}).items():
+        columns[f"{name} Availability (MW)"] = np.array(service_availability, dtype=np.float64)
+        columns[f"{name} Availability Revenue (£)"] = M * np.asarray(availability_price) * service_availability
+
+    return columns
+
+
+def records_from_columns(columns: dict) -> tuple[list, list]:
+    """
+    Convert result columns into the per-period records returned by collect_opt_results
+    :param columns: Dictionary of result column name to array
+    :return: record_list: List of HH result records
+             SOC_tracker: Energy level at the end of every HH period
+    """
+    names = list(columns)
+    record_list = [dict(zip(names, row)) for row in zip(*(columns[name].tolist() for name in names))]
+
+    return record_list, columns["State of Energy (MWh)"].tolist()
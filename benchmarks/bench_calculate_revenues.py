@@ -0,0 +1,51 @@
+"""
+Benchmark of tools.calculate_revenues on synthetic multi-year HH price series
+
+Run from the repository root:
+  $ python -m benchmarks.bench_calculate_revenues
+"""
+import numpy as np
+import pandas as pd
+import time
+
+from tools.calculate_revenues import calculate_revenues
+
+
+def synthetic_inputs(n_years: int, seed: int = 0) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Build a price frame shaped like the output of process_price_data and a matching optimised_df
+
+    :param n_years: Length of the series in years
+    :param seed: Random seed
+    :return: prices_df, optimised_df
+    """
+    rng = np.random.default_rng(seed)
+    time_index = pd.date_range("2016-01-01 00:00", periods=n_years * 365 * 48, freq="30T")
+    daily_shape = 20 * np.sin(2 * np.pi * (time_index.hour * 2 + time_index.minute // 30) / 48)
+
+    prices_df = pd.DataFrame({"time": time_index,
+                              "prices": 50 + daily_shape + rng.normal(0, 10, len(time_index))})
+    prices_df["day_count"] = (prices_df["time"].dt.strftime('%H:%M') == '00:00').cumsum()
+
+    optimised_df = pd.DataFrame({"datetime": time_index.astype(str),
+                                 "Trading Profits (£)": rng.normal(100, 50, len(time_index))})
+
+    return prices_df, optimised_df
+
+
+def main(year_lengths: tuple = (1, 2, 4, 8), repeats: int = 3):
+    for n_years in year_lengths:
+        prices_df, optimised_df = synthetic_inputs(n_years)
+
+        timings = []
+        for _ in range(repeats):
+            tic = time.perf_counter()
+            calculate_revenues(prices_df.copy(), optimised_df.copy(), trading_volume=100, battery_power=100,
+                               round_trip_eff=0.85)
+            timings.append(time.perf_counter() - tic)
+
+        print(f"{n_years} year(s), {len(prices_df):,} HH rows: best of {repeats} = {min(timings):.3f} seconds")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+Benchmark of every stage of the dispatch pipeline on price series of increasing length
+
+Times price cleaning, Battery construction, each add_* method, the solve, result collection and calculate_revenues
+separately, with the peak traced memory of each stage, for synthetic and bundled prices from 1 day to 8 years and a
+range of horizon sizes. The results are saved as JSON keyed by the git commit so regressions can be compared across
+commits.
+
+Run from the repository root:
+  $ python -m benchmarks.bench_pipeline
+  $ python -m benchmarks.bench_pipeline --lengths 1d 1w --horizons 1d --backend pyomo --solver highs
+  $ python -m benchmarks.bench_pipeline --compare benchmarks/results/<old>.json benchmarks/results/<new>.json
+"""
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+import tracemalloc
+import subprocess
+import platform
+import argparse
+import datetime
+import scipy
+import pyomo
+import json
+import math
+import time
+import os
+
+from battery_model import Battery
+from solvers import PYOMO_SOLVERS, MATRIX_SOLVERS
+from tools.calculate_revenues import calculate_revenues
+from tools.dispatch_runner import DEFAULT_BATTERY_PARAMS
+from tools.price_data_cleaning import process_price_data
+from tools.result_buffer import ResultBuffer
+
+# Series lengths and horizon sizes in half hours
+PERIODS = {"1d": 48, "1w": 48 * 7, "1y": 48 * 365, "8y": 48 * 365 * 8}
+
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(__file__), "results")
+
+
+class StageTimer:
+
+    def __init__(self, trace_memory: bool = True):
+        """
+        :param trace_memory: Record the peak traced memory of each stage, tracemalloc slows Pyomo down noticeably
+        """
+        self.trace_memory = trace_memory
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Time a stage, repeated stages (e.g. one per horizon) are summed and their peak memory is the maximum
+        :param name: Stage name
+        """
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+        tic = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - tic
+
+        record = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0, "peak_mb": None})
+        record["seconds"] += elapsed
+        record["calls"] += 1
+        if self.trace_memory:
+            peak_mb = (tracemalloc.get_traced_memory()[1] - start_memory) / 1e6
+            record["peak_mb"] = max(record["peak_mb"] or 0.0, peak_mb)
+
+
+def synthetic_prices(n_periods: int, seed: int = 0) -> pd.DataFrame:
+    """
+    :param n_periods: Number of HH periods
+    :param seed: Random seed
+    :return: Price frame shaped like the output of process_price_data
+    """
+    rng = np.random.default_rng(seed)
+    time_index = pd.date_range("2016-01-01 00:00", periods=n_periods, freq="30T")
+    daily_shape = 20 * np.sin(2 * np.pi * (time_index.hour * 2 + time_index.minute // 30) / 48)
+
+    prices_df = pd.DataFrame({"time": time_index,
+                              "prices": 50 + daily_shape + rng.normal(0, 10, n_periods)})
+    prices_df["day_count"] = (prices_df["time"].dt.strftime('%H:%M') == '00:00').cumsum()
+
+    return prices_df
+
+
+def run_case(prices_df: pd.DataFrame, time_horizon: int, timer: StageTimer, backend: str, solver: str,
+             relax_binaries: bool, mip_rel_gap: float = 0.0001, time_limit: float | int = 20):
+    """
+    Run the serial dispatch stage by stage, chaining the SoC between horizons like run_serial
+    :param prices_df: Price frame with "time", "prices" and "day_count" columns
+    :param time_horizon: Horizon size in half hours
+    :param timer: Timer collecting the stage timings
+    :param backend: Battery model backend, "pyomo" or "matrix"
+    :param solver: Solver name from the registry in solvers.py
+    :param relax_binaries: Solve the LP relaxation first
+    :return:
+    """
+    prices = prices_df["prices"].to_numpy(dtype=np.float64)
+    n_horizons = math.ceil(len(prices) / time_horizon)
+    results = ResultBuffer(capacity=len(prices))
+    init_charge = 0.5 * DEFAULT_BATTERY_PARAMS["battery_capacity"]
+
+    for day_count in range(1, n_horizons + 1):
+        prices_sliced = prices[(day_count - 1) * time_horizon:day_count * time_horizon]
+        price_series = pd.Series(prices_sliced, index=np.arange(1, len(prices_sliced) + 1))
+
+        with timer.stage("Battery.__init__"):
+            battery = Battery(import_rate=price_series, export_rate=price_series, init_charge=init_charge,
+                              backend=backend, relax_binaries=relax_binaries, **DEFAULT_BATTERY_PARAMS)
+        with timer.stage("add_objective_function"):
+            battery.add_objective_function()
+        with timer.stage("add_storage_constraints"):
+            battery.add_storage_constraints()
+        with timer.stage("add_max_cycles_constraint"):
+            battery.add_max_cycles_constraint(max_daily_cycles=len(prices_sliced) / 48)
+        with timer.stage("solve_problem"):
+            battery.solve_problem(solver_selection=solver, day_count=day_count, mip_rel_gap=mip_rel_gap,
+                                  time_limit=time_limit)
+        with timer.stage("collect_opt_columns"):
+            results.append(battery.collect_opt_columns())
+
+        init_charge = results.last("State of Energy (MWh)")
+
+    with timer.stage("results.to_frame"):
+        optimised_df = results.to_frame()
+        optimised_df.insert(0, "datetime", prices_df["time"].dt.strftime("%Y-%m-%d %H:%M:%S").to_numpy())
+
+    with timer.stage("calculate_revenues"):
+        calculate_revenues(prices_df.copy(), optimised_df, trading_volume=100, battery_power=100,
+                           round_trip_eff=0.85)
+
+
+def git_commit() -> tuple[str, bool]:
+    """
+    :return: Short hash of HEAD and whether the working tree has uncommitted changes
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True,
+                                    text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, dirty
+
+
+def main(lengths: list, horizons: list, sources: list, backend: str, solver: str, relax_binaries: bool,
+         trace_memory: bool, output: str | None) -> str:
+    """
+    Run every case and save the results
+
+    :return: Path of the saved JSON file
+    """
+    if trace_memory:
+        tracemalloc.start()
+
+    records = []
+
+    # Price cleaning is timed once on the bundled input file, without and with the on-disk cache
+    cleaning_timer = StageTimer(trace_memory)
+    with cleaning_timer.stage("process_price_data (uncached)"):
+        bundled_df, _ = process_price_data("input_data.csv", time_horizon=48, use_cache=False)
+    process_price_data("input_data.csv", time_horizon=48)
+    with cleaning_timer.stage("process_price_data (cached)"):
+        process_price_data("input_data.csv", time_horizon=48)
+    for stage, record in cleaning_timer.stages.items():
+        records.append({"source": "bundled", "periods": len(bundled_df), "horizon": None, "stage": stage, **record})
+
+    for source in sources:
+        for length in lengths:
+            if source == "bundled":
+                prices_df = bundled_df.iloc[:PERIODS[length]].reset_index(drop=True)
+            else:
+                prices_df = synthetic_prices(PERIODS[length])
+
+            for horizon in horizons:
+                if PERIODS[horizon] > len(prices_df):
+                    continue
+
+                timer = StageTimer(trace_memory)
+                tic = time.perf_counter()
+                run_case(prices_df, PERIODS[horizon], timer, backend=backend, solver=solver,
+                         relax_binaries=relax_binaries)
+                print(f"{source:>9} {length:>3} series, {horizon:>3} horizons: {time.perf_counter() - tic:8.2f} s")
+
+                for stage, record in timer.stages.items():
+                    records.append({"source": source, "periods": len(prices_df), "length": length,
+                                    "horizon": horizon, "stage": stage, **record})
+
+    commit, dirty = git_commit()
+    benchmark = {"commit": commit,
+                 "dirty": dirty,
+                 "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+                 "options": {"backend": backend, "solver": solver, "relax_binaries": relax_binaries,
+                             "trace_memory": trace_memory},
+                 "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                                 "cpu_count": os.cpu_count(), "numpy": np.__version__, "pandas": pd.__version__,
+                                 "scipy": scipy.__version__, "pyomo": pyomo.__version__},
+                 "records": records,
+                 }
+
+    if output is None:
+        os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+        output = os.path.join(RESULTS_DIRECTORY, f"{commit}{'-dirty' if dirty else ''}_{backend}.json")
+    with open(output, "w") as file:
+        json.dump(benchmark, file, indent=1)
+    print(f"Saved {len(records)} stage timings to {output}")
+
+    return output
+
+
+def compare(baseline_path: str, candidate_path: str) -> pd.DataFrame:
+    """
+    Compare the stage timings of two saved benchmarks
+
+    :param baseline_path: JSON file of the baseline run
+    :param candidate_path: JSON file of the candidate run
+    :return: DataFrame of the matching stages with their timings and the candidate/baseline ratio
+    """
+    keys = ["source", "periods", "horizon", "stage"]
+    frames = []
+    for label, path in (("baseline", baseline_path), ("candidate", candidate_path)):
+        with open(path) as file:
+            benchmark = json.load(file)
+        frame = pd.DataFrame(benchmark["records"])[keys + ["seconds", "peak_mb"]]
+        frame["horizon"] = frame["horizon"].fillna("-")
+        frames.append(frame.set_index(keys).add_suffix(f" {label} ({benchmark['commit']})"))
+
+    comparison_df = frames[0].join(frames[1], how="inner")
+    comparison_df["time ratio"] = comparison_df.iloc[:, 2] / comparison_df.iloc[:, 0]
+
+    return comparison_df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lengths", nargs="+", default=["1d", "1w", "1y", "8y"], choices=PERIODS)
+    parser.add_argument("--horizons", nargs="+", default=["1d", "1w", "1y"], choices=PERIODS)
+    parser.add_argument("--sources", nargs="+", default=["synthetic", "bundled"], choices=["synthetic", "bundled"])
+    parser.add_argument("--backend", default="matrix", choices=["matrix", "pyomo"])
+    parser.add_argument("--solver", default="highs", choices=sorted(PYOMO_SOLVERS | MATRIX_SOLVERS),
+                        help="Solver from solvers.py, the matrix backend runs the Pyomo-only names with scipy")
+    parser.add_argument("--relax-binaries", action="store_true")
+    parser.add_argument("--no-memory", action="store_true", help="Skip tracemalloc for undisturbed timings")
+    parser.add_argument("--output", help="JSON file to write, defaults to benchmarks/results/<commit>_<backend>.json")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"))
+    args = parser.parse_args()
+
+    if args.compare:
+        with pd.option_context("display.max_rows", None, "display.width", 200):
+            print(compare(*args.compare))
+    else:
+        main(lengths=args.lengths, horizons=args.horizons, sources=args.sources, backend=args.backend,
+             solver=args.solver, relax_binaries=args.relax_binaries, trace_memory=not args.no_memory,
+             output=args.output)
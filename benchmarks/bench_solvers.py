@@ -0,0 +1,107 @@
+"""
+Benchmark of the build and solve time of every backend and solver available here
+
+Every backend/solver combination from solvers.available_solvers() dispatches the same price series through
+run_serial, once rebuilding the model for every horizon and once through the persistent update path. The build and
+solve time of each run are summed from its horizon telemetry, next to the total profit so that a faster solver that
+lands on a different optimum stands out. The results are saved as CSV keyed by the git commit.
+
+Run from the repository root:
+  $ python -m benchmarks.bench_solvers
+  $ python -m benchmarks.bench_solvers --length 1y --horizon 1w --threads 1 --relax-binaries
+"""
+import pandas as pd
+import argparse
+import time
+import os
+
+from benchmarks.bench_pipeline import PERIODS, RESULTS_DIRECTORY, git_commit, synthetic_prices
+from solvers import available_solvers
+from tools.dispatch_runner import run_serial, DEFAULT_BATTERY_PARAMS
+from tools.price_data_cleaning import process_price_data
+from tools.telemetry import HorizonTelemetry
+
+
+def run_solver(prices_df: pd.DataFrame, time_horizon: int, backend: str, solver: str, persistent: bool,
+               relax_binaries: bool, threads: int | None, mip_rel_gap: float = 0.0001,
+               time_limit: float | int = 20) -> dict:
+    """
+    :param prices_df: Price frame with "time" and "prices" columns
+    :param time_horizon: Horizon size in half hours
+    :param backend: Battery model backend, "pyomo" or "matrix"
+    :param solver: Solver name from the registry in solvers.py
+    :param persistent: Update the model in place between horizons instead of rebuilding it
+    :param relax_binaries: Solve the LP relaxation first
+    :param threads: Number of solver threads, the solver's default if None
+    :return: Summed build and solve time of the run with its total profit
+    """
+    telemetry = HorizonTelemetry(live_summary=False)
+    tic = time.perf_counter()
+    results = run_serial(prices_df["prices"].to_numpy(), time_horizon=time_horizon,
+                         cycles_per_time_horizon=time_horizon / 48,
+                         init_charge=0.5 * DEFAULT_BATTERY_PARAMS["battery_capacity"],
+                         battery_params=DEFAULT_BATTERY_PARAMS, persistent=persistent, solver_selection=solver,
+                         mip_rel_gap=mip_rel_gap, time_limit=time_limit, backend=backend,
+                         relax_binaries=relax_binaries, telemetry=telemetry, threads=threads)
+    total_time = time.perf_counter() - tic
+
+    records = pd.DataFrame(telemetry.records)
+    return {"backend": backend,
+            "solver": solver,
+            "persistent": persistent,
+            "horizons": len(records),
+            "build_time_s": records["build_time_s"].sum(),
+            "solve_time_s": records["solve_time_s"].sum(),
+            "total_time_s": total_time,
+            "objective": records["objective"].sum(),
+            "profit": results["Trading Profits (£)"].sum(),
+            }
+
+
+def main(length: str, horizon: str, source: str, relax_binaries: bool, threads: int | None,
+         output: str | None) -> pd.DataFrame:
+    """
+    Run every available backend and solver and save the results
+
+    :return: DataFrame of one row per run
+    """
+    if source == "bundled":
+        prices_df, _ = process_price_data("input_data.csv", time_horizon=48)
+        prices_df = prices_df.iloc[:PERIODS[length]].reset_index(drop=True)
+    else:
+        prices_df = synthetic_prices(PERIODS[length])
+
+    rows = []
+    for backend, solvers in available_solvers().items():
+        for solver in solvers:
+            for persistent in (False, True):
+                row = run_solver(prices_df, PERIODS[horizon], backend=backend, solver=solver, persistent=persistent,
+                                 relax_binaries=relax_binaries, threads=threads)
+                print(f"{backend:>6} {solver:>6} {'persistent' if persistent else 'rebuilt':>10}: "
+                      f"build {row['build_time_s']:7.2f} s, solve {row['solve_time_s']:7.2f} s, "
+                      f"profit £{row['profit']:,.0f}")
+                rows.append(row)
+
+    benchmark_df = pd.DataFrame(rows)
+    commit, dirty = git_commit()
+    if output is None:
+        os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+        output = os.path.join(RESULTS_DIRECTORY, f"{commit}{'-dirty' if dirty else ''}_solvers_{source}_{length}.csv")
+    benchmark_df.to_csv(output, index=False)
+    print(f"Saved {len(rows)} solver runs to {output}")
+
+    return benchmark_df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--length", default="1w", choices=PERIODS)
+    parser.add_argument("--horizon", default="1d", choices=PERIODS)
+    parser.add_argument("--source", default="synthetic", choices=["synthetic", "bundled"])
+    parser.add_argument("--relax-binaries", action="store_true")
+    parser.add_argument("--threads", type=int, help="Number of solver threads, the solver's default if not given")
+    parser.add_argument("--output", help="CSV file to write, defaults to benchmarks/results/<commit>_solvers_*.csv")
+    args = parser.parse_args()
+
+    main(length=args.length, horizon=args.horizon, source=args.source, relax_binaries=args.relax_binaries,
+         threads=args.threads, output=args.output)
@@ -0,0 +1,345 @@
+"""
+Dynamic programming dispatch engine for the single battery arbitrage problem.
+
+The battery has a single state (its energy level), so the optimal dispatch can be found by discretising the energy
+level and running a backward dynamic program over the horizon, with no MILP solver needed. Every transition between
+two energy levels is either a charge or a discharge, so charging and discharging can never happen at the same time.
+
+The cycle cap couples all periods together, so it is handled with a Lagrangian penalty per MWh discharged. The
+penalty is found by bisection so the discharge throughput sits just inside the cap. Without a binding cap the dispatch
+is optimal on the energy grid. With one, the throughput can only move in steps as the penalty changes, so the
+bisection may have to stop short of the cap: the dispatch is then only feasible, and the Lagrangian dual bound of the
+passes gives its gap like a MIP gap.
+
+The degradation cost is the SoC band model ("soc_band" in the metrics), not the segment model of the other backends,
+see add_degradation_cost.
+"""
+import numpy as np
+import pandas as pd
+import logging
+import time
+
+from battery_model import build_result_columns, records_from_columns
+from matrix_model import BatteryMatrixModel, check_segment_costs
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class DynamicProgrammingBattery:
+
+    def __init__(self, battery_capacity: float | int,
+                 discharge_power: float | int,
+                 charge_power: float | int,
+                 charging_eff: float,
+                 discharging_eff: float,
+                 import_grid_lim: float | int,
+                 export_grid_lim: float | int,
+                 import_rate: pd.Series | np.ndarray,
+                 export_rate: pd.Series | np.ndarray,
+                 min_soc: float | int,
+                 max_soc: float | int,
+                 init_charge: float | int,
+                 soc_resolution: float = 1.0,
+                 interval_length: float = 0.5,
+                 ):
+        """
+        :param soc_resolution: Size of an energy level step in MWh, a finer grid gets closer to the MILP optimum at
+                               the cost of run time (which grows with the square of the number of levels)
+        :param interval_length: Duration of a dispatch period in hours, e.g. 0.25 for a 15-minute market
+        """
+
+        self.battery_cap = battery_capacity
+        self.dis_p = discharge_power
+        self.charge_p = charge_power
+        self.charge_eff = charging_eff
+        self.discharge_eff = discharging_eff
+        self.import_grid_lim = import_grid_lim
+        self.export_grid_lim = export_grid_lim
+        self.min_soc = min_soc
+        self.max_soc = max_soc
+        self.init_charge = init_charge
+
+        # Duration of a market dispatch time interval
+        self.M = interval_length  # 1 = 1 hour, 0.5 = 30min, 0.25 = 15 min
+
+        self.import_rate = np.array(import_rate, dtype=np.float64)
+        self.export_rate = np.array(export_rate, dtype=np.float64)
+        self.n_periods = len(self.import_rate)
+
+        # Discretised energy levels (MWh)
+        n_levels = int(round(battery_capacity * (max_soc - min_soc) / soc_resolution)) + 1
+        self.levels = np.linspace(battery_capacity * min_soc, battery_capacity * max_soc, n_levels)
+
+        # Charge and discharge power needed to move from level i (rows) to level j (columns)
+        energy_change = self.levels[None, :] - self.levels[:, None]
+        self.charge_power = np.where(energy_change > 0, energy_change / (self.M * charging_eff), 0.0)
+        self.discharge_power = np.where(energy_change < 0, -energy_change * discharging_eff / self.M, 0.0)
+
+        # Transitions that break the power rating or the grid limits are never allowed
+        self.feasible = (self.charge_power <= min(charge_power, import_grid_lim) + 1e-9) & \
+                        (self.discharge_power <= min(discharge_power, export_grid_lim) + 1e-9)
+
+        self.max_discharge = None
+        self.final_charge = None
+        self.cycle_penalty = 0.0
+        # Penalty the bisection settled on for the last solve, the user's cycle_penalty is kept as its starting point
+        self.tuned_penalty = None
+        # Degradation cost (£) of moving from level i (rows) to level j (columns), set by add_degradation_cost
+        self.degradation_cost = None
+        self.path = None
+        self.metrics = {}
+
+    def add_objective_function(self, cycle_penalty: float = 0.0):
+        """
+        The trading profit is evaluated directly inside the dynamic program
+        :param cycle_penalty: Optional penalty per MWh discharged (£/MWh)
+        :return:
+        """
+        self.cycle_penalty = cycle_penalty
+
+    def add_storage_constraints(self):
+        # Power, grid and SoC limits are built into the feasible transitions between energy levels
+        pass
+
+    def add_max_cycles_constraint(self, max_daily_cycles: float | int, max_discharge: float | int = None):
+        """
+        :param max_daily_cycles: Number of full cycles allowed within the time horizon
+        :param max_discharge: Optional override of the discharge throughput limit in MWh
+        :return:
+        """
+        self.max_discharge = max_discharge if max_discharge else max_daily_cycles * self.battery_cap
+
+    def add_degradation_cost(self, segment_costs: np.ndarray):
+        """
+        Price every discharge transition by the SoC bands it physically passes through, with the band costs of
+        Battery.add_degradation_cost. This SoC band model is stricter than the segment model of the pyomo and matrix
+        backends, where charging may refill any segment so energy held low in the battery can still be discharged
+        from the cheap top segment. The same dispatch therefore costs at least as much here, and the metrics name the
+        model ("soc_band" against "segment") next to the cost. The single energy level state cannot track how the
+        energy is spread over the segments, so the segment model does not fit the dynamic program.
+        :param segment_costs: Cost per MWh discharged from each SoC band (£/MWh), from the bottom band up
+        :return:
+        """
+        check_segment_costs(segment_costs)
+
+        segment_costs = np.asarray(segment_costs, dtype=np.float64)
+        segment_size = self.battery_cap / len(segment_costs)
+        bottoms = np.arange(len(segment_costs)) * segment_size
+
+        # Energy taken out of each segment when discharging from level i down to level j
+        upper = self.levels[:, None, None]
+        lower = self.levels[None, :, None]
+        overlap = np.clip(np.minimum(upper, bottoms + segment_size) - np.maximum(lower, bottoms), 0, None)
+
+        # Costs are per MWh delivered, which is the energy taken out times the discharging efficiency
+        self.degradation_cost = (overlap * self.discharge_eff) @ segment_costs
+
+    def add_terminal_soc_constraint(self, final_charge: float | int):
+        """
+        :param final_charge: Required energy level in the final period (MWh), snapped to the nearest level
+        :return:
+        """
+        self.final_charge = final_charge
+
+    def update_horizon(self, import_rate: pd.Series | np.ndarray, export_rate: pd.Series | np.ndarray,
+                       init_charge: float | int):
+        """
+        :param import_rate: Import prices for the new horizon
+        :param export_rate: Export prices for the new horizon
+        :param init_charge: Energy level at the start of the new horizon (MWh)
+        :return:
+        """
+        if len(import_rate) != self.n_periods:
+            raise ValueError(f"The model was built for {self.n_periods} periods, got {len(import_rate)}")
+        self.import_rate[:] = np.asarray(import_rate, dtype=np.float64)
+        self.export_rate[:] = np.asarray(export_rate, dtype=np.float64)
+        self.init_charge = init_charge
+        self.tuned_penalty = None
+
+    def _nearest_level(self, energy: float) -> int:
+        return int(np.abs(self.levels - energy).argmin())
+
+    def _run_dp(self, cycle_penalty: float) -> tuple[np.ndarray, float]:
+        """
+        Backward induction over the discretised energy levels followed by a forward pass to recover the path
+
+        :param cycle_penalty: Lagrangian penalty per MWh discharged (£/MWh)
+        :return: path: Index of the energy level at the start and the end of every period, length T + 1
+                 value: Penalised objective of the path (£)
+        """
+        n_levels = len(self.levels)
+        charge_energy = np.where(self.feasible, self.M * self.charge_power, 0.0)
+        discharge_energy = np.where(self.feasible, self.M * self.discharge_power, 0.0)
+        # Value of a transition that does not depend on the prices, -inf where it is infeasible
+        transition_value = np.where(self.feasible, 0.0, -np.inf)
+        if self.degradation_cost is not None:
+            transition_value -= self.degradation_cost
+
+        value_to_go = np.zeros(n_levels)
+        if self.final_charge is not None:
+            value_to_go = np.full(n_levels, -np.inf)
+            value_to_go[self._nearest_level(self.final_charge)] = 0.0
+
+        # Preallocated work arrays, the loop below runs once per period so it avoids temporary allocations
+        policy = np.empty((self.n_periods, n_levels), dtype=np.int32)
+        q_value = np.empty((n_levels, n_levels))
+        charge_cost = np.empty((n_levels, n_levels))
+        rows = np.arange(n_levels)
+        for t in range(self.n_periods - 1, -1, -1):
+            np.multiply(discharge_energy, self.export_rate[t] - cycle_penalty, out=q_value)
+            np.multiply(charge_energy, self.import_rate[t], out=charge_cost)
+            q_value -= charge_cost
+            q_value += transition_value
+            q_value += value_to_go[None, :]
+            policy[t] = q_value.argmax(axis=1)
+            value_to_go = q_value[rows, policy[t]]
+
+        path = np.empty(self.n_periods + 1, dtype=np.int32)
+        path[0] = self._nearest_level(self.init_charge)
+        for t in range(self.n_periods):
+            path[t + 1] = policy[t, path[t]]
+
+        return path, float(value_to_go[path[0]])
+
+    def _discharge_throughput(self, path: np.ndarray) -> float:
+        return self.M * self.discharge_power[path[:-1], path[1:]].sum()
+
+    def solve_problem(self, solver_selection=None, day_count=None, mip_rel_gap=None, time_limit=None, threads=None,
+                      penalty_tolerance: float = 0.005, max_iterations: int = 30):
+        """
+        Solve the dispatch, the solver arguments are accepted for compatibility with Battery but are not used
+
+        :param penalty_tolerance: Stop the bisection once the throughput is within this fraction of the cycle cap
+        :param max_iterations: Maximum number of bisection steps on the cycle penalty
+        :return:
+        """
+        tic = time.perf_counter()
+        dp_passes = 1
+        # Every solve starts from the user's penalty, so a reused model is not held at an earlier horizon's penalty
+        self.tuned_penalty = self.cycle_penalty
+        path, value = self._run_dp(cycle_penalty=self.cycle_penalty)
+        # Every pass at a penalty above the user's bounds the capped optimum: L(penalty) + extra penalty * cap
+        dual_bound = value
+        cap_binds = self.max_discharge is not None and self._discharge_throughput(path) > self.max_discharge
+
+        if cap_binds:
+            # Above the best export price even energy already held is not worth discharging, and negative import
+            # prices can pay up to -min(import)/(ce*de) per MWh discharged on top, so no discharge can be profitable
+            round_trip_eff = self.charge_eff * self.discharge_eff
+            upper = max(self.export_rate.max() - min(self.import_rate.min(), 0) / round_trip_eff, 0) + 1
+            lower = self.cycle_penalty
+            path, value = self._run_dp(cycle_penalty=upper)
+            dp_passes += 1
+            dual_bound = min(dual_bound, value + (upper - self.cycle_penalty) * self.max_discharge)
+
+            for _ in range(max_iterations):
+                penalty = (lower + upper) / 2
+                candidate, value = self._run_dp(cycle_penalty=penalty)
+                dp_passes += 1
+                dual_bound = min(dual_bound, value + (penalty - self.cycle_penalty) * self.max_discharge)
+                throughput = self._discharge_throughput(candidate)
+                if throughput > self.max_discharge:
+                    lower = penalty
+                else:
+                    upper, path = penalty, candidate
+                    if throughput >= self.max_discharge * (1 - penalty_tolerance):
+                        break
+
+            self.tuned_penalty = upper
+
+        # Only a terminal SoC can force discharge at the upper bound, the cap cannot be met then
+        if self.max_discharge is not None and self._discharge_throughput(path) > self.max_discharge + 1e-6:
+            raise RuntimeError(f"No feasible solution found: the dispatch discharges "
+                               f"{self._discharge_throughput(path):.1f} MWh against a cap of {self.max_discharge} MWh")
+
+        self.path = path
+
+        charge = self.charge_power[path[:-1], path[1:]]
+        discharge = self.discharge_power[path[:-1], path[1:]]
+        # The same objective as Battery: trading profit less the user's cycle penalty and the degradation cost
+        degradation_cost = 0.0 if self.degradation_cost is None else \
+            float(self.degradation_cost[path[:-1], path[1:]].sum())
+        objective = self.M * ((self.export_rate - self.cycle_penalty) @ discharge - self.import_rate @ charge) - \
+            degradation_cost
+        # Only exact on the energy grid once the throughput reaches the cap, short of it the dual bound gives the gap
+        stopped_short = cap_binds and self._discharge_throughput(path) < self.max_discharge * (1 - penalty_tolerance)
+        self.metrics = {"solve_time_s": time.perf_counter() - tic,
+                        "termination": "feasible" if stopped_short else "optimal",
+                        "objective": objective,
+                        "mip_gap": max(dual_bound - objective, 0.0) / abs(objective) if objective else None,
+                        "n_variables": self.n_periods * len(self.levels),
+                        "n_constraints": None,
+                        "n_binaries": 0,
+                        "dp_passes": dp_passes,
+                        "cycle_penalty": self.tuned_penalty,
+                        }
+        if self.degradation_cost is not None:
+            self.metrics["degradation_cost"] = degradation_cost
+            self.metrics["degradation_model"] = "soc_band"
+
+    def collect_opt_columns(self) -> dict:
+        """
+        :return: Dictionary of result column name to array, one element per period
+        """
+        energy = self.levels[self.path[1:]]
+        charge = self.charge_power[self.path[:-1], self.path[1:]]
+        discharge = self.discharge_power[self.path[:-1], self.path[1:]]
+
+        return build_result_columns(charge=charge,
+                                    discharge=discharge,
+                                    charge_bool=(charge > 0).astype(float),
+                                    discharge_bool=(discharge > 0).astype(float),
+                                    energy=energy,
+                                    import_rate=self.import_rate,
+                                    export_rate=self.export_rate,
+                                    battery_cap=self.battery_cap,
+                                    M=self.M)
+
+    def collect_opt_results(self):
+        return records_from_columns(self.collect_opt_columns())
+
+
+def dp_optimality_gap(prices: np.ndarray, battery_params: dict, max_cycles: float, init_charge: float,
+                      mip_rel_gap: float = 0.0001, time_limit: float | int = 20, soc_resolution: float = 1.0) -> dict:
+    """
+    Solve the same horizon with the dynamic program and the MILP (matrix backend) and report the optimality gap
+
+    :param prices: HH prices for the horizon (used for both import and export)
+    :param battery_params: Battery specification, see tools.dispatch_runner.DEFAULT_BATTERY_PARAMS
+    :param max_cycles: Number of cycles allowed within the horizon
+    :param init_charge: Energy level at the start of the horizon (MWh)
+    :param mip_rel_gap: Relative MIP gap tolerance for the MILP
+    :param time_limit: MILP time limit in seconds
+    :param soc_resolution: Size of an energy level step in the dynamic program (MWh)
+    :return: Dictionary with the profit and run time of both engines and the gap in %
+    """
+    tic = time.perf_counter()
+    dp_battery = DynamicProgrammingBattery(import_rate=prices, export_rate=prices, init_charge=init_charge,
+                                           soc_resolution=soc_resolution, **battery_params)
+    dp_battery.add_max_cycles_constraint(max_daily_cycles=max_cycles)
+    dp_battery.solve_problem()
+    dp_columns = dp_battery.collect_opt_columns()
+    dp_time = time.perf_counter() - tic
+
+    tic = time.perf_counter()
+    milp_model = BatteryMatrixModel(import_rate=prices, export_rate=prices, init_charge=init_charge, **battery_params)
+    milp_model.add_objective_function()
+    milp_model.add_storage_constraints()
+    milp_model.add_max_cycles_constraint(max_daily_cycles=max_cycles)
+    milp_model.solve_problem(mip_rel_gap=mip_rel_gap, time_limit=time_limit)
+    milp_time = time.perf_counter() - tic
+
+    dp_profit = dp_columns["Trading Profits (£)"].sum()
+    gap = {"dp_profit": dp_profit,
+           "milp_profit": milp_model.objective_value,
+           "gap_pct": (milp_model.objective_value - dp_profit) / abs(milp_model.objective_value) * 100,
+           "dp_time_s": dp_time,
+           "milp_time_s": milp_time,
+           "cycle_penalty": dp_battery.tuned_penalty,
+           }
+
+    logging.info(f"DP: £{dp_profit:,.0f} in {dp_time:.1f} s, MILP: £{milp_model.objective_value:,.0f} in "
+                 f"{milp_time:.1f} s, Gap: {gap['gap_pct']:.3f}%")
+
+    return gap
@@ -0,0 +1,549 @@
+"""
+Matrix-based formulation of the battery arbitrage problem.
+
+This builds exactly the same MILP as the Pyomo rules in battery_model.Battery (SoC balance, power/bool coupling,
+grid limits, SoC limits and the cycle cap) but as sparse SciPy coefficient matrices assembled in a single vectorised
+pass. The problem is then handed straight to an in-process solver from the registry in solvers.py (HiGHS through
+scipy.optimize.milp by default), so no model file is written to disk.
+
+Variable layout (T = number of periods in the horizon), each block holds T columns:
+    [LevelofEnergy | charge | discharge | charge_bool | discharge_bool]
+Optional extensions (degradation segments, ancillary service availability) append their columns after these.
+"""
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import logging
+
+from solvers import matrix_solver
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Column block offsets in the decision vector
+ENERGY, CHARGE, DISCHARGE, CHARGE_BOOL, DISCHARGE_BOOL = range(5)
+N_BLOCKS = 5
+
+# Power (MW) below which a charge or discharge counts as zero when checking a relaxed solution
+DISPATCH_TOLERANCE = 1e-6
+
+# scipy.optimize.milp status codes named like Pyomo's TerminationCondition
+MILP_TERMINATION = {0: "optimal", 1: "maxTimeLimit", 2: "infeasible", 3: "unbounded", 4: "error"}
+
+
+def service_directions(services: dict) -> tuple[np.ndarray, np.ndarray]:
+    """
+    :param services: Mapping of service name to its specification, see tools.ancillary_services.SERVICES
+    :return: up: 1 for every service that needs up headroom, 0 otherwise
+             down: 1 for every service that needs down headroom, 0 otherwise
+    """
+    directions = [spec["direction"] for spec in services.values()]
+    if set(directions) - {"up", "down", "both"}:
+        raise ValueError(f"Service directions must be 'up', 'down' or 'both', got {directions}")
+    return (np.array([direction in ("up", "both") for direction in directions], dtype=np.float64),
+            np.array([direction in ("down", "both") for direction in directions], dtype=np.float64))
+
+
+def max_service_volumes(services: dict, up_limit: float, down_limit: float) -> np.ndarray:
+    """
+    :param services: Mapping of service name to its specification, see tools.ancillary_services.SERVICES
+    :param up_limit: Export capability of the battery (MW)
+    :param down_limit: Import capability of the battery (MW)
+    :return: Maximum availability of every service (MW), its max_volume or else the power rating in its direction
+    """
+    up, down = service_directions(services)
+    limits = np.minimum(np.where(up, up_limit, np.inf), np.where(down, down_limit, np.inf))
+    return np.array([spec.get("max_volume") or limit for spec, limit in zip(services.values(), limits)],
+                    dtype=np.float64)
+
+
+def check_segment_costs(segment_costs: np.ndarray):
+    """
+    :param segment_costs: Cost per MWh discharged from each segment (£/MWh), from the bottom segment up
+    :return:
+    """
+    if np.any(np.diff(segment_costs) > 0):
+        raise ValueError("Segment costs must not increase from the bottom segment up, deeper discharge has to "
+                         "cost more")
+
+
+class BatteryMatrixModel:
+
+    def __init__(self, battery_capacity: float | int,
+                 discharge_power: float | int,
+                 charge_power: float | int,
+                 charging_eff: float,
+                 discharging_eff: float,
+                 import_grid_lim: float | int,
+                 export_grid_lim: float | int,
+                 import_rate: pd.Series | np.ndarray,
+                 export_rate: pd.Series | np.ndarray,
+                 min_soc: float | int,
+                 max_soc: float | int,
+                 init_charge: float | int,
+                 interval_length: float = 0.5,
+                 ):
+        """
+        :param interval_length: Duration of a dispatch period in hours, e.g. 0.25 for a 15-minute market
+        """
+
+        self.battery_cap = battery_capacity
+        self.dis_p = discharge_power
+        self.charge_p = charge_power
+        self.charge_eff = charging_eff
+        self.discharge_eff = discharging_eff
+        self.import_grid_lim = import_grid_lim
+        self.export_grid_lim = export_grid_lim
+        self.min_soc = min_soc
+        self.max_soc = max_soc
+        self.init_charge = init_charge
+
+        # Duration of a market dispatch time interval
+        self.M = interval_length  # 1 = 1 hour, 0.5 = 30min, 0.25 = 15 min
+
+        # Copied so update_horizon never writes into the caller's price array
+        self.import_rate = np.array(import_rate, dtype=np.float64)
+        self.export_rate = np.array(export_rate, dtype=np.float64)
+        self.T = len(self.import_rate)
+
+        # Objective coefficients, constraint blocks and variable bounds are filled by the add_* methods
+        self.c = np.zeros(N_BLOCKS * self.T)
+        self.constraint_blocks = []
+        self.solution = None
+        self.objective_value = None
+        self.soc_rhs = None
+        self.cycle_penalty = 0.0
+        self._stacked_constraints = None
+        # Indexes in constraint_blocks of the rows that stop charging and discharging in the same period
+        self.exclusive_blocks = []
+        self.binary_periods = None
+        self.metrics = {}
+        # Column of the first period of each independent SoC chain, only the portfolio model has more than one
+        self.chain_starts = np.array([0])
+        # Set by add_degradation_cost
+        self.segment_size = None
+        self.segment_rhs = None
+        self.degradation_columns = None
+        # Set by add_ancillary_services
+        self.service_names = None
+        self.service_columns = None
+        self.availability_price = None
+        self.period_block = None
+
+        # Variable bounds - the grid and SoC limits are single-variable constraints, so they are expressed as bounds
+        self.lb = np.zeros(N_BLOCKS * self.T)
+        self.ub = np.full(N_BLOCKS * self.T, np.inf)
+        self.ub[self._block(CHARGE_BOOL)] = 1
+        self.ub[self._block(DISCHARGE_BOOL)] = 1
+
+        self.integrality = np.zeros(N_BLOCKS * self.T)
+        self.integrality[self._block(CHARGE_BOOL)] = 1
+        self.integrality[self._block(DISCHARGE_BOOL)] = 1
+
+    def _block(self, block: int) -> slice:
+        """
+        :param block: Index of the variable block
+        :return: Slice of the decision vector holding that block
+        """
+        return slice(block * self.T, (block + 1) * self.T)
+
+    def _block_matrix(self, coefficients: dict) -> sp.csr_matrix:
+        """
+        Build a T x (5 * T) matrix where each variable block contributes a diagonal (or any T x T sparse matrix).
+
+        :param coefficients: Mapping of block index to a scalar, a length T array or a T x T sparse matrix
+        :return: Sparse coefficient matrix for T constraint rows
+        """
+        blocks = []
+        for block in range(N_BLOCKS):
+            coef = coefficients.get(block)
+            if coef is None:
+                blocks.append(sp.csr_matrix((self.T, self.T)))
+            elif sp.issparse(coef):
+                blocks.append(coef)
+            else:
+                blocks.append(sp.diags(np.broadcast_to(coef, self.T).astype(np.float64), format="csr"))
+        return sp.hstack(blocks, format="csr")
+
+    def add_objective_function(self, cycle_penalty: float = 0.0):
+        """
+        :param cycle_penalty: Optional penalty per MWh discharged (£/MWh)
+        :return:
+        """
+        self.cycle_penalty = cycle_penalty
+        # milp minimises, so negate the trading profit
+        self.c[self._block(CHARGE)] = self.M * self.import_rate
+        self.c[self._block(DISCHARGE)] = -self.M * (self.export_rate - cycle_penalty)
+
+    def add_max_cycles_constraint(self, max_daily_cycles: float | int, max_discharge: float | int = None):
+        """
+        :param max_daily_cycles: Number of full cycles allowed within the time horizon
+        :param max_discharge: Optional override of the discharge throughput limit in MWh
+        :return:
+        """
+        row = np.zeros(N_BLOCKS * self.T)
+        row[self._block(DISCHARGE)] = self.M
+        limit = max_discharge if max_discharge else max_daily_cycles * self.battery_cap
+        self.constraint_blocks.append((sp.csr_matrix(row), np.array([-np.inf]), np.array([limit], dtype=np.float64)))
+
+    def add_block_cycles_constraint(self, block_periods: int, max_discharge: float | int):
+        """
+        :param block_periods: Number of periods in a block, a shorter last block gets a pro rata limit
+        :param max_discharge: Discharge throughput limit of a full block in MWh
+        :return:
+        """
+        block_starts = np.arange(0, self.T, block_periods)
+        block_lengths = np.minimum(block_periods, self.T - block_starts)
+
+        rows = sp.csr_matrix((np.full(self.T, self.M),
+                              (np.arange(self.T) // block_periods, np.arange(self.T) + DISCHARGE * self.T)),
+                             shape=(len(block_starts), N_BLOCKS * self.T))
+        self.constraint_blocks.append((rows, np.full(len(block_starts), -np.inf),
+                                       max_discharge * block_lengths / block_periods))
+
+    def add_terminal_soc_constraint(self, final_charge: float | int):
+        """
+        :param final_charge: Required energy level in the final period (MWh)
+        :return:
+        """
+        row = np.zeros(N_BLOCKS * self.T)
+        row[self._block(ENERGY).stop - 1] = 1
+        self.constraint_blocks.append((sp.csr_matrix(row), np.array([final_charge]), np.array([final_charge])))
+
+    def add_storage_constraints(self):
+        """
+        This function adds all the general storage constraints
+        :return:
+        """
+        T = self.T
+
+        # Grid import/export constraints
+        self.ub[self._block(CHARGE)] = self.import_grid_lim
+        self.ub[self._block(DISCHARGE)] = self.export_grid_lim
+
+        # Min/max SoC constraints
+        self.lb[self._block(ENERGY)] = self.battery_cap * self.min_soc
+        self.ub[self._block(ENERGY)] = self.battery_cap * self.max_soc
+
+        no_lb = np.full(T, -np.inf)
+
+        # Boolean variables state that charging and discharging can only occur independently
+        self.exclusive_blocks.append(len(self.constraint_blocks))
+        self.constraint_blocks.append((self._block_matrix({CHARGE_BOOL: 1, DISCHARGE_BOOL: 1}), no_lb, np.ones(T)))
+
+        # Charging power must be within the battery power rating
+        self.constraint_blocks.append((self._block_matrix({CHARGE: 1, CHARGE_BOOL: -self.charge_p}),
+                                       no_lb, np.zeros(T)))
+        self.exclusive_blocks.append(len(self.constraint_blocks))
+        self.constraint_blocks.append((self._block_matrix({CHARGE: 1, DISCHARGE_BOOL: self.charge_p}),
+                                       no_lb, np.full(T, self.charge_p)))
+
+        # The discharging power must be within the battery power rating
+        self.constraint_blocks.append((self._block_matrix({DISCHARGE: 1, DISCHARGE_BOOL: -self.dis_p}),
+                                       no_lb, np.zeros(T)))
+        self.exclusive_blocks.append(len(self.constraint_blocks))
+        self.constraint_blocks.append((self._block_matrix({DISCHARGE: 1, CHARGE_BOOL: self.dis_p}),
+                                       no_lb, np.full(T, self.dis_p)))
+
+        # SoC balance: E[t] - E[t-1] - M * ce * charge[t] + M / de * discharge[t] = 0, with E[0] = init_charge
+        previous = np.ones(T - 1)
+        previous[self.chain_starts[1:] - 1] = 0
+        energy_diff = sp.eye(T, format="csr") - sp.diags(previous, -1, shape=(T, T), format="csr")
+        rhs = np.zeros(T)
+        rhs[self.chain_starts] = self.init_charge
+        # Kept so update_horizon can change the initial SoC in place
+        self.soc_rhs = rhs
+        self.constraint_blocks.append((self._block_matrix({ENERGY: energy_diff,
+                                                           CHARGE: -self.M * self.charge_eff,
+                                                           DISCHARGE: self.M / self.discharge_eff}), rhs, rhs))
+
+    def update_horizon(self, import_rate: pd.Series | np.ndarray, export_rate: pd.Series | np.ndarray,
+                       init_charge: float | int, availability_prices: dict | None = None):
+        """
+        Update the prices and initial SoC in place, the constraint matrix is left untouched
+
+        :param import_rate: Import prices for the new horizon
+        :param export_rate: Export prices for the new horizon
+        :param init_charge: Energy level at the start of the new horizon (MWh)
+        :param availability_prices: Availability prices of every service for the new horizon, the settlement blocks
+                                    must line up with the periods as they did when the services were added
+        :return:
+        """
+        self.import_rate[:] = np.asarray(import_rate, dtype=np.float64)
+        self.export_rate[:] = np.asarray(export_rate, dtype=np.float64)
+        self.init_charge = init_charge
+        self.add_objective_function(cycle_penalty=self.cycle_penalty)
+        if self.soc_rhs is not None:
+            self.soc_rhs[self.chain_starts] = init_charge
+        if self.segment_rhs is not None:
+            n_segments = len(self.segment_rhs) // self.T
+            self.segment_rhs[np.arange(n_segments) * self.T] = self._segment_initial_energy(init_charge, n_segments)
+        if availability_prices is not None and self.service_columns is not None:
+            for row, name in enumerate(self.service_names):
+                self.availability_price[row] = availability_prices[name]
+            self._add_availability_revenue()
+
+    def add_degradation_cost(self, segment_costs: np.ndarray):
+        """
+        Charge a depth-of-discharge dependent cost per MWh discharged. The capacity is split into equal SoC segments,
+        each with its own energy and discharge columns, and every MWh discharged from a segment costs that segment's
+        price. Deeper segments must cost more (a convex cost curve), then the cheapest segments are always used first
+        and no binaries are needed.
+
+        The segment charge is left implicit: a segment's energy may only fall by what is discharged from it, and the
+        segment energies add up to the battery's energy, so charging can top up any segment. That needs two columns
+        and one row per segment and period rather than three columns.
+
+        Extra columns (K = number of segments), appended after the five standard blocks:
+            [segment energy | segment discharge], each ordered [segment 0 t0..tT, segment 1 ...]
+
+        :param segment_costs: Cost per MWh discharged from each segment (£/MWh), from the bottom segment up
+        :return:
+        """
+        # A portfolio holds its battery parameters per column, the segments are sized for a single battery
+        if np.ndim(self.battery_cap):
+            raise ValueError("Degradation costs are not supported by the portfolio model")
+
+        segment_costs = np.asarray(segment_costs, dtype=np.float64)
+        K, T = len(segment_costs), self.T
+        offset = len(self.c)
+        self.segment_size = self.battery_cap / K
+        self.degradation_columns = slice(offset, offset + 2 * K * T)
+
+        self.c = np.r_[self.c, np.zeros(K * T), self.M * np.repeat(segment_costs, T)]
+        self.lb = np.r_[self.lb, np.zeros(2 * K * T)]
+        self.ub = np.r_[self.ub, np.full(K * T, self.segment_size), np.full(K * T, np.inf)]
+        self.integrality = np.r_[self.integrality, np.zeros(2 * K * T)]
+        columns = self._full_width
+
+        # E_k[t] - E_k[t-1] + M / de * D_k[t] >= 0, with E_k[0] = the segment's share of the initial energy
+        previous = np.ones(T - 1)
+        previous[self.chain_starts[1:] - 1] = 0
+        energy_diff = sp.eye(T, format="csr") - sp.diags(previous, -1, shape=(T, T), format="csr")
+        segment_eye = sp.eye(K, format="csr")
+        self.segment_rhs = np.zeros(K * T)
+        self.segment_rhs[np.arange(K) * T] = self._segment_initial_energy(self.init_charge, K)
+        self.constraint_blocks.append((columns((offset, sp.kron(segment_eye, energy_diff, format="csr")),
+                                               (offset + K * T, sp.kron(segment_eye, sp.eye(T) * self.M /
+                                                                        self.discharge_eff, format="csr"))),
+                                       self.segment_rhs, np.full(K * T, np.inf)))
+
+        # The segment energies add up to the battery's energy and the segment discharges to its discharge
+        segment_sum = sp.kron(np.ones((1, K)), sp.eye(T), format="csr")
+        for block, first_column in ((ENERGY, offset), (DISCHARGE, offset + K * T)):
+            self.constraint_blocks.append((columns((block * T, -sp.eye(T, format="csr")), (first_column, segment_sum)),
+                                           np.zeros(T), np.zeros(T)))
+
+    def _full_width(self, *blocks: tuple[int, sp.spmatrix]) -> sp.csr_matrix:
+        """
+        :param blocks: (first column, matrix) pairs in column order, all with the same number of rows
+        :return: Row block as wide as the decision vector with every matrix placed at its first column
+        """
+        n_rows, parts, position = blocks[0][1].shape[0], [], 0
+        for first_column, block in blocks:
+            parts += [sp.csr_matrix((n_rows, first_column - position)), block]
+            position = first_column + block.shape[1]
+        parts.append(sp.csr_matrix((n_rows, len(self.c) - position)))
+        return sp.hstack(parts, format="csr")
+
+    def add_ancillary_services(self, services: dict, availability_prices: dict, settlement_blocks: np.ndarray):
+        """
+        Co-optimise availability in frequency response or reserve services with the arbitrage. The availability of a
+        service is held for a whole settlement block (e.g. a 4-hour EFA block) and paid per MW and hour. In every
+        period of the block the contracted MW must fit in the power headroom left by the energy dispatch, in the
+        direction of the service, and the SoC must hold enough energy to deliver it for the service's duration.
+
+        Extra columns (S = number of services, B = number of settlement blocks), appended after the existing columns:
+            [availability], ordered [service 0 block 0..B, service 1 ...]
+
+        :param services: Mapping of service name to its specification, see tools.ancillary_services.SERVICES
+        :param availability_prices: Mapping of service name to its availability price of every period (£/MW/h)
+        :param settlement_blocks: Settlement block of every period, non-decreasing
+        :return:
+        """
+        # A portfolio holds its battery parameters per column, the headroom rows are built for a single battery
+        if np.ndim(self.battery_cap):
+            raise ValueError("Ancillary services are not supported by the portfolio model")
+
+        T = self.T
+        self.service_names = list(services)
+        _, blocks = np.unique(settlement_blocks, return_inverse=True)
+        n_blocks = blocks[-1] + 1
+        # Maps the availability of a block to each of its periods
+        self.period_block = sp.csr_matrix((np.ones(T), (np.arange(T), blocks)), shape=(T, n_blocks))
+
+        offset = len(self.c)
+        n_services = len(self.service_names)
+        self.service_columns = slice(offset, offset + n_services * n_blocks)
+        self.availability_price = np.array([availability_prices[name] for name in self.service_names],
+                                           dtype=np.float64)
+
+        up, down = service_directions(services)
+        duration = np.array([services[name]["duration"] for name in self.service_names], dtype=np.float64)
+        up_limit = min(self.dis_p, self.export_grid_lim)
+        down_limit = min(self.charge_p, self.import_grid_lim)
+        max_volume = max_service_volumes(services, up_limit, down_limit)
+
+        self.c = np.r_[self.c, np.zeros(n_services * n_blocks)]
+        self._add_availability_revenue()
+        self.lb = np.r_[self.lb, np.zeros(n_services * n_blocks)]
+        self.ub = np.r_[self.ub, np.repeat(max_volume, n_blocks)]
+        self.integrality = np.r_[self.integrality, np.zeros(n_services * n_blocks)]
+
+        def availability(weights):
+            # T x (S * B): the weighted availability of every service in the block of each period
+            return sp.kron(weights[None, :], self.period_block, format="csr")
+
+        eye = sp.eye(T, format="csr")
+        no_lb = np.full(T, -np.inf)
+
+        # Up headroom: discharge[t] - charge[t] + up availability <= export capability
+        self.constraint_blocks.append((self._full_width((CHARGE * T, -eye), (DISCHARGE * T, eye),
+                                                        (offset, availability(up))),
+                                       no_lb, np.full(T, up_limit)))
+        # Down headroom: charge[t] - discharge[t] + down availability <= import capability
+        self.constraint_blocks.append((self._full_width((CHARGE * T, eye), (DISCHARGE * T, -eye),
+                                                        (offset, availability(down))),
+                                       no_lb, np.full(T, down_limit)))
+        # Energy reserve: enough energy above min SoC to deliver the up services and room below max SoC for the down
+        self.constraint_blocks.append((self._full_width((ENERGY * T, eye),
+                                                        (offset, availability(-up * duration / self.discharge_eff))),
+                                       np.full(T, self.battery_cap * self.min_soc), np.full(T, np.inf)))
+        self.constraint_blocks.append((self._full_width((ENERGY * T, eye),
+                                                        (offset, availability(down * duration * self.charge_eff))),
+                                       no_lb, np.full(T, self.battery_cap * self.max_soc)))
+
+    def _add_availability_revenue(self):
+        """
+        Set the objective coefficients of the availability columns from the availability prices
+        :return:
+        """
+        # milp minimises, so the revenue of a MW held over a block is its negated price summed over the block
+        self.c[self.service_columns] = -self.M * (self.availability_price @ self.period_block).ravel()
+
+    def availability_values(self) -> np.ndarray:
+        """
+        :return: (services x periods) solved availability in MW, the block value repeated over its periods
+        """
+        n_blocks = self.period_block.shape[1]
+        return (self.period_block @ self.solution[self.service_columns].reshape(-1, n_blocks).T).T
+
+    def _segment_initial_energy(self, init_charge: float | int, n_segments: int) -> np.ndarray:
+        """
+        :return: Initial energy of every segment, the initial energy fills the segments from the bottom up
+        """
+        return np.clip(init_charge - np.arange(n_segments) * self.segment_size, 0, self.segment_size)
+
+    def _stack_constraints(self) -> tuple[sp.csr_matrix, np.ndarray, np.ndarray]:
+        """
+        :return: Stacked constraint matrix with its lower and upper row bounds
+        """
+        # The stacked matrix is reused while no constraint families are added, e.g. across update_horizon calls
+        if self._stacked_constraints is None or self._stacked_constraints[0] != len(self.constraint_blocks):
+            # Blocks added before any extra columns (e.g. the degradation segments) are padded to the full width
+            n_columns = len(self.c)
+            blocks = [block[0] if block[0].shape[1] == n_columns else
+                      sp.hstack([block[0], sp.csr_matrix((block[0].shape[0], n_columns - block[0].shape[1]))])
+                      for block in self.constraint_blocks]
+            self._stacked_constraints = (len(self.constraint_blocks), sp.vstack(blocks, format="csr"))
+        A = self._stacked_constraints[1]
+        lower = np.concatenate([block[1] for block in self.constraint_blocks])
+        upper = np.concatenate([block[2] for block in self.constraint_blocks])
+
+        return A, lower, upper
+
+    def _run_milp(self, A, lower, upper, integrality, lb, ub, mip_rel_gap, time_limit, solver=None, threads=None):
+        solver, solve = matrix_solver(solver)
+        results = solve(self.c, A, lower, upper, integrality, lb, ub, mip_rel_gap, time_limit, threads)
+
+        if results.x is None:
+            raise RuntimeError(f"No feasible solution found: {results.message}")
+
+        # Status 1 means the time limit was reached with a feasible incumbent
+        if results.status != 0:
+            logging.info("Status = %s" % results.message)
+
+        self.solution = results.x
+        self.objective_value = -results.fun
+        self.metrics = {"solver": solver,
+                        "termination": MILP_TERMINATION.get(results.status, "error"),
+                        "objective": self.objective_value,
+                        # An LP has no MIP gap, and it is infinite when the time limit is hit before a bound is found
+                        "mip_gap": 0.0 if results.mip_gap is None else
+                        results.mip_gap if np.isfinite(results.mip_gap) else None,
+                        "n_variables": A.shape[1],
+                        "n_constraints": A.shape[0],
+                        "n_binaries": int(np.count_nonzero(integrality)),
+                        }
+        if self.degradation_columns is not None:
+            self.metrics["degradation_cost"] = float(self.c[self.degradation_columns] @
+                                                     results.x[self.degradation_columns])
+            self.metrics["degradation_model"] = "segment"
+        if self.service_columns is not None:
+            self.metrics["availability_revenue"] = float(-self.c[self.service_columns] @
+                                                         results.x[self.service_columns])
+
+    def solve_problem(self, mip_rel_gap: float, time_limit: float | int, relax_binaries: bool = False,
+                      solver: str | None = None, threads: int | None = None):
+        """
+        Solve the assembled problem with an in-process MILP solver.
+
+        :param mip_rel_gap: Relative MIP gap tolerance
+        :param time_limit: Solver time limit in seconds
+        :param relax_binaries: Solve the pure LP first and only bring back the binaries of the periods where the LP
+                               charges and discharges at the same time, repeating until there are none
+        :param solver: Solver name from solvers.MATRIX_SOLVERS, Pyomo-only names and None use scipy's milp
+        :param threads: Number of solver threads, the solver's default if None
+        :return:
+        """
+        A, lower, upper = self._stack_constraints()
+
+        if not relax_binaries:
+            self.binary_periods = np.ones(self.T, dtype=bool)
+            self._run_milp(A, lower, upper, self.integrality, self.lb, self.ub, mip_rel_gap, time_limit, solver,
+                           threads)
+            return
+
+        # Row offset of each exclusivity block in the stacked matrix
+        offsets = np.cumsum([0] + [block[0].shape[0] for block in self.constraint_blocks])
+        exclusive_rows = [slice(offsets[i], offsets[i + 1]) for i in self.exclusive_blocks]
+
+        self.binary_periods = np.zeros(self.T, dtype=bool)
+        relaxation_rounds = 0
+        while True:
+            relaxation_rounds += 1
+            relaxed = ~self.binary_periods
+            lb, relaxed_upper = self.lb.copy(), upper.copy()
+            integrality = np.zeros_like(self.integrality)
+
+            # With both bools fixed at 1 and the exclusivity rows dropped, the remaining coupling rows reduce to
+            # the power ratings, so the relaxed periods are a pure LP
+            for block in (CHARGE_BOOL, DISCHARGE_BOOL):
+                lb[self._block(block)][relaxed] = 1
+                integrality[self._block(block)][self.binary_periods] = 1
+            for rows in exclusive_rows:
+                relaxed_upper[rows][relaxed] = np.inf
+
+            self._run_milp(A, lower, relaxed_upper, integrality, lb, self.ub, mip_rel_gap, time_limit, solver, threads)
+
+            charging = self.variable_values(CHARGE) > DISPATCH_TOLERANCE
+            discharging = self.variable_values(DISCHARGE) > DISPATCH_TOLERANCE
+            simultaneous = charging & discharging & relaxed
+            if not simultaneous.any():
+                break
+
+            logging.info(f"{simultaneous.sum()} periods charge and discharge at the same time, re-solving with "
+                         f"their binaries")
+            self.binary_periods |= simultaneous
+
+        # The bools of the relaxed periods were fixed, so report them from the dispatch
+        self.solution[self._block(CHARGE_BOOL)][relaxed] = charging[relaxed]
+        self.solution[self._block(DISCHARGE_BOOL)][relaxed] = discharging[relaxed]
+        self.metrics["relaxation_rounds"] = relaxation_rounds
+
+    def variable_values(self, block: int) -> np.ndarray:
+        """
+        :param block: Index of the variable block
+        :return: Solved values of that block
+        """
+        return self.solution[self._block(block)]
@@ -0,0 +1,173 @@
+"""
+Matrix-based formulation of a portfolio of batteries trading the same prices, where groups of batteries can sit
+behind a shared grid connection.
+
+Every asset has the same constraints as battery_model.Battery, and the assets are stacked asset-major inside each
+variable block of matrix_model.BatteryMatrixModel, so the constraint rows of all assets are assembled in one
+vectorised pass over asset x time rather than one ConcreteModel per asset. A shared connection adds one import and one
+export row per period that limit the summed charge and discharge of the assets behind it.
+
+Variable layout (A = number of assets, T = number of periods in the horizon), each block holds A * T columns:
+    [LevelofEnergy | charge | discharge | charge_bool | discharge_bool], each ordered [asset 0 t0..tT, asset 1 ...]
+"""
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import logging
+
+from battery_model import build_result_columns
+from matrix_model import BatteryMatrixModel, CHARGE, DISCHARGE, ENERGY, CHARGE_BOOL, DISCHARGE_BOOL, N_BLOCKS
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Battery specification keys, each asset dictionary holds these plus "name" and an optional "connection"
+ASSET_PARAMS = ["battery_capacity", "discharge_power", "charge_power", "charging_eff", "discharging_eff",
+                "import_grid_lim", "export_grid_lim", "min_soc", "max_soc"]
+
+
+class PortfolioMatrixModel(BatteryMatrixModel):
+
+    def __init__(self, assets: list[dict],
+                 import_rate: pd.Series | np.ndarray,
+                 export_rate: pd.Series | np.ndarray,
+                 init_charge: float | int | np.ndarray,
+                 interval_length: float = 0.5,
+                 ):
+        """
+        :param assets: One dictionary per asset with the battery specification (see ASSET_PARAMS), a "name" and an
+                       optional "connection" naming the shared grid connection it sits behind
+        :param import_rate: Import prices for the horizon, shared by every asset
+        :param export_rate: Export prices for the horizon, shared by every asset
+        :param init_charge: Energy level of every asset at the start of the horizon (MWh), a scalar or one per asset
+        :param interval_length: Duration of a dispatch period in hours
+        """
+        self.assets = assets
+        self.asset_names = [asset["name"] for asset in assets]
+        self.n_assets = len(assets)
+        self.n_periods = len(import_rate)
+
+        # Every parameter is repeated over the periods of its asset, so the parent's per-column arithmetic applies
+        params = {name: np.repeat([float(asset[name]) for asset in assets], self.n_periods) for name in ASSET_PARAMS}
+
+        super().__init__(import_rate=np.tile(np.asarray(import_rate, dtype=np.float64), self.n_assets),
+                         export_rate=np.tile(np.asarray(export_rate, dtype=np.float64), self.n_assets),
+                         init_charge=np.broadcast_to(np.asarray(init_charge, dtype=np.float64), self.n_assets),
+                         interval_length=interval_length,
+                         **params)
+
+        # Each asset has its own SoC chain
+        self.chain_starts = np.arange(self.n_assets) * self.n_periods
+
+    def _asset_rows(self, block: int, coefficient: float) -> sp.csr_matrix:
+        """
+        :param block: Index of the variable block
+        :param coefficient: Coefficient of every period of the block
+        :return: A x (5 * A * T) matrix with one row summing the block over the periods of each asset
+        """
+        columns = np.arange(self.T) + block * self.T
+        return sp.csr_matrix((np.full(self.T, coefficient), (np.arange(self.T) // self.n_periods, columns)),
+                             shape=(self.n_assets, N_BLOCKS * self.T))
+
+    def add_max_cycles_constraint(self, max_daily_cycles: float | int, max_discharge: float | int = None):
+        """
+        :param max_daily_cycles: Number of full cycles each asset is allowed within the time horizon
+        :param max_discharge: Optional override of the discharge throughput limit of each asset in MWh
+        :return:
+        """
+        capacity = self.battery_cap[self.chain_starts]
+        limit = (np.full(self.n_assets, max_discharge, dtype=np.float64) if max_discharge
+                 else max_daily_cycles * capacity)
+        self.constraint_blocks.append((self._asset_rows(DISCHARGE, self.M), np.full(self.n_assets, -np.inf), limit))
+
+    def add_block_cycles_constraint(self, block_periods: int, max_discharge: float | int | np.ndarray):
+        """
+        :param block_periods: Number of periods in a block, a shorter last block gets a pro rata limit
+        :param max_discharge: Discharge throughput limit of each asset over a full block in MWh, a scalar or one per
+                              asset
+        :return:
+        """
+        block_starts = np.arange(0, self.n_periods, block_periods)
+        block_lengths = np.minimum(block_periods, self.n_periods - block_starts)
+
+        # One row per asset and block: [a0 b0..bB, a1 b0..bB]
+        columns = np.arange(self.T)
+        block_rows = columns // self.n_periods * len(block_starts) + columns % self.n_periods // block_periods
+        rows = sp.csr_matrix((np.full(self.T, self.M), (block_rows, columns + DISCHARGE * self.T)),
+                             shape=(self.n_assets * len(block_starts), N_BLOCKS * self.T))
+        limit = np.outer(np.broadcast_to(np.asarray(max_discharge, dtype=np.float64), self.n_assets),
+                         block_lengths / block_periods).ravel()
+        self.constraint_blocks.append((rows, np.full(len(limit), -np.inf), limit))
+
+    def add_terminal_soc_constraint(self, final_charge: float | int | np.ndarray):
+        """
+        :param final_charge: Required energy level of every asset in the final period (MWh), a scalar or one per asset
+        :return:
+        """
+        last_periods = self.chain_starts + self.n_periods - 1
+        rows = sp.csr_matrix((np.ones(self.n_assets), (np.arange(self.n_assets), last_periods + ENERGY * self.T)),
+                             shape=(self.n_assets, N_BLOCKS * self.T))
+        final_charge = np.broadcast_to(np.asarray(final_charge, dtype=np.float64), self.n_assets)
+        self.constraint_blocks.append((rows, final_charge, final_charge))
+
+    def add_connection_constraints(self, connections: dict):
+        """
+        Limit the summed charge and discharge of the assets behind each shared connection
+
+        :param connections: Mapping of connection name to {"import_grid_lim": MW, "export_grid_lim": MW}
+        :return:
+        """
+        for name, limits in connections.items():
+            members = np.array([asset.get("connection") == name for asset in self.assets])
+            if not members.any():
+                continue
+
+            # Sums the members' power in every period: [a0 t0..tT, a1 t0..tT] -> [t0..tT]
+            period_sum = sp.kron(sp.csr_matrix(members.astype(np.float64)), sp.eye(self.n_periods), format="csr")
+            no_lb = np.full(self.n_periods, -np.inf)
+            self.constraint_blocks.append((self._connection_rows(CHARGE, period_sum), no_lb,
+                                           np.full(self.n_periods, limits["import_grid_lim"])))
+            self.constraint_blocks.append((self._connection_rows(DISCHARGE, period_sum), no_lb,
+                                           np.full(self.n_periods, limits["export_grid_lim"])))
+
+    def _connection_rows(self, block: int, period_sum: sp.csr_matrix) -> sp.csr_matrix:
+        blocks = [period_sum if b == block else sp.csr_matrix((self.n_periods, self.T)) for b in range(N_BLOCKS)]
+        return sp.hstack(blocks, format="csr")
+
+    def update_horizon(self, import_rate: pd.Series | np.ndarray, export_rate: pd.Series | np.ndarray,
+                       init_charge: float | int | np.ndarray):
+        """
+        Update the prices and the initial SoC of every asset in place, the constraint matrix is left untouched
+
+        :param import_rate: Import prices for the new horizon
+        :param export_rate: Export prices for the new horizon
+        :param init_charge: Energy level of every asset at the start of the new horizon (MWh)
+        :return:
+        """
+        super().update_horizon(import_rate=np.tile(np.asarray(import_rate, dtype=np.float64), self.n_assets),
+                               export_rate=np.tile(np.asarray(export_rate, dtype=np.float64), self.n_assets),
+                               init_charge=init_charge)
+
+    def asset_values(self, block: int) -> np.ndarray:
+        """
+        :param block: Index of the variable block
+        :return: Solved values of that block with one row per asset
+        """
+        return self.variable_values(block).reshape(self.n_assets, self.n_periods)
+
+    def collect_asset_columns(self) -> dict:
+        """
+        :return: Dictionary of asset name to its HH result columns, in the schema of Battery.collect_opt_columns
+        """
+        charge, discharge = self.asset_values(CHARGE), self.asset_values(DISCHARGE)
+        charge_bool, discharge_bool = self.asset_values(CHARGE_BOOL), self.asset_values(DISCHARGE_BOOL)
+        energy = self.asset_values(ENERGY)
+        import_rate = self.import_rate[:self.n_periods]
+        export_rate = self.export_rate[:self.n_periods]
+
+        return {name: build_result_columns(charge=charge[a], discharge=discharge[a],
+                                           charge_bool=np.round(charge_bool[a]),
+                                           discharge_bool=np.round(discharge_bool[a]),
+                                           energy=energy[a], import_rate=import_rate, export_rate=export_rate,
+                                           battery_cap=self.battery_cap[self.chain_starts[a]], M=self.M)
+                for a, name in enumerate(self.asset_names)}
@@ -4,72 +4,137 @@ This module runs the battery optimisation model
 
 from tools.calculate_revenues import calculate_revenues
 from tools.price_data_cleaning import process_price_data
-from battery_model import Battery
+from tools.dispatch_runner import run_serial, run_parallel, DEFAULT_BATTERY_PARAMS
+from tools.receding_horizon import run_receding_horizon
+from tools.parquet_sink import ParquetResultSink, read_results
+from tools.telemetry import HorizonTelemetry
+from tools.horizon_cache import HorizonCache
+from tools.price_inputs import PriceInputs
 import pandas as pd
-import numpy as np
 import time
-import math
 import os
 
-master_list = []
-status_SOC = [0.5 * 100]        # Initial state of charge set to 50% of 100MWh capacity
+interval_length = 0.5               # Dispatch interval in hours, e.g. 0.25 for a 15-minute market or 1 to pre-screen
+periods_per_day = int(24 / interval_length)
+init_charge = 0.5 * 100             # Initial state of charge set to 50% of 100MWh capacity
 cycles_per_time_horizon = 1*365     # Total number of cycles per time horizon
-time_horizon = 48*365               # Time horizon in half hours
+time_horizon = periods_per_day*365  # Time horizon in dispatch intervals
+model_backend = "pyomo"             # "pyomo" Pyomo rules, "matrix" vectorised sparse builder, "dp" solver-free DP
+solver_selection = "cplex"          # "highs" in-process, "cbc"/"cplex" executables on PATH or in solvers/
+solver_threads = None               # e.g. 4 to cap the solver threads, the solver's default if None
+parallel_block_freq = None          # e.g. "Y" or "M" to solve independent blocks across a process pool
+persistent_model = False            # Build the model once and update prices/SoC in place for each horizon
+relax_binaries = False              # Solve the LP and only add binaries where it charges and discharges at once
+parquet_output = None               # e.g. "avg_1_cycle_optimised" to stream the results to results/<name>/ as Parquet
+telemetry_output = None             # e.g. "telemetry.jsonl" to write one metrics record per horizon to results/<name>
+receding_lookahead = None           # e.g. 96 to optimise 48 h windows and only commit the first receding_commit periods
+receding_commit = periods_per_day   # Periods committed per receding-horizon window, replaces time_horizon when in use
+incremental_backtest = False        # Reuse horizons solved by earlier runs from data/.cache/horizons
+export_price_column = None          # e.g. "export_prices" to sell at a different price than the "prices" bought at
+network_charge = None               # e.g. 12.5 £/MWh of network charges on top of the import price
+loss_factor = None                  # e.g. 0.98 to settle the metered volumes with a transmission loss multiplier
 
 
 # Import the market price data using the prepared function
-market_price_df, missing_rows_indexes = process_price_data("input_data.csv", time_horizon=time_horizon)
-import_rate = export_rate = market_price_df.copy().reset_index().set_index(["day_count", "time_horizon"])[['prices']]
+market_price_df, missing_rows_indexes = process_price_data("input_data.csv", time_horizon=time_horizon,
+                                                            interval_length=interval_length)
+# Import and export prices held once as float32 arrays, every horizon is a view into them
+prices = PriceInputs.from_frame(market_price_df, export_column=export_price_column, network_charge=network_charge,
+                                loss_factor=loss_factor)
 
 
+file_location = os.path.join(os.path.dirname(__file__), "results/").replace('\\', '/')
+
+# Stream each solved horizon to a year/month partitioned Parquet dataset rather than holding it in memory
+sink = ParquetResultSink(file_location + parquet_output, start_time=market_price_df["time"].iloc[0],
+                         freq=pd.Timedelta(hours=interval_length), row_group_size=periods_per_day * 31,
+                         overwrite=True) if parquet_output else None
+
+# Per-horizon build/solve metrics with a live throughput and ETA summary
+telemetry = HorizonTelemetry(file_location + telemetry_output) if telemetry_output else None
+
+# Only horizons whose prices, starting SoC or settings changed since an earlier run are solved again
+cache = HorizonCache(os.path.join(os.path.dirname(__file__), "data", ".cache", "horizons")) \
+    if incremental_backtest else None
+
 # Track simulation time
 tic = time.time()
-for day_count in range(1, math.ceil(import_rate.index.get_level_values(0)[-1] / (time_horizon / 48)) + 1):
-
-    import_rate_sliced = export_rate_sliced = import_rate.iloc[(day_count - 1) * time_horizon:day_count * time_horizon]
-    if len(import_rate_sliced) < time_horizon:
-        import_rate_sliced = export_rate_sliced = import_rate.iloc[(day_count - 1) * time_horizon:]
-
-    import_rate_sliced.index = export_rate_sliced.index = np.arange(1, len(import_rate_sliced) + 1)
-
-    print('\n')
-    print('Optimising horizon {}/{}'.format(day_count,
-                                            math.ceil(import_rate.index.get_level_values(0)[-1] / (time_horizon / 48))))
-
-    battery = Battery(battery_capacity=100,  # MWh
-                      discharge_power=100,  # MW
-                      charge_power=100,  # MW
-                      charging_eff=0.922,  # charge_eff * discharge_eff = round_trip_eff of 85%
-                      discharging_eff=0.922,
-                      import_grid_lim=100,  # MW
-                      export_grid_lim=100,  # MW
-                      export_rate=export_rate_sliced["prices"],
-                      import_rate=import_rate_sliced["prices"],
-                      max_soc=1,  # p.u.
-                      min_soc=0,  # p.u.
-                      init_charge=status_SOC[-1],  # This is looped so retrieve the previous loop final SoC
-                      )
-
-    battery.add_objective_function()
-    battery.add_storage_constraints()
-    battery.add_max_cycles_constraint(max_daily_cycles=cycles_per_time_horizon)
-    battery.solve_problem(mip_rel_gap=0.0001, time_limit=20, day_count=day_count, solver_selection="cplex")
-    hh_iteration_list, soc_tracker = battery.collect_opt_results()
-
-    master_list.extend(hh_iteration_list)  # Add each iteration to the list
-    status_SOC.extend(soc_tracker)
+if parallel_block_freq:
+    # Each block starts and ends at the initial SoC so the blocks can be solved independently
+    results = run_parallel(market_price_df,
+                           block_freq=parallel_block_freq,
+                           time_horizon=time_horizon,
+                           cycles_per_time_horizon=cycles_per_time_horizon,
+                           boundary_charge=init_charge,
+                           battery_params=DEFAULT_BATTERY_PARAMS,
+                           solver_selection=solver_selection,
+                           threads=solver_threads,
+                           mip_rel_gap=0.0001,
+                           time_limit=20,
+                           backend=model_backend,
+                           persistent=persistent_model,
+                           relax_binaries=relax_binaries,
+                           interval_length=interval_length,
+                           sink=sink,
+                           cache=cache,
+                           telemetry_path=file_location + telemetry_output if telemetry_output else None,
+                           price_inputs=prices)
+elif receding_lookahead:
+    # Overlapping windows rolled forward by receding_commit periods, with the same daily cycle budget
+    results = run_receding_horizon(prices,
+                                   lookahead=receding_lookahead,
+                                   commit=receding_commit,
+                                   cycles_per_day=cycles_per_time_horizon * periods_per_day / time_horizon,
+                                   init_charge=init_charge,
+                                   battery_params=DEFAULT_BATTERY_PARAMS,
+                                   solver_selection=solver_selection,
+                                   threads=solver_threads,
+                                   mip_rel_gap=0.0001,
+                                   time_limit=20,
+                                   backend=model_backend,
+                                   persistent=persistent_model,
+                                   relax_binaries=relax_binaries,
+                                   interval_length=interval_length,
+                                   sink=sink,
+                                   telemetry=telemetry)
+else:
+    # Each horizon is looped so it starts from the previous horizon's final SoC
+    results = run_serial(prices,
+                         time_horizon=time_horizon,
+                         cycles_per_time_horizon=cycles_per_time_horizon,
+                         init_charge=init_charge,
+                         battery_params=DEFAULT_BATTERY_PARAMS,
+                         solver_selection=solver_selection,
+                         threads=solver_threads,
+                         mip_rel_gap=0.0001,
+                         time_limit=20,
+                         backend=model_backend,
+                         persistent=persistent_model,
+                         relax_binaries=relax_binaries,
+                         interval_length=interval_length,
+                         sink=sink,
+                         telemetry=telemetry,
+                         cache=cache)
 
 toc = time.time()
+if telemetry:
+    telemetry.close()
 print('\n')
 print('############## Total Simulation Time: ' + str(round(toc - tic, 2)) + ' seconds ##############')
 
 
-# Convert the hourly timeseries list and the frequency market list to a dataframe
-optimised_df = pd.DataFrame.from_records(master_list)
-hourly_timerange = pd.date_range(start=market_price_df["time"].iloc[0], end=market_price_df["time"].iloc[-1],
-                                 freq='30T').astype(str)
-# Set the "datetime" as the first column in the DataFrame
-optimised_df.insert(0, "datetime", hourly_timerange)
+if sink:
+    sink.close()
+    # Only load the columns needed for the checks and the revenue comparison
+    optimised_df = read_results(file_location + parquet_output,
+                                columns=["Charge Bool", "Discharge Bool", "Trading Profits (£)"])
+else:
+    # Wrap the columnar results in a dataframe
+    optimised_df = results.to_frame()
+    hourly_timerange = pd.date_range(start=market_price_df["time"].iloc[0], end=market_price_df["time"].iloc[-1],
+                                     freq=pd.Timedelta(hours=interval_length)).astype(str)
+    # Set the "datetime" as the first column in the DataFrame
+    optimised_df.insert(0, "datetime", hourly_timerange)
 
 assert not ((optimised_df['Charge Bool'] == 1) & (optimised_df['Discharge Bool'] == 1)).any(),\
     "Error: Occurrences where both discharge and charge are occurring at the same time."
@@ -83,7 +148,6 @@ daily_revenues_df, annual_revenues_df = calculate_revenues(market_price_df,
                                                            round_trip_eff=0.85)
 
 
-file_location = os.path.join(os.path.dirname(__file__), "results/").replace('\\', '/')
 annual_revenues_df.to_csv(file_location + f"annual_profit_by_scenario.csv")
 daily_revenues_df.to_csv(file_location + f"daily_profit_by_scenario.csv")
 
@@ -0,0 +1,220 @@
+"""
+Registry of the solvers the battery models can be solved with, so a solver is picked by name and configured with the
+same mip_rel_gap, time_limit and threads options whichever it is.
+
+Pyomo backend (battery_model.Battery):
+    "highs"  in-process through the Pyomo APPSI interface to highspy, no model file is written
+    "cbc"    executable, the model is written to an LP file every solve
+    "cplex"  executable, the model is written to an LP file every solve
+The executables are looked up once per process, first in the solvers/ directory of the repository and the working
+directory, with or without a .exe suffix, then on the PATH.
+
+Matrix backend (matrix_model.BatteryMatrixModel), the coefficient matrices are passed in memory:
+    "scipy"  scipy.optimize.milp, which runs HiGHS but has no threads option
+    "highs"  highspy directly, which also takes threads
+The Pyomo-only names fall back to "scipy" on the matrix backend, so a run configured for a Pyomo solver keeps working
+when only the backend is switched. A solver_selection of None picks "highs" on the Pyomo backend and "scipy" on the
+matrix backend.
+
+New solvers are added with the register_pyomo_solver and register_matrix_solver decorators.
+"""
+from pyomo.contrib.appsi.base import LegacySolverInterface
+from pyomo.contrib.appsi.solvers import Highs as AppsiHighs
+from pyomo.opt import SolverFactory
+from scipy.optimize import milp, LinearConstraint, Bounds, OptimizeResult
+import scipy.sparse as sp
+import numpy as np
+import functools
+import logging
+import shutil
+import os
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Pyomo solver factories, keyed by solver name
+PYOMO_SOLVERS = {}
+# In-memory MILP solvers of the matrix backend, keyed by solver name
+MATRIX_SOLVERS = {}
+
+DEFAULT_PYOMO_SOLVER = "highs"
+DEFAULT_MATRIX_SOLVER = "scipy"
+
+# Directories searched for solver executables before the PATH
+SOLVER_DIRECTORIES = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "solvers"),
+                      os.getcwd(),
+                      os.path.join(os.getcwd(), "solvers")]
+
+
+def register_pyomo_solver(name: str):
+    """
+    :param name: Solver name used as solver_selection
+    :return: Decorator registering a factory(mip_rel_gap, time_limit, threads) that returns a Pyomo solver
+    """
+    def decorator(factory):
+        PYOMO_SOLVERS[name] = factory
+        return factory
+    return decorator
+
+
+def register_matrix_solver(name: str):
+    """
+    :param name: Solver name used as solver_selection
+    :return: Decorator registering a function(c, A, lower, upper, integrality, lb, ub, mip_rel_gap, time_limit,
+             threads) that returns an OptimizeResult shaped like scipy.optimize.milp's
+    """
+    def decorator(solve):
+        MATRIX_SOLVERS[name] = solve
+        return solve
+    return decorator
+
+
+@functools.lru_cache(maxsize=None)
+def find_executable(name: str) -> str | None:
+    """
+    :param name: Executable name without suffix, e.g. "cbc"
+    :return: Path of the executable, None if it is not found
+    """
+    for directory in SOLVER_DIRECTORIES:
+        for file_name in (name, f"{name}.exe"):
+            path = os.path.join(directory, file_name)
+            if os.path.isfile(path) and os.access(path, os.X_OK):
+                return path
+    return shutil.which(name)
+
+
+def _executable_solver(name: str):
+    executable = find_executable(name)
+    if executable is None:
+        raise RuntimeError(f"No {name} executable found in {SOLVER_DIRECTORIES} or on the PATH")
+    return SolverFactory(name, executable=executable)
+
+
+class QuietHighs(LegacySolverInterface, AppsiHighs):
+    """
+    The "appsi_highs" solver of SolverFactory, with the HiGHS output turned off before the model is passed in. HiGHS
+    prints its banner as soon as the first variables are added, before the solve options are applied.
+    """
+
+    def add_block(self, block):
+        self._solver_model.setOptionValue("output_flag", False)
+        super().add_block(block)
+
+
+@register_pyomo_solver("highs")
+def _highs(mip_rel_gap: float, time_limit: float | int, threads: int | None):
+    solver = QuietHighs()
+    solver.config.time_limit = time_limit
+    solver.highs_options = {"output_flag": False, "mip_rel_gap": mip_rel_gap,
+                            **({"threads": threads} if threads else {})}
+    return solver
+
+
+@register_pyomo_solver("cbc")
+def _cbc(mip_rel_gap: float, time_limit: float | int, threads: int | None):
+    solver = _executable_solver("cbc")
+    solver.options.update({"ratio": mip_rel_gap, "sec": time_limit, **({"threads": threads} if threads else {})})
+    return solver
+
+
+@register_pyomo_solver("cplex")
+def _cplex(mip_rel_gap: float, time_limit: float | int, threads: int | None):
+    solver = _executable_solver("cplex")
+    solver.options.update({"mip tolerances mipgap": mip_rel_gap, "timelimit": time_limit,
+                           **({"threads": threads} if threads else {})})
+    return solver
+
+
+def pyomo_solver(name: str | None, mip_rel_gap: float, time_limit: float | int, threads: int | None = None):
+    """
+    :param name: Registered Pyomo solver name, DEFAULT_PYOMO_SOLVER if None
+    :param mip_rel_gap: Relative MIP gap tolerance
+    :param time_limit: Solver time limit in seconds
+    :param threads: Number of solver threads, the solver's default if None
+    :return: Configured Pyomo solver
+    """
+    name = name or DEFAULT_PYOMO_SOLVER
+    if name not in PYOMO_SOLVERS:
+        raise ValueError(f"Unknown solver '{name}', expected one of {sorted(PYOMO_SOLVERS)}")
+    return PYOMO_SOLVERS[name](mip_rel_gap, time_limit, threads)
+
+
+@register_matrix_solver("scipy")
+def _scipy_milp(c, A, lower, upper, integrality, lb, ub, mip_rel_gap, time_limit, threads) -> OptimizeResult:
+    return milp(c=c,
+                constraints=LinearConstraint(A, lower, upper),
+                integrality=integrality,
+                bounds=Bounds(lb, ub),
+                options={"mip_rel_gap": mip_rel_gap, "time_limit": time_limit})
+
+
+# highspy model statuses mapped to scipy.optimize.milp status codes
+HIGHS_STATUS = {"Optimal": 0, "Time limit reached": 1, "Infeasible": 2, "Primal infeasible or unbounded": 2,
+                "Unbounded": 3}
+
+
+@register_matrix_solver("highs")
+def _highspy(c, A, lower, upper, integrality, lb, ub, mip_rel_gap, time_limit, threads) -> OptimizeResult:
+    import highspy
+
+    A = sp.csr_matrix(A)
+    lp = highspy.HighsLp()
+    lp.num_col_, lp.num_row_ = A.shape[1], A.shape[0]
+    lp.col_cost_, lp.col_lower_, lp.col_upper_ = c, lb, ub
+    lp.row_lower_, lp.row_upper_ = lower, upper
+    lp.a_matrix_.format_ = highspy.MatrixFormat.kRowwise
+    lp.a_matrix_.start_, lp.a_matrix_.index_, lp.a_matrix_.value_ = A.indptr, A.indices, A.data
+    is_mip = bool(np.any(integrality))
+    if is_mip:
+        lp.integrality_ = [highspy.HighsVarType.kInteger if flag else highspy.HighsVarType.kContinuous
+                           for flag in integrality]
+
+    highs = highspy.Highs()
+    highs.setOptionValue("output_flag", False)
+    highs.setOptionValue("mip_rel_gap", mip_rel_gap)
+    highs.setOptionValue("time_limit", float(time_limit))
+    if threads:
+        highs.setOptionValue("threads", int(threads))
+    highs.passModel(lp)
+    highs.run()
+
+    model_status = highs.modelStatusToString(highs.getModelStatus())
+    info = highs.getInfo()
+    has_solution = info.primal_solution_status == 2
+    return OptimizeResult(x=np.array(highs.getSolution().col_value) if has_solution else None,
+                          fun=info.objective_function_value if has_solution else None,
+                          status=HIGHS_STATUS.get(model_status, 4),
+                          message=model_status,
+                          mip_gap=info.mip_gap if is_mip else None)
+
+
+def matrix_solver(name: str | None):
+    """
+    :param name: Solver selection, names only registered for the Pyomo backend fall back to DEFAULT_MATRIX_SOLVER
+    :return: Name and solve function of the matrix solver
+    """
+    if name not in MATRIX_SOLVERS:
+        if name is not None and name not in PYOMO_SOLVERS:
+            raise ValueError(f"Unknown solver '{name}', expected one of {sorted(MATRIX_SOLVERS | PYOMO_SOLVERS)}")
+        name = DEFAULT_MATRIX_SOLVER
+    return name, MATRIX_SOLVERS[name]
+
+
+def available_solvers() -> dict:
+    """
+    :return: Names of the registered solvers that can run here, per backend
+    """
+    pyomo_available = []
+    for name in PYOMO_SOLVERS:
+        try:
+            if pyomo_solver(name, mip_rel_gap=0.0001, time_limit=20).available():
+                pyomo_available.append(name)
+        except RuntimeError:
+            continue
+    try:
+        import highspy  # noqa: F401
+        matrix_available = list(MATRIX_SOLVERS)
+    except ImportError:
+        matrix_available = [name for name in MATRIX_SOLVERS if name != "highs"]
+
+    return {"pyomo": pyomo_available, "matrix": matrix_available}
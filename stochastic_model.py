@@ -0,0 +1,142 @@
+"""
+Matrix-based two-stage stochastic formulation of the battery arbitrage problem over an ensemble of price forecasts.
+
+The horizon is split into the first-stage periods, whose charge and discharge are committed day-ahead before the prices
+are known, and the recourse periods that follow, which are dispatched once the scenario has played out. Every
+scenario is a copy of the battery with its own forecast prices and its own SoC chain, stacked scenario-major exactly
+like the assets of portfolio_model.PortfolioMatrixModel, and the objective is the probability weighted profit. The
+non-anticipativity rows tie the first-stage charge and discharge of every scenario to those of scenario 0, so only one
+day-ahead schedule comes out while every scenario keeps its own recourse.
+
+Variable layout (S = number of scenarios, T = number of periods in the horizon), each block holds S * T columns:
+    [LevelofEnergy | charge | discharge | charge_bool | discharge_bool], each ordered [scenario 0 t0..tT, ...]
+
+This extensive form is solved in one go. For many scenarios or long recourse horizons, tools/stochastic_dispatch.py
+solves the same problem by Benders decomposition across worker processes.
+"""
+import numpy as np
+import scipy.sparse as sp
+import logging
+
+from battery_model import build_result_columns
+from portfolio_model import PortfolioMatrixModel
+from matrix_model import CHARGE, DISCHARGE, ENERGY, CHARGE_BOOL, DISCHARGE_BOOL, N_BLOCKS
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class StochasticMatrixModel(PortfolioMatrixModel):
+
+    def __init__(self, battery_params: dict,
+                 scenario_prices: np.ndarray,
+                 first_stage_periods: int,
+                 init_charge: float | int,
+                 probabilities: np.ndarray | None = None,
+                 interval_length: float = 0.5,
+                 ):
+        """
+        :param battery_params: Battery specification, see tools.dispatch_runner.DEFAULT_BATTERY_PARAMS
+        :param scenario_prices: (scenarios x periods) array of price forecasts for the horizon, used for import and
+                                export
+        :param first_stage_periods: Number of periods at the start of the horizon committed before the prices are known
+        :param init_charge: Energy level at the start of the horizon (MWh)
+        :param probabilities: Probability of every scenario, equally likely if None
+        :param interval_length: Duration of a dispatch period in hours
+        """
+        scenario_prices = np.atleast_2d(np.asarray(scenario_prices, dtype=np.float64))
+        n_scenarios, n_periods = scenario_prices.shape
+        if not 0 < first_stage_periods <= n_periods:
+            raise ValueError(f"first_stage_periods must be between 1 and the {n_periods} periods of the horizon")
+
+        self.first_stage_periods = first_stage_periods
+        self.probabilities = self._normalise(probabilities, n_scenarios)
+
+        assets = [{"name": f"scenario_{s}", **battery_params} for s in range(n_scenarios)]
+        super().__init__(assets, import_rate=scenario_prices[0], export_rate=scenario_prices[0],
+                         init_charge=init_charge, interval_length=interval_length)
+        self.n_scenarios = n_scenarios
+
+        # The parent tiles one price series over the assets, every scenario has its own
+        self.import_rate[:] = scenario_prices.ravel()
+        self.export_rate[:] = scenario_prices.ravel()
+
+    @staticmethod
+    def _normalise(probabilities: np.ndarray | None, n_scenarios: int) -> np.ndarray:
+        if probabilities is None:
+            return np.full(n_scenarios, 1 / n_scenarios)
+        probabilities = np.asarray(probabilities, dtype=np.float64)
+        if len(probabilities) != n_scenarios or (probabilities < 0).any():
+            raise ValueError("Expected one non-negative probability per scenario")
+        return probabilities / probabilities.sum()
+
+    def add_objective_function(self, cycle_penalty: float = 0.0):
+        """
+        Probability weighted trading profit of the scenarios
+
+        :param cycle_penalty: Optional penalty per MWh discharged (£/MWh)
+        :return:
+        """
+        super().add_objective_function(cycle_penalty=cycle_penalty)
+        weights = np.repeat(self.probabilities, self.n_periods)
+        self.c[self._block(CHARGE)] *= weights
+        self.c[self._block(DISCHARGE)] *= weights
+
+    def add_non_anticipativity_constraints(self):
+        """
+        The first-stage charge and discharge of every scenario equal those of scenario 0
+        :return:
+        """
+        if self.n_scenarios == 1:
+            return
+
+        # One row per later scenario and first-stage period: x[s, t] - x[0, t] = 0
+        scenarios = np.repeat(np.arange(1, self.n_scenarios), self.first_stage_periods)
+        periods = np.tile(np.arange(self.first_stage_periods), self.n_scenarios - 1)
+        n_rows = len(scenarios)
+        rows = np.r_[np.arange(n_rows), np.arange(n_rows)]
+        for block in (CHARGE, DISCHARGE):
+            columns = block * self.T + np.r_[scenarios * self.n_periods + periods, periods]
+            matrix = sp.csr_matrix((np.r_[np.ones(n_rows), -np.ones(n_rows)], (rows, columns)),
+                                   shape=(n_rows, N_BLOCKS * self.T))
+            self.constraint_blocks.append((matrix, np.zeros(n_rows), np.zeros(n_rows)))
+
+    def update_horizon(self, scenario_prices: np.ndarray, init_charge: float | int,
+                       probabilities: np.ndarray | None = None):
+        """
+        Update the forecasts, the probabilities and the initial SoC in place, the constraint matrix is left untouched
+
+        :param scenario_prices: (scenarios x periods) array of price forecasts for the new horizon
+        :param init_charge: Energy level at the start of the new horizon (MWh)
+        :param probabilities: Probability of every scenario, equally likely if None
+        :return:
+        """
+        self.probabilities = self._normalise(probabilities, self.n_scenarios)
+        prices = np.asarray(scenario_prices, dtype=np.float64).ravel()
+        super(PortfolioMatrixModel, self).update_horizon(import_rate=prices, export_rate=prices,
+                                                         init_charge=init_charge)
+
+    def first_stage_schedule(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :return: charge: Committed charge of every first-stage period (MW)
+                 discharge: Committed discharge of every first-stage period (MW)
+        """
+        first_stage = slice(0, self.first_stage_periods)
+        return self.asset_values(CHARGE)[0, first_stage], self.asset_values(DISCHARGE)[0, first_stage]
+
+    def collect_first_stage_columns(self, realised_prices: np.ndarray) -> dict:
+        """
+        :param realised_prices: Prices that cleared for the first-stage periods
+        :return: HH result columns of the committed schedule settled at the realised prices, in the schema of
+                 Battery.collect_opt_columns
+        """
+        first_stage = slice(0, self.first_stage_periods)
+        charge, discharge = self.first_stage_schedule()
+        realised_prices = np.asarray(realised_prices, dtype=np.float64)[:self.first_stage_periods]
+
+        return build_result_columns(charge=charge, discharge=discharge,
+                                    charge_bool=np.round(self.asset_values(CHARGE_BOOL)[0, first_stage]),
+                                    discharge_bool=np.round(self.asset_values(DISCHARGE_BOOL)[0, first_stage]),
+                                    energy=self.asset_values(ENERGY)[0, first_stage],
+                                    import_rate=realised_prices, export_rate=realised_prices,
+                                    battery_cap=self.battery_cap[0], M=self.M)
@@ -1,8 +1,38 @@
 import streamlit as st
-from timeseries_echart.line_chart import render_timeseries_line_chart
+from timeseries_echart.line_chart import render_timeseries_line_chart, chart_series, SERIES_METHODS, MAX_POINTS
+from tools.parquet_sink import read_results
 import pandas as pd
+import datetime
 import os
 
+# Only the columns plotted by the line chart are loaded
+CHART_COLUMNS = list(SERIES_METHODS)
+
+
+@st.cache_data(show_spinner="Loading results...")
+def load_results(results_path: str, modified: float) -> pd.DataFrame:
+    """
+    :param results_path: Parquet dataset directory or results CSV
+    :param modified: Modification time of results_path, so a new run is loaded rather than the cached results
+    :return: The plotted columns of the results
+    """
+    return read_results(results_path, columns=CHART_COLUMNS)
+
+
+@st.cache_data(show_spinner=False)
+def load_chart_series(results_path: str, modified: float, start: datetime.datetime, end: datetime.datetime) -> dict:
+    """
+    :param results_path: Parquet dataset directory or results CSV
+    :param modified: Modification time of results_path
+    :param start: Inclusive start of the plotted window
+    :param end: Inclusive end of the plotted window
+    :return: Downsampled chart data of the window, full HH resolution once the window fits in MAX_POINTS
+    """
+    results_df = load_results(results_path, modified)
+    in_window = (results_df["datetime"] >= start) & (results_df["datetime"] <= end)
+
+    return chart_series(results_df[in_window], max_points=MAX_POINTS)
+
 
 def main():
 
@@ -12,11 +42,24 @@ def main():
     # Retrieve the saved optimised battery profile from the data file
     file_location = os.path.join(os.path.dirname(__file__), "results/").replace('\\', '/')
 
-    results_data = pd.read_csv(file_location + "avg_1_cycle_optimised_df.csv")
-    results_df = pd.DataFrame(results_data)
-    results_df["datetime"] = pd.to_datetime(results_df["datetime"], format="%Y-%m-%d %H:%M:%S")
+    # Prefer the partitioned Parquet dataset written by run.py and fall back to the CSV of older runs
+    results_path = file_location + "avg_1_cycle_optimised"
+    if not os.path.isdir(results_path):
+        results_path = file_location + "avg_1_cycle_optimised_df.csv"
+    modified = os.path.getmtime(results_path)
+    results_df = load_results(results_path, modified)
+
+    # Narrowing the window is the zoom level, the window is downsampled to MAX_POINTS on the server
+    first, last = results_df["datetime"].iloc[0].to_pydatetime(), results_df["datetime"].iloc[-1].to_pydatetime()
+    # The slider moves by one dispatch interval of the run, e.g. 30 minutes for HH results
+    interval = (results_df["datetime"].iloc[1] - results_df["datetime"].iloc[0]).to_pytimedelta()
+    start, end = st.slider("Period", min_value=first, max_value=last, value=(first, last),
+                           step=interval, format="DD/MM/YYYY")
 
-    render_timeseries_line_chart(results_df)
+    series = load_chart_series(results_path, modified, start, end)
+    render_timeseries_line_chart(series)
+    st.caption(f"{series['n_points']:,} of {len(results_df):,} {interval.total_seconds() / 60:g}-minute periods "
+               f"shown, narrow the period for full resolution")
 
 
 if __name__ == "__main__":
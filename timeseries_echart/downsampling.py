@@ -0,0 +1,94 @@
+"""
+Server-side downsampling of the HH results before they are sent to the browser.
+
+A multi-year result has hundreds of thousands of HH points per series, far more than a chart a few thousand pixels wide
+can show. Each series is reduced to a point budget with the method that keeps its shape: Largest-Triangle-Three-Buckets
+(LTTB) for the smooth price and SoC lines, and min/max per bucket for the spiky charge and discharge bars so no peak is
+lost. The rows picked for any series are kept for every series, so they still share one x-axis.
+
+Once the selected window holds fewer points than the budget it is sent at full HH resolution.
+"""
+import numpy as np
+import pandas as pd
+
+
+def lttb_indices(values: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets on equally spaced points
+
+    :param values: Series values in time order
+    :param n_out: Number of points to keep, including the first and last point
+    :return: Sorted positions of the kept points
+    """
+    n = len(values)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # The first and last point are always kept, the others are split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    # Mean of every bucket, the third corner of the triangle for the bucket before it
+    sums = np.add.reduceat(values[1:n - 1], edges[:-1] - 1)
+    counts = np.diff(edges)
+    mean_x = (edges[:-1] + edges[1:] - 1) / 2
+    mean_y = sums / counts
+
+    kept = np.empty(n_out, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    x = np.arange(n, dtype=np.float64)
+    for bucket in range(n_out - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        a = kept[bucket]
+        if bucket + 1 < n_out - 2:
+            next_x, next_y = mean_x[bucket + 1], mean_y[bucket + 1]
+        else:
+            next_x, next_y = n - 1, values[n - 1]
+        # Twice the area of the triangle between the last kept point, each candidate and the next bucket's mean
+        areas = np.abs((x[a] - next_x) * (values[start:stop] - values[a]) -
+                       (x[a] - x[start:stop]) * (next_y - values[a]))
+        kept[bucket + 1] = start + np.argmax(areas)
+
+    return kept
+
+
+def min_max_indices(values: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Keep the smallest and largest point of every bucket
+
+    :param values: Series values in time order
+    :param n_out: Number of points to keep
+    :return: Sorted positions of the kept points
+    """
+    n = len(values)
+    n_buckets = n_out // 2
+    if n_out >= n or n_buckets < 1:
+        return np.arange(n)
+
+    # Pad the last bucket with its last value so every bucket is the same length and the reduction is one call
+    bucket_size = -(-n // n_buckets)
+    padded = np.concatenate([values, np.full(bucket_size * n_buckets - n, values[-1])]).reshape(n_buckets,
+                                                                                                bucket_size)
+    offsets = np.arange(n_buckets) * bucket_size
+    kept = np.concatenate([offsets + padded.argmin(axis=1), offsets + padded.argmax(axis=1)])
+
+    return np.unique(np.minimum(kept, n - 1))
+
+
+DOWNSAMPLERS = {"lttb": lttb_indices, "min_max": min_max_indices}
+
+
+def downsample(results_df: pd.DataFrame, methods: dict, max_points: int) -> pd.DataFrame:
+    """
+    :param results_df: HH results in time order
+    :param methods: Mapping of column to its downsampling method, "lttb" or "min_max"
+    :param max_points: Point budget of the whole chart, split evenly over the columns
+    :return: The rows of results_df kept by any column's downsampling, in time order
+    """
+    if len(results_df) <= max_points:
+        return results_df
+
+    points_per_column = max_points // len(methods)
+    kept = np.unique(np.concatenate([DOWNSAMPLERS[method](results_df[column].to_numpy(dtype=np.float64),
+                                                          points_per_column)
+                                     for column, method in methods.items()]))
+
+    return results_df.iloc[kept]
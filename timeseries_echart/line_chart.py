@@ -1,15 +1,50 @@
 from streamlit_echarts import st_echarts
 import pandas as pd
+import numpy as np
 
+from timeseries_echart.downsampling import downsample
 
-def render_timeseries_line_chart(results_df: pd.DataFrame):
+# Downsampling method of every plotted column, min/max keeps the peaks of the bars
+SERIES_METHODS = {"DC Charging power (MW)": "min_max",
+                  "DC Discharging power (MW)": "min_max",
+                  "Import Price (£/MWh)": "lttb",
+                  "State of Charge (%)": "lttb"}
 
-    x_axis_array = results_df["datetime"].dt.strftime('%H:%M %d-%m-%Y').tolist()
+# Points sent to the browser across all series, about what a wide chart can resolve
+MAX_POINTS = 4000
 
-    charge_volume = [round(value, 1) for value in results_df["DC Charging power (MW)"]]
-    discharge_volume = [round(value, 1) for value in results_df["DC Discharging power (MW)"]]
-    price = results_df["Import Price (£/MWh)"].tolist()
-    soc = [round(value, 1) for value in results_df["State of Charge (%)"]]
+
+def chart_series(results_df: pd.DataFrame, max_points: int = MAX_POINTS) -> dict:
+    """
+    Downsample the results and serialise them to the lists ECharts expects
+
+    :param results_df: HH results in time order with a "datetime" column and the SERIES_METHODS columns
+    :param max_points: Point budget of the whole chart
+    :return: Dictionary of the x-axis labels and the data of every series
+    """
+    sampled_df = downsample(results_df, SERIES_METHODS, max_points)
+
+    def rounded(column: str) -> list:
+        return np.round(sampled_df[column].to_numpy(dtype=np.float64), 1).tolist()
+
+    return {"x_axis": sampled_df["datetime"].dt.strftime('%H:%M %d-%m-%Y').tolist(),
+            "charge": rounded("DC Charging power (MW)"),
+            "discharge": rounded("DC Discharging power (MW)"),
+            "price": rounded("Import Price (£/MWh)"),
+            "soc": rounded("State of Charge (%)"),
+            "n_points": len(sampled_df)}
+
+
+def render_timeseries_line_chart(series: dict):
+    """
+    :param series: Chart data from chart_series
+    :return:
+    """
+    x_axis_array = series["x_axis"]
+    charge_volume = series["charge"]
+    discharge_volume = series["discharge"]
+    price = series["price"]
+    soc = series["soc"]
 
     options = {
         "grid": [
@@ -54,11 +89,11 @@ def render_timeseries_line_chart(results_df: pd.DataFrame):
             {
                 "type": 'inside',
                 "start": 0,
-                "end": 1
+                "end": 100
             },
             {
                 "start": 0,
-                "end": 10
+                "end": 100
             }
         ],
         "series": [{
@@ -86,6 +121,7 @@ def render_timeseries_line_chart(results_df: pd.DataFrame):
                 "smooth": 0.2,
                 "color": '#7A2A2A',
                 "showSymbol": False,
+                "sampling": 'lttb',
             },
             {
                 "name": 'State of Charge (%)',
@@ -97,6 +133,7 @@ def render_timeseries_line_chart(results_df: pd.DataFrame):
                 "smooth": 0.2,
                 "color": '#99A1B7',
                 "showSymbol": False,
+                "sampling": 'lttb',
             }
     ],
     }
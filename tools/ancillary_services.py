@@ -0,0 +1,115 @@
+"""
+This module stacks frequency response availability on top of the energy arbitrage and reports the value of stacking.
+
+The services are bought per EFA block (six 4-hour blocks a day, the first starting at 23:00) and paid per MW of
+availability and hour. Holding availability in a block leaves less power headroom and SoC for the arbitrage in every
+period of that block, which Battery.add_ancillary_services models with one availability variable per service and
+block. Only the availability payment is valued, the energy delivered when the frequency moves is small and roughly
+nets out over a block.
+
+Availability auction results are not shipped with the repo, so the example below uses flat availability prices.
+
+Example:
+  price_inputs = PriceInputs(prices, availability_prices=EXAMPLE_AVAILABILITY_PRICES,
+                             settlement_blocks=efa_blocks(market_price_df["time"]))
+  results = run_serial(price_inputs, ..., backend="matrix", services=SERVICES)
+
+Run from the repository root:
+  $ python -m tools.ancillary_services
+"""
+import pandas as pd
+import numpy as np
+import logging
+import time
+import os
+
+from tools.calculate_revenues import calculate_revenues
+from tools.dispatch_runner import run_serial, DEFAULT_BATTERY_PARAMS
+from tools.price_data_cleaning import process_price_data
+from tools.price_inputs import PriceInputs
+from tools.telemetry import HorizonTelemetry
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Dynamic frequency response services: direction of the response and the hours of full delivery the SoC must hold.
+# A service may also set max_volume (MW), it is otherwise capped at the power rating in its direction.
+SERVICES = {"DCL": {"direction": "up", "duration": 0.25},    # Dynamic Containment, low frequency
+            "DCH": {"direction": "down", "duration": 0.25},  # Dynamic Containment, high frequency
+            "DML": {"direction": "up", "duration": 0.5},     # Dynamic Moderation, low frequency
+            "DMH": {"direction": "down", "duration": 0.5},   # Dynamic Moderation, high frequency
+            "DRL": {"direction": "up", "duration": 1},       # Dynamic Regulation, low frequency
+            "DRH": {"direction": "down", "duration": 1},     # Dynamic Regulation, high frequency
+            }
+
+# Flat availability prices (£/MW/h) of the example, in place of auction results
+EXAMPLE_AVAILABILITY_PRICES = {"DCL": 3.0, "DCH": 1.5, "DML": 4.0, "DMH": 4.0, "DRL": 6.0, "DRH": 8.0}
+
+# EFA blocks are 4 hours long and the EFA day starts at 23:00
+EFA_BLOCK_HOURS = 4
+EFA_DAY_START_HOUR = 23
+
+
+def efa_blocks(times: pd.Series | pd.DatetimeIndex) -> np.ndarray:
+    """
+    :param times: Start time of every period
+    :return: EFA block of every period, numbered consecutively in time since the epoch
+    """
+    hours = pd.DatetimeIndex(times).to_numpy().astype("datetime64[h]").astype(np.int64)
+    return (hours + 24 - EFA_DAY_START_HOUR) // EFA_BLOCK_HOURS
+
+
+def stacking_comparison(market_price_df: pd.DataFrame, availability_prices: dict, services: dict = None,
+                        cycles_per_day: float = 1, horizon_days: int = 7, init_soc: float = 0.5,
+                        battery_params: dict = None, interval_length: float = 0.5,
+                        **solve_kwargs) -> pd.DataFrame:
+    """
+    Dispatch the battery for arbitrage only and for arbitrage stacked with the services, and compare their revenues
+
+    :param market_price_df: Cleaned price data from process_price_data
+    :param availability_prices: Mapping of service name to its availability price (£/MW/h), per period or one value
+    :param services: Services to stack, defaults to every service with an availability price in SERVICES
+    :param cycles_per_day: Daily cycle limit
+    :param horizon_days: Length of each optimised horizon in days
+    :param init_soc: Initial state of charge as a fraction of the capacity
+    :param battery_params: Battery specification, defaults to DEFAULT_BATTERY_PARAMS
+    :param interval_length: Duration of a dispatch period in hours
+    :param solve_kwargs: backend, relax_binaries, mip_rel_gap and time_limit passed to run_serial
+    :return: Annual revenues of both runs, one row per run and year, with the stacked revenue per service
+    """
+    battery_params = battery_params or DEFAULT_BATTERY_PARAMS
+    services = services or {name: SERVICES[name] for name in availability_prices}
+    time_horizon = round(24 / interval_length) * horizon_days
+    price_inputs = PriceInputs(market_price_df["prices"].to_numpy(), availability_prices=availability_prices,
+                               settlement_blocks=efa_blocks(market_price_df["time"]))
+    times = pd.date_range(market_price_df["time"].iloc[0], periods=len(price_inputs),
+                          freq=pd.Timedelta(hours=interval_length))
+
+    annual_revenues = []
+    for run, run_services in (("arbitrage", None), ("stacked", services)):
+        tic = time.perf_counter()
+        results = run_serial(price_inputs, time_horizon=time_horizon, cycles_per_time_horizon=cycles_per_day *
+                             horizon_days, init_charge=init_soc * battery_params["battery_capacity"],
+                             battery_params=battery_params, interval_length=interval_length,
+                             telemetry=HorizonTelemetry(live_summary=False), services=run_services, **solve_kwargs)
+        logging.info(f"{run} dispatch solved in {time.perf_counter() - tic:.1f} seconds")
+
+        optimised_df = results.to_frame()
+        optimised_df.insert(0, "datetime", times)
+        _, annual_df = calculate_revenues(market_price_df.copy(), optimised_df=optimised_df,
+                                          trading_volume=battery_params["battery_capacity"],
+                                          battery_power=battery_params["discharge_power"], round_trip_eff=0.85)
+        annual_df.insert(0, "run", run)
+        annual_revenues.append(annual_df)
+
+    return pd.concat(annual_revenues).rename_axis("year").reset_index()
+
+
+if __name__ == "__main__":
+    market_price_df, _ = process_price_data("input_data.csv", time_horizon=48)
+    one_year = market_price_df.iloc[:48 * 365].reset_index(drop=True)
+
+    comparison_df = stacking_comparison(one_year, EXAMPLE_AVAILABILITY_PRICES, backend="matrix", relax_binaries=True)
+
+    file_location = os.path.join(os.path.dirname(__file__), "..", "results/").replace('\\', '/')
+    comparison_df.to_csv(file_location + "ancillary_stacking.csv", index=False)
@@ -7,15 +7,40 @@ the highest price.
 
 2. Using an MIP optimisation strategy
 
+When the optimisation stacked ancillary services, the availability revenue of every service is reported next to the
+trading profit together with the stacked total.
+
+The simple strategy is also reported in an "ordered" form, which trades the best spread available each day where the
+buy hour comes before the sell hour.
+
 """
+import numpy as np
 import pandas as pd
 
 
+def _daily_price_matrix(day_ids: np.ndarray, prices: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Reshape a time ordered price series into one row per day
+
+    :param day_ids: Day of each price, the days must be contiguous as they are in a time ordered series
+    :param prices: Prices in time order
+    :return: day_price_matrix: (days x periods) array padded with NaN at the end of incomplete days
+             day_starts: Position of the first price of each day
+    """
+    day_starts = np.flatnonzero(np.r_[True, day_ids[1:] != day_ids[:-1]])
+    day_lengths = np.diff(np.r_[day_starts, len(prices)])
+    position_in_day = np.arange(len(prices)) - np.repeat(day_starts, day_lengths)
+
+    day_price_matrix = np.full((len(day_starts), day_lengths.max()), np.nan)
+    day_price_matrix[np.repeat(np.arange(len(day_starts)), day_lengths), position_in_day] = prices
+
+    return day_price_matrix, day_starts
+
+
 def calculate_revenues(prices_df: pd.DataFrame, optimised_df: pd.DataFrame, trading_volume: float | int,
                        battery_power: float | int, round_trip_eff: float):
     """
     Calculate daily and annual revenues based on HH prices and trading volume for both strategies
-    TODO: Ensure that the battery charges each day before it discharges.
 
     :param round_trip_eff: Round trip efficiency p.u.
     :param optimised_df: This is the result df from the optimisation
@@ -42,38 +67,68 @@ def calculate_revenues(prices_df: pd.DataFrame, optimised_df: pd.DataFrame, trad
     hourly_price_df = prices_df.resample("60min").mean()
     hourly_price_df.reset_index(inplace=True)
 
-    hourly_price_df.sort_values(by=["day_count", "prices"], ascending=[True, True], inplace=True)
+    # Reshape the hourly prices into a (days x hours) array, padded with NaN where a day is incomplete
+    hourly_prices = hourly_price_df["prices"].to_numpy()
+    day_price_matrix, day_starts = _daily_price_matrix(hourly_price_df["day_count"].to_numpy(), hourly_prices)
+
+    # The earliest hour with the highest and the lowest price of each day. The trade only counts when the highest
+    # price comes after the lowest, otherwise the day is left at 0
+    max_hour = np.nanargmax(day_price_matrix, axis=1)
+    min_hour = np.nanargmin(day_price_matrix, axis=1)
+    valid_order = max_hour > min_hour
+    days = np.arange(len(day_starts))
 
-    # Group by day_count and apply a function to get the highest and lowest prices else return 0 for that row
-    daily_df = hourly_price_df.groupby("day_count").apply(
-        lambda x: pd.Series({
-            'max_price': x.loc[x['prices'].idxmax()]['prices'],
-            'min_price': x.loc[x['prices'].idxmin()]['prices']
-        }) if x['prices'].idxmax() > x['prices'].idxmin() else pd.Series({'max_price': 0, 'min_price': 0})
-    )
+    daily_df = pd.DataFrame({"max_price": np.where(valid_order, day_price_matrix[days, max_hour], 0.0),
+                             "min_price": np.where(valid_order, day_price_matrix[days, min_hour], 0.0)})
 
     daily_df["daily_price_spread"] = daily_df["max_price"] - daily_df["min_price"]      # hourly spread
     daily_df["simple_daily_profit"] = daily_df["daily_price_spread"] * trading_volume * round_trip_eff # £/MWh * MWh = £
+
+    # Ensure that the battery charges each day before it discharges: sell at each hour against the cheapest hour so
+    # far that day and keep the best of those spreads
+    running_min_price = np.fmin.accumulate(day_price_matrix, axis=1)
+    sell_hour = np.nanargmax(day_price_matrix - running_min_price, axis=1)
+
+    daily_df["ordered_max_price"] = day_price_matrix[days, sell_hour]
+    daily_df["ordered_min_price"] = running_min_price[days, sell_hour]
+    daily_df["ordered_daily_price_spread"] = daily_df["ordered_max_price"] - daily_df["ordered_min_price"]
+    daily_df["ordered_daily_profit"] = daily_df["ordered_daily_price_spread"] * trading_volume * round_trip_eff
+
     daily_df.index = pd.date_range(start=prices_df.index[0], freq="1D", periods=len(daily_df))
 
     # Group by year
     annual_df = daily_df.groupby(daily_df.index.year)[["simple_daily_profit"]].sum()
     annual_df.rename(columns={"simple_daily_profit": "simple_annual_profit"}, inplace=True)
     annual_df["simple_£_kW_year"] = annual_df["simple_annual_profit"] / (battery_power * 1000)      # MW * 1000 =  kW
+    annual_df["ordered_annual_profit"] = daily_df.groupby(daily_df.index.year)["ordered_daily_profit"].sum()
+    annual_df["ordered_£_kW_year"] = annual_df["ordered_annual_profit"] / (battery_power * 1000)
 
     ################################################################################################
     # Now need to calculate the revenues from the optimisation model
     ################################################################################################
 
-    optimised_daily_df = optimised_df.groupby(optimised_df["datetime"].dt.date)[["Trading Profits (£)"]].sum()
+    # Normalising keeps a datetime index, which is much faster to group by than python date objects
+    optimised_daily_df = optimised_df.groupby(optimised_df["datetime"].dt.normalize())[["Trading Profits (£)"]].sum()
     daily_df["optimised_daily_profit"] = optimised_daily_df["Trading Profits (£)"]
 
-    optimised_daily_df.index = pd.to_datetime(optimised_daily_df.index, format="%Y-%m-%d")
-
     optimised_annual_df = optimised_daily_df.groupby(optimised_daily_df.index.year)[["Trading Profits (£)"]].sum()
     annual_df["optimised_annual_profit"] = optimised_annual_df["Trading Profits (£)"]
     annual_df["optimised_£_kW_year"] = annual_df["optimised_annual_profit"] / (battery_power * 1000)  # MW * 1000 =  kW
 
+    # Availability revenue of every stacked service, see tools.ancillary_services
+    suffix = " Availability Revenue (£)"
+    service_columns = [column for column in optimised_df.columns if column.endswith(suffix)]
+    if service_columns:
+        service_daily_df = optimised_df.groupby(optimised_df["datetime"].dt.normalize())[service_columns].sum()
+        service_annual_df = service_daily_df.groupby(service_daily_df.index.year).sum()
+        for column in service_columns:
+            service = column[:-len(suffix)]
+            daily_df[f"{service}_daily_revenue"] = service_daily_df[column]
+            annual_df[f"{service}_annual_revenue"] = service_annual_df[column]
+
+        annual_df["stacked_annual_profit"] = annual_df["optimised_annual_profit"] + service_annual_df.sum(axis=1)
+        annual_df["stacked_£_kW_year"] = annual_df["stacked_annual_profit"] / (battery_power * 1000)
+
     return daily_df, annual_df
 
 
@@ -0,0 +1,138 @@
+"""
+This module enforces the cycle budget through a price on discharge throughput instead of a single constraint.
+
+add_max_cycles_constraint sums every discharge variable across the horizon, which couples all periods together. By
+relaxing that constraint into the objective with a multiplier (£ per MWh discharged), every day can be solved on its
+own and in parallel. The multiplier is tuned by bisection until the total discharge throughput sits just inside the
+cycle budget, at which point it is the marginal value of throughput - multiplied by the battery capacity it gives the
+marginal value of one extra cycle.
+
+Each day starts and finishes at the same boundary SoC so the days are independent of each other.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import logging
+
+from tools.dispatch_runner import solve_horizon, DEFAULT_BATTERY_PARAMS
+from tools.result_buffer import ResultBuffer
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def _solve_days(days_args: tuple) -> list:
+    """
+    Worker function for the process pool, solves a chunk of days with the same penalty
+
+    :param days_args: Tuple of (list of daily price arrays, keyword args for solve_horizon)
+    :return: List of the HH result columns of each day
+    """
+    daily_prices, kwargs = days_args
+    return [solve_horizon(prices, **kwargs) for prices in daily_prices]
+
+
+def solve_days_with_penalty(prices: np.ndarray, cycle_penalty: float, boundary_charge: float,
+                            battery_params: dict = None, periods_per_day: int = 48,
+                            executor: ProcessPoolExecutor | None = None, days_per_task: int = 30,
+                            **solve_kwargs) -> tuple[ResultBuffer, float]:
+    """
+    Solve every day independently with a fixed penalty per MWh discharged and no cycle constraint
+
+    :param prices: HH prices for the whole period
+    :param cycle_penalty: Penalty per MWh discharged (£/MWh)
+    :param boundary_charge: Energy level at the start and end of every day (MWh)
+    :param battery_params: Battery specification, defaults to DEFAULT_BATTERY_PARAMS
+    :param periods_per_day: Number of dispatch periods in a day
+    :param executor: Optional process pool to solve the days in parallel, solved in this process when None
+    :param days_per_task: Number of days sent to a worker at a time
+    :param solve_kwargs: solver_selection, mip_rel_gap, time_limit and backend passed to solve_horizon
+    :return: results: Columnar HH results in time order
+             discharge_throughput: Total energy discharged (MWh)
+    """
+    day_starts = range(0, len(prices), periods_per_day)
+    daily_prices = [prices[start:start + periods_per_day] for start in day_starts]
+
+    kwargs = dict(init_charge=boundary_charge,
+                  final_charge=boundary_charge,
+                  battery_params=battery_params or DEFAULT_BATTERY_PARAMS,
+                  max_cycles=None,
+                  cycle_penalty=cycle_penalty,
+                  interval_length=24 / periods_per_day,
+                  **solve_kwargs)
+    tasks = [(daily_prices[i:i + days_per_task], kwargs) for i in range(0, len(daily_prices), days_per_task)]
+
+    chunk_results = executor.map(_solve_days, tasks) if executor else map(_solve_days, tasks)
+
+    results = ResultBuffer(capacity=len(prices))
+    for chunk in chunk_results:
+        for day_columns in chunk:
+            results.append(day_columns)
+
+    # MW * interval length in hours = MWh
+    discharge_throughput = 24 / periods_per_day * results["DC Discharging power (MW)"].sum()
+
+    return results, discharge_throughput
+
+
+def tune_cycle_penalty(prices: np.ndarray, total_cycles: float, boundary_charge: float, battery_params: dict = None,
+                       periods_per_day: int = 48, tolerance: float = 0.005, max_iterations: int = 20,
+                       max_workers: int | None = None, **solve_kwargs) -> tuple[ResultBuffer, dict]:
+    """
+    Find the smallest penalty per MWh discharged that keeps the total throughput within the cycle budget
+
+    :param prices: HH prices for the whole period
+    :param total_cycles: Number of full cycles allowed over the whole period
+    :param boundary_charge: Energy level at the start and end of every day (MWh)
+    :param battery_params: Battery specification, defaults to DEFAULT_BATTERY_PARAMS
+    :param periods_per_day: Number of dispatch periods in a day
+    :param tolerance: Stop once the throughput is within this fraction of the budget
+    :param max_iterations: Maximum number of bisection steps
+    :param max_workers: Number of worker processes, defaults to the number of CPUs
+    :param solve_kwargs: solver_selection, mip_rel_gap, time_limit and backend passed to solve_horizon
+    :return: results: Columnar HH results in time order for the tuned penalty
+             summary: Dictionary with the tuned penalty, the marginal value of a cycle and the throughput used
+    """
+    battery_params = battery_params or DEFAULT_BATTERY_PARAMS
+    throughput_budget = total_cycles * battery_params["battery_capacity"]
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+
+        def solve(penalty):
+            return solve_days_with_penalty(prices, penalty, boundary_charge, battery_params=battery_params,
+                                           periods_per_day=periods_per_day, executor=executor, **solve_kwargs)
+
+        lower = 0.0
+        results, throughput = solve(lower)
+        upper = lower
+
+        if throughput > throughput_budget:
+            # Double the penalty until the budget is respected to bracket the multiplier
+            upper = 1.0
+            results, throughput = solve(upper)
+            while throughput > throughput_budget:
+                lower, upper = upper, upper * 2
+                results, throughput = solve(upper)
+
+            for iteration in range(max_iterations):
+                if throughput >= throughput_budget * (1 - tolerance):
+                    break
+                penalty = (lower + upper) / 2
+                candidate_results, candidate_throughput = solve(penalty)
+                if candidate_throughput > throughput_budget:
+                    lower = penalty
+                else:
+                    upper, results, throughput = penalty, candidate_results, candidate_throughput
+                logging.info(f"Bisection step {iteration + 1}: penalty £{penalty:.3f}/MWh, "
+                             f"throughput {candidate_throughput:,.0f}/{throughput_budget:,.0f} MWh")
+
+    summary = {"cycle_penalty": upper,
+               "marginal_cycle_value": upper * battery_params["battery_capacity"],
+               "discharge_throughput": throughput,
+               "cycles_used": throughput / battery_params["battery_capacity"],
+               "trading_profit": results["Trading Profits (£)"].sum(),
+               }
+
+    logging.info(f"Tuned penalty £{upper:.3f}/MWh, marginal value of a cycle £{summary['marginal_cycle_value']:,.0f}"
+                 f", {summary['cycles_used']:,.1f}/{total_cycles:,.1f} cycles used")
+
+    return results, summary
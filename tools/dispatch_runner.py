@@ -0,0 +1,397 @@
+"""
+This module runs the rolling-horizon battery dispatch either serially (each horizon starts from the previous horizon's
+final SoC, as in run.py) or in parallel.
+
+For the parallel run the price series is broken into independent blocks (e.g. one per year or per month). Every block
+starts from a fixed boundary SoC and is forced to finish at the same SoC, so the blocks no longer depend on each other
+and can be solved across a ProcessPoolExecutor. The results are then stitched back together in time order.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import logging
+import math
+import time
+import os
+
+from battery_model import Battery
+from dp_model import DynamicProgrammingBattery
+from tools.horizon_cache import HorizonCache
+from tools.parquet_sink import ParquetResultSink
+from tools.price_inputs import PriceInputs
+from tools.result_buffer import ResultBuffer
+from tools.telemetry import HorizonTelemetry
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# The 100MW/100MWh battery used in run.py
+DEFAULT_BATTERY_PARAMS = {"battery_capacity": 100,  # MWh
+                          "discharge_power": 100,  # MW
+                          "charge_power": 100,  # MW
+                          "charging_eff": 0.922,  # charge_eff * discharge_eff = round_trip_eff of 85%
+                          "discharging_eff": 0.922,
+                          "import_grid_lim": 100,  # MW
+                          "export_grid_lim": 100,  # MW
+                          "max_soc": 1,  # p.u.
+                          "min_soc": 0,  # p.u.
+                          }
+
+
+def build_battery(prices: np.ndarray, init_charge: float, battery_params: dict, max_cycles: float | None,
+                  backend: str = "pyomo", final_charge: float | None = None, persistent: bool = False,
+                  cycle_penalty: float = 0.0, relax_binaries: bool = False,
+                  segment_costs: np.ndarray | None = None,
+                  interval_length: float = 0.5,
+                  export_prices: np.ndarray | None = None,
+                  services: dict | None = None,
+                  availability_prices: dict | None = None,
+                  settlement_blocks: np.ndarray | None = None) -> Battery | DynamicProgrammingBattery:
+    """
+    Build the battery model with its objective and constraints for a single horizon
+
+    :param prices: HH prices for the horizon, used for import and also for export unless export_prices is given
+    :param init_charge: Energy level at the start of the horizon (MWh)
+    :param battery_params: Battery specification, see DEFAULT_BATTERY_PARAMS
+    :param max_cycles: Number of cycles allowed within the horizon, None leaves the throughput uncapped
+    :param backend: Battery model backend, "pyomo", "matrix" or "dp" for the solver-free dynamic program
+    :param final_charge: Optional energy level the battery must finish the horizon at (MWh)
+    :param persistent: Build the model so it can be updated in place for the next horizon
+    :param cycle_penalty: Penalty per MWh discharged (£/MWh) added to the objective
+    :param relax_binaries: Solve as an LP and only add binaries where it charges and discharges at the same time,
+                           the dynamic program never does both so it ignores this
+    :param segment_costs: Optional degradation cost per MWh discharged from each SoC segment, bottom segment first,
+                          see tools.degradation
+    :param interval_length: Duration of a dispatch period in hours, 0.5 for HH prices
+    :param export_prices: Optional export prices for the horizon when they differ from the import prices
+    :param services: Optional ancillary services stacked on the arbitrage, see tools.ancillary_services.SERVICES
+    :param availability_prices: Availability price of every service and period of the horizon (£/MW/h)
+    :param settlement_blocks: Settlement block of every period of the horizon
+    :return: battery: Battery model ready to be solved
+    """
+    export_prices = prices if export_prices is None else export_prices
+
+    if backend == "dp":
+        if services:
+            # The availability is held over a whole settlement block, which couples the periods of the block and does
+            # not fit the period-by-period recursion over energy levels
+            raise ValueError("Ancillary services need the 'pyomo' or 'matrix' backend")
+        battery = DynamicProgrammingBattery(export_rate=export_prices,
+                                            import_rate=prices,
+                                            init_charge=init_charge,
+                                            interval_length=interval_length,
+                                            **battery_params)
+    else:
+        battery = Battery(export_rate=export_prices,
+                          import_rate=prices,
+                          init_charge=init_charge,
+                          backend=backend,
+                          persistent=persistent,
+                          relax_binaries=relax_binaries,
+                          interval_length=interval_length,
+                          **battery_params)
+
+    battery.add_objective_function(cycle_penalty=cycle_penalty)
+    battery.add_storage_constraints()
+    if max_cycles is not None:
+        battery.add_max_cycles_constraint(max_daily_cycles=max_cycles)
+    if final_charge is not None:
+        battery.add_terminal_soc_constraint(final_charge=final_charge)
+    if segment_costs is not None:
+        battery.add_degradation_cost(segment_costs)
+    if services:
+        battery.add_ancillary_services(services, availability_prices, settlement_blocks)
+
+    return battery
+
+
+def solve_horizon(prices: np.ndarray, init_charge: float, battery_params: dict, max_cycles: float | None,
+                  solver_selection: str, mip_rel_gap: float, time_limit: float | int, backend: str = "pyomo",
+                  day_count: int = 1, final_charge: float | None = None,
+                  cycle_penalty: float = 0.0, interval_length: float = 0.5, threads: int | None = None) -> dict:
+    """
+    Build and solve the battery model for a single horizon
+
+    :param prices: HH prices for the horizon (used for both import and export)
+    :param init_charge: Energy level at the start of the horizon (MWh)
+    :param battery_params: Battery specification, see DEFAULT_BATTERY_PARAMS
+    :param max_cycles: Number of cycles allowed within the horizon, None leaves the throughput uncapped
+    :param solver_selection: Solver name from the registry in solvers.py, e.g. "highs", "cbc" or "cplex"
+    :param mip_rel_gap: Relative MIP gap tolerance
+    :param time_limit: Solver time limit in seconds
+    :param backend: Battery model backend, "pyomo", "matrix" or "dp"
+    :param day_count: Horizon counter passed on to Battery.solve_problem
+    :param final_charge: Optional energy level the battery must finish the horizon at (MWh)
+    :param cycle_penalty: Penalty per MWh discharged (£/MWh) added to the objective
+    :param interval_length: Duration of a dispatch period in hours
+    :param threads: Number of solver threads, the solver's default if None
+    :return: Dictionary of HH result column name to array
+    """
+    battery = build_battery(prices, init_charge, battery_params, max_cycles, backend=backend,
+                            final_charge=final_charge, cycle_penalty=cycle_penalty, interval_length=interval_length)
+    battery.solve_problem(mip_rel_gap=mip_rel_gap, time_limit=time_limit, day_count=day_count,
+                          solver_selection=solver_selection, threads=threads)
+
+    return battery.collect_opt_columns()
+
+
+def run_serial(prices: np.ndarray | PriceInputs, time_horizon: int, cycles_per_time_horizon: float,
+               init_charge: float, battery_params: dict = None, final_charge: float | None = None,
+               persistent: bool = False,
+               solver_selection: str = "cplex", mip_rel_gap: float = 0.0001, time_limit: float | int = 20,
+               backend: str = "pyomo", relax_binaries: bool = False,
+               sink: ParquetResultSink | None = None, telemetry: HorizonTelemetry | None = None,
+               cache: HorizonCache | None = None, segment_costs: np.ndarray | None = None,
+               interval_length: float = 0.5, services: dict | None = None,
+               threads: int | None = None) -> ResultBuffer:
+    """
+    Solve consecutive horizons one after another, chaining the final SoC of each horizon into the next one
+
+    :param prices: HH prices for the whole period, or PriceInputs with separate import and export prices
+    :param time_horizon: Time horizon in periods, half hours unless interval_length is set
+    :param cycles_per_time_horizon: Total number of cycles per time horizon
+    :param init_charge: Energy level at the start of the first horizon (MWh)
+    :param battery_params: Battery specification, defaults to DEFAULT_BATTERY_PARAMS
+    :param final_charge: Optional energy level the last horizon must finish at (MWh)
+    :param persistent: Build the model once and only update the prices and initial SoC for each following horizon
+                       of the same length, re-solving through a persistent solver interface with a warm start
+    :param solver_selection: Solver name from the registry in solvers.py, "highs" solves in-process on either
+                             backend, "cbc" and "cplex" are executables on the Pyomo backend
+    :param mip_rel_gap: Relative MIP gap tolerance
+    :param time_limit: Solver time limit in seconds
+    :param backend: Battery model backend, "pyomo", "matrix" or "dp"
+    :param relax_binaries: Solve each horizon as an LP and only add binaries where it charges and discharges at the
+                           same time
+    :param sink: Optional Parquet sink, each horizon is streamed to it as soon as it is solved instead of being kept
+                 in memory
+    :param telemetry: Optional telemetry sink that receives one record per solved horizon, its live summary
+                      replaces the "Optimising horizon" prints
+    :param cache: Optional store of solved horizons, a horizon whose prices, initial SoC and settings were solved
+                  before is loaded from it instead of being solved again. Only horizons solved to optimality are
+                  stored
+    :param segment_costs: Optional degradation cost per MWh discharged from each SoC segment, bottom segment first,
+                          see tools.degradation
+    :param interval_length: Duration of a dispatch period in hours, the horizon is time_horizon periods of this length
+    :param services: Optional ancillary services stacked on the arbitrage, see tools.ancillary_services.SERVICES,
+                     their availability prices and settlement blocks are taken from prices, which must then be
+                     PriceInputs
+    :param threads: Number of solver threads, the solver's default if None. It does not change the optimum, so it
+                    is left out of the cache key
+    :return: results: Columnar HH results of every horizon in time order, empty when a sink is given
+    """
+    battery_params = battery_params or DEFAULT_BATTERY_PARAMS
+    price_inputs = prices if isinstance(prices, PriceInputs) else PriceInputs(prices)
+    n_horizons = math.ceil(len(prices) / time_horizon)
+    if telemetry:
+        telemetry.start(n_horizons)
+
+    results = ResultBuffer(capacity=0 if sink else len(prices))
+    horizon_init_charge = init_charge
+    battery = None
+    availability_sliced = blocks_sliced = battery_blocks = None
+
+    for day_count in range(1, n_horizons + 1):
+        start, stop = (day_count - 1) * time_horizon, day_count * time_horizon
+        prices_sliced, export_sliced = price_inputs.horizon(start, stop)
+        if services:
+            availability_sliced, blocks_sliced = price_inputs.service_horizon(start, stop)
+        horizon_final_charge = final_charge if day_count == n_horizons else None
+
+        if not telemetry:
+            print('\n')
+            print('Optimising horizon {}/{}'.format(day_count, n_horizons))
+
+        cached = None
+        if cache:
+            cache_key = cache.key(prices_sliced, horizon_init_charge, battery_params,
+                                  export_prices=None if price_inputs.single_price else export_sliced,
+                                  availability=None if not services else
+                                  {**availability_sliced, "settlement_blocks": blocks_sliced},
+                                  services=services,
+                                  max_cycles=cycles_per_time_horizon, final_charge=horizon_final_charge,
+                                  backend=backend, solver_selection=solver_selection, mip_rel_gap=mip_rel_gap,
+                                  time_limit=time_limit, relax_binaries=relax_binaries,
+                                  segment_costs=None if segment_costs is None else list(segment_costs),
+                                  interval_length=interval_length)
+            cached = cache.load(cache_key)
+
+        tic = time.perf_counter()
+        rebuilt = False
+        if cached:
+            horizon_columns, solve_metrics = cached
+            build_time = 0.0
+        else:
+            # A shorter final horizon, a terminal SoC target or settlement blocks that line up differently with the
+            # periods change the model structure, so it is rebuilt
+            rebuilt = not (persistent and battery is not None and battery.n_periods == len(prices_sliced)
+                           and horizon_final_charge is None
+                           and (not services or np.array_equal(blocks_sliced, battery_blocks)))
+            if not rebuilt:
+                # Only passed with services, the dynamic program has no availability prices to update
+                service_kwargs = {"availability_prices": availability_sliced} if services else {}
+                battery.update_horizon(import_rate=prices_sliced, export_rate=export_sliced,
+                                       init_charge=horizon_init_charge, **service_kwargs)
+            else:
+                battery = build_battery(prices_sliced,
+                                        init_charge=horizon_init_charge,
+                                        battery_params=battery_params,
+                                        max_cycles=cycles_per_time_horizon,
+                                        backend=backend,
+                                        final_charge=horizon_final_charge,
+                                        persistent=persistent,
+                                        relax_binaries=relax_binaries,
+                                        segment_costs=segment_costs,
+                                        interval_length=interval_length,
+                                        export_prices=export_sliced,
+                                        services=services,
+                                        availability_prices=availability_sliced,
+                                        settlement_blocks=blocks_sliced)
+                battery_blocks = blocks_sliced
+            build_time = time.perf_counter() - tic
+
+            battery.solve_problem(mip_rel_gap=mip_rel_gap, time_limit=time_limit, day_count=day_count,
+                                  solver_selection=solver_selection, threads=threads)
+            solve_metrics = battery.metrics
+
+            tic = time.perf_counter()
+            horizon_columns = battery.collect_opt_columns()
+            if cache:
+                cache.store(cache_key, horizon_columns, solve_metrics)
+
+        if sink:
+            sink.write(horizon_columns)
+        else:
+            results.append(horizon_columns)
+
+        # This is looped so the next horizon starts from this horizon's final SoC
+        horizon_init_charge = float(horizon_columns["State of Energy (MWh)"][-1])
+
+        if telemetry:
+            telemetry.record(horizon=day_count, n_periods=len(prices_sliced), build_time_s=build_time,
+                             solve_metrics={**solve_metrics, "solve_time_s": 0.0} if cached else solve_metrics,
+                             end_soc=horizon_init_charge, collect_time_s=time.perf_counter() - tic, rebuilt=rebuilt,
+                             cached=cached is not None)
+
+    if cache:
+        cache.log_summary()
+
+    return results
+
+
+def _solve_block(block_args: tuple) -> tuple[int, ResultBuffer]:
+    """
+    Worker function for the process pool, it needs to be importable at module level to be pickled
+
+    :param block_args: Tuple of (block number, positional args, keyword args) for run_serial, the keyword args may
+                       hold a telemetry_path the block appends its horizon records to
+    :return: The block number with the result of run_serial
+    """
+    block_number, args, kwargs = block_args
+    telemetry_path = kwargs.pop("telemetry_path", None)
+    if telemetry_path is None:
+        return block_number, run_serial(*args, **kwargs)
+
+    # Every record is a single short line flushed on its own, so the blocks can append to the same file
+    with HorizonTelemetry(telemetry_path, live_summary=False, context={"block": block_number}) as telemetry:
+        return block_number, run_serial(*args, telemetry=telemetry, **kwargs)
+
+
+def run_parallel(market_price_df: pd.DataFrame, block_freq: str, time_horizon: int, cycles_per_time_horizon: float,
+                 boundary_charge: float, battery_params: dict = None, max_workers: int | None = None,
+                 sink: ParquetResultSink | None = None, telemetry_path: str | None = None,
+                 price_inputs: PriceInputs | None = None, **solve_kwargs) -> ResultBuffer:
+    """
+    Break the price series into independent blocks and solve them across a process pool. Every block starts and
+    finishes at boundary_charge, so the results can be stitched back together in time order.
+
+    :param market_price_df: Cleaned price data from process_price_data with "time" and "prices" columns
+    :param block_freq: Pandas period frequency of the blocks, e.g. "Y" for years or "M" for months
+    :param time_horizon: Time horizon in periods within each block
+    :param cycles_per_time_horizon: Total number of cycles per time horizon
+    :param boundary_charge: Energy level at the start and end of every block (MWh)
+    :param battery_params: Battery specification, defaults to DEFAULT_BATTERY_PARAMS
+    :param max_workers: Number of worker processes, defaults to the number of CPUs
+    :param sink: Optional Parquet sink, each block is streamed to it in time order as soon as it is available
+    :param telemetry_path: Optional JSONL file every block appends its per-horizon telemetry records to
+    :param price_inputs: Optional import and export prices of every period of market_price_df, its "prices" column
+                         is used for both if None
+    :param solve_kwargs: persistent, solver_selection, mip_rel_gap, time_limit, threads, backend, relax_binaries,
+                         interval_length and cache passed to run_serial. A HorizonCache is pickled to every worker,
+                         so all the worker processes read and write the one cache directory.
+    :return: results: Columnar HH results of every block in time order, empty when a sink is given
+    """
+    prices = price_inputs or PriceInputs.from_frame(market_price_df)
+    block_id = market_price_df["time"].dt.to_period(block_freq).to_numpy()
+
+    # Start position of each block, the price data is sorted so each block is a contiguous slice
+    block_starts = np.flatnonzero(np.r_[True, block_id[1:] != block_id[:-1]])
+    block_ends = np.r_[block_starts[1:], len(prices)]
+
+    tasks = []
+    for block_number, (start, end) in enumerate(zip(block_starts, block_ends)):
+        # Only the final block is left free to finish at any SoC, matching the serial run
+        is_last_block = block_number == len(block_starts) - 1
+        block_horizon = min(time_horizon, end - start)
+        tasks.append((block_number,
+                      (prices.block(start, end), block_horizon,
+                       cycles_per_time_horizon * block_horizon / time_horizon, boundary_charge),
+                      dict(battery_params=battery_params,
+                           final_charge=None if is_last_block else boundary_charge,
+                           telemetry_path=telemetry_path,
+                           **solve_kwargs)))
+
+    logging.info(f"Solving {len(tasks)} blocks across {max_workers or os.cpu_count()} processes")
+
+    # executor.map yields the blocks in submission order, so they are stitched back together in time order
+    results = ResultBuffer(capacity=0 if sink else len(prices))
+    tic = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for block_number, block_buffer in executor.map(_solve_block, tasks):
+            logging.info(f"Block {block_number + 1}/{len(tasks)} done, {time.perf_counter() - tic:.1f} s elapsed")
+            if sink:
+                sink.write({name: block_buffer[name] for name in block_buffer.columns})
+            else:
+                results.extend(block_buffer)
+
+    return results
+
+
+def compare_serial_and_parallel(market_price_df: pd.DataFrame, block_freq: str, time_horizon: int,
+                                cycles_per_time_horizon: float, init_charge: float, battery_params: dict = None,
+                                max_workers: int | None = None, **solve_kwargs) -> dict:
+    """
+    Run the serial chained dispatch and the parallel block dispatch and report the speed-up and profit difference
+
+    :return: Dictionary with the run times, total profits, speed-up and profit difference
+    """
+    prices = market_price_df["prices"].to_numpy(dtype=np.float64)
+
+    tic = time.perf_counter()
+    serial_results = run_serial(prices, time_horizon, cycles_per_time_horizon, init_charge,
+                                battery_params=battery_params, **solve_kwargs)
+    serial_time = time.perf_counter() - tic
+
+    tic = time.perf_counter()
+    parallel_results = run_parallel(market_price_df, block_freq, time_horizon, cycles_per_time_horizon,
+                                    boundary_charge=init_charge, battery_params=battery_params,
+                                    max_workers=max_workers, **solve_kwargs)
+    parallel_time = time.perf_counter() - tic
+
+    serial_profit = serial_results["Trading Profits (£)"].sum()
+    parallel_profit = parallel_results["Trading Profits (£)"].sum()
+
+    comparison = {"serial_time_s": serial_time,
+                  "parallel_time_s": parallel_time,
+                  "speed_up": serial_time / parallel_time,
+                  "serial_profit": serial_profit,
+                  "parallel_profit": parallel_profit,
+                  "profit_difference": parallel_profit - serial_profit,
+                  "profit_difference_pct": (parallel_profit - serial_profit) / serial_profit * 100,
+                  }
+
+    logging.info(f"Serial: {serial_time:.1f} s, Parallel: {parallel_time:.1f} s, "
+                 f"Speed-up: {comparison['speed_up']:.2f}x, "
+                 f"Profit difference: £{comparison['profit_difference']:,.0f} "
+                 f"({comparison['profit_difference_pct']:.3f}%)")
+
+    return comparison
@@ -0,0 +1,119 @@
+"""
+On-disk store of solved horizons for incremental backtests.
+
+Every horizon solved to optimality is saved under a key hashed from everything that determines its solution: the
+horizon's prices, the battery specification, the initial SoC and the solve settings. When run_serial is given a
+HorizonCache it looks each horizon up before building the model, so a rerun after a few days of prices were corrected
+only re-solves the horizons holding those days, plus any later horizon whose starting SoC moved as a result. Prices
+appended at the end of the file only cost the solve of the (previously partial) last horizon and the new ones.
+
+Layout:
+  <root_path>/<key>.npz    the result columns of the horizon and its solve metrics
+"""
+import numpy as np
+import hashlib
+import logging
+import json
+import os
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Bump when the models change in a way that changes their solutions, so existing entries are no longer used
+CACHE_VERSION = 1
+
+# The initial SoC is rounded before hashing so float noise in the chained SoC does not cause a miss (MWh)
+SOC_DECIMALS = 6
+
+
+def _to_json(obj):
+    # NumPy scalars in the solve metrics are not JSON serialisable
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class HorizonCache:
+
+    def __init__(self, root_path: str):
+        """
+        :param root_path: Directory the solved horizons are stored in
+        """
+        self.root_path = root_path
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root_path, exist_ok=True)
+
+    def key(self, prices: np.ndarray, init_charge: float, battery_params: dict,
+            export_prices: np.ndarray | None = None, availability: dict | None = None, **settings) -> str:
+        """
+        :param prices: HH prices of the horizon
+        :param init_charge: Energy level at the start of the horizon (MWh)
+        :param battery_params: Battery specification
+        :param export_prices: Export prices of the horizon when they differ from prices
+        :param availability: Availability prices of every service and the settlement blocks of the horizon, keyed by
+                             name
+        :param settings: Anything else the solution depends on, e.g. max_cycles, backend and mip_rel_gap
+        :return: Hex digest identifying the horizon's solution
+        """
+        digest = hashlib.sha256(np.ascontiguousarray(prices, dtype=np.float64).tobytes())
+        if export_prices is not None:
+            digest.update(np.ascontiguousarray(export_prices, dtype=np.float64).tobytes())
+        for name in sorted(availability or {}):
+            digest.update(name.encode())
+            digest.update(np.ascontiguousarray(availability[name], dtype=np.float64).tobytes())
+        inputs = {"version": CACHE_VERSION,
+                  "init_charge": round(float(init_charge), SOC_DECIMALS),
+                  "battery_params": battery_params,
+                  **settings}
+        digest.update(json.dumps(inputs, sort_keys=True, default=str).encode())
+
+        return digest.hexdigest()[:32]
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root_path, f"{key}.npz")
+
+    def load(self, key: str) -> tuple[dict, dict] | None:
+        """
+        :param key: Key from HorizonCache.key
+        :return: The result columns and solve metrics of the horizon, None if it has not been solved before
+        """
+        path = self._path(key)
+        if not os.path.isfile(path):
+            self.misses += 1
+            return None
+
+        with np.load(path) as stored:
+            names = json.loads(str(stored["names"]))
+            columns = {name: stored[f"column_{i}"] for i, name in enumerate(names)}
+            metrics = json.loads(str(stored["metrics"]))
+        self.hits += 1
+
+        return columns, metrics
+
+    def store(self, key: str, columns: dict, metrics: dict):
+        """
+        Save a solved horizon, written to a temporary file first so an interrupted run never leaves a partial entry.
+        Horizons that did not solve to optimality, e.g. stopped by the time limit, are not saved so a rerun solves
+        them again. Every process writes its own temporary file, so processes can share one cache directory.
+
+        :param key: Key from HorizonCache.key
+        :param columns: Result columns of the horizon, as returned by collect_opt_columns
+        :param metrics: Solve metrics of the horizon
+        :return:
+        """
+        if metrics.get("termination") != "optimal":
+            logging.info(f"Horizon {key} not cached, its termination was {metrics.get('termination')}")
+            return
+
+        temp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as file:
+            np.savez(file,
+                     names=np.array(json.dumps(list(columns))),
+                     metrics=np.array(json.dumps(metrics, default=_to_json)),
+                     **{f"column_{i}": np.asarray(values) for i, values in enumerate(columns.values())})
+        os.replace(temp_path, self._path(key))
+
+    def log_summary(self):
+        total = self.hits + self.misses
+        logging.info(f"Reused {self.hits}/{total} solved horizons from {self.root_path}, solved {self.misses}")
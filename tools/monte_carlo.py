@@ -0,0 +1,241 @@
+"""
+This module values the battery against thousands of synthetic price paths rather than the single historical path, to
+give a distribution of annual revenues for investment decisions.
+
+Synthetic years are built by a seasonal block bootstrap of the cleaned history: the year is split into blocks of
+block_days, and each block is drawn from a randomly chosen historical year at roughly the same time of year, so every
+path keeps the intra-day shape, the within-week autocorrelation and the seasonality of the history while mixing the
+years. The paths are generated with NumPy fancy indexing on a (days x periods) view of the history.
+
+Every path is dispatched with the fast settings of the matrix backend: the persistent model updated in place over five
+73-day horizons, so every horizon gets the same cycle budget, solved as an LP with the binaries only brought back where
+needed (about 1 s per path on one core). The paths are split over a
+ProcessPoolExecutor and never exist all at once: the history is sent to every worker once through the pool initializer,
+each worker rebuilds its own paths from (seed, path number), and only the annual summary of a path is sent back, so
+memory stays flat however many paths are run.
+
+The distribution is reported with the metrics of results/annual_profit_by_scenario.csv. P90 is the value exceeded by
+90% of the paths (the conservative case) and P10 the value exceeded by 10% of them.
+
+Example:
+  paths_df = run_monte_carlo(prices, n_paths=1000, seed=42)
+  percentile_summary(paths_df)
+
+Run from the repository root:
+  $ python -m tools.monte_carlo
+"""
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import numpy as np
+import logging
+import time
+import os
+
+from tools.calculate_revenues import calculate_revenues
+from tools.dispatch_runner import run_serial, DEFAULT_BATTERY_PARAMS
+from tools.price_data_cleaning import process_price_data
+from tools.telemetry import HorizonTelemetry
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Days in a synthetic year, the calendar of every path is a non-leap year
+PATH_DAYS = 365
+
+# Metrics of annual_profit_by_scenario.csv reported for every path
+PATH_METRICS = ["simple_£_kW_year", "ordered_£_kW_year", "optimised_£_kW_year"]
+
+# Settings of the fast dispatch used for every path, overridable through run_monte_carlo's solve_kwargs. The horizon is
+# given in days and converted to periods of the path's interval length by value_path.
+FAST_DISPATCH = {"backend": "matrix", "relax_binaries": True, "persistent": True, "horizon_days": 73}
+
+# History and settings shared by every path, set once in each worker process by _init_worker
+_shared_days = None
+_shared_settings = None
+
+
+def daily_matrix(prices: np.ndarray, periods_per_day: int = 48) -> np.ndarray:
+    """
+    :param prices: Cleaned prices in time order, starting at midnight
+    :param periods_per_day: Number of dispatch periods in a day
+    :return: (days x periods) view of the complete days of the history
+    """
+    n_days = len(prices) // periods_per_day
+    return np.asarray(prices[:n_days * periods_per_day]).reshape(n_days, periods_per_day)
+
+
+def bootstrap_paths(days: np.ndarray, n_paths: int, rng: np.random.Generator, block_days: int = 7,
+                    season_window: int = 14, first_day_of_year: int = 0) -> np.ndarray:
+    """
+    Draw synthetic years of prices by a seasonal block bootstrap. A block's time of year is found by counting
+    PATH_DAYS days from the history's calendar day first_day_of_year, so the leap days of the history drift the
+    blocks by a day every four years, well within season_window.
+
+    :param days: (days x periods) history from daily_matrix, at least one full year
+    :param n_paths: Number of synthetic years to draw
+    :param rng: Random generator
+    :param block_days: Number of consecutive historical days kept together in a block
+    :param season_window: A block may start up to this many days either side of its position in the year
+    :param first_day_of_year: Day of the year of the history's first day, 0 for 1 January, the paths start on
+                              1 January
+    :return: (n_paths x PATH_DAYS * periods) array of prices
+    """
+    n_days, periods_per_day = days.shape
+    n_years = n_days // PATH_DAYS
+    if n_years < 1:
+        raise ValueError(f"The bootstrap needs at least {PATH_DAYS} days of history, got {n_days}")
+
+    n_blocks = -(-PATH_DAYS // block_days)
+    # Day of the history's first year with the same day of the year as every block of the path
+    positions = (np.arange(n_blocks) * block_days - first_day_of_year) % PATH_DAYS
+
+    # Start day of every block: a random historical year at the block's time of year, shifted by a few days
+    years = rng.integers(0, n_years, size=(n_paths, n_blocks))
+    shifts = rng.integers(-season_window, season_window + 1, size=(n_paths, n_blocks))
+    starts = np.clip(years * PATH_DAYS + positions + shifts, 0, n_days - block_days)
+
+    day_index = (starts[:, :, None] + np.arange(block_days)).reshape(n_paths, -1)[:, :PATH_DAYS]
+
+    return days[day_index].reshape(n_paths, PATH_DAYS * periods_per_day)
+
+
+def _init_worker(days: np.ndarray, settings: dict):
+    global _shared_days, _shared_settings
+    _shared_days = days
+    _shared_settings = settings
+
+
+def value_path(prices: np.ndarray, battery_params: dict, cycles_per_day: float, init_soc: float,
+               round_trip_eff: float, interval_length: float = 0.5, **solve_kwargs) -> dict:
+    """
+    Dispatch one synthetic year and value it like run.py
+
+    :param prices: Prices of the synthetic year
+    :param battery_params: Battery specification
+    :param cycles_per_day: Daily cycle limit
+    :param init_soc: Initial state of charge as a fraction of the capacity
+    :param round_trip_eff: Round trip efficiency of the simple strategies, p.u.
+    :param interval_length: Duration of a dispatch period in hours
+    :param solve_kwargs: horizon_days, or time_horizon in periods which takes precedence, and the backend settings
+                         passed to run_serial
+    :return: Annual metrics of the path, see PATH_METRICS
+    """
+    periods_per_day = round(24 / interval_length)
+    horizon_days = solve_kwargs.pop("horizon_days")
+    time_horizon = solve_kwargs.pop("time_horizon", None) or horizon_days * periods_per_day
+    results = run_serial(prices, time_horizon=time_horizon,
+                         cycles_per_time_horizon=cycles_per_day * time_horizon / periods_per_day,
+                         init_charge=init_soc * battery_params["battery_capacity"], battery_params=battery_params,
+                         interval_length=interval_length, telemetry=HorizonTelemetry(live_summary=False),
+                         **solve_kwargs)
+
+    # The synthetic year is given a non-leap calendar so calculate_revenues can group it by day and year
+    times = pd.date_range("2001-01-01", periods=len(prices), freq=pd.Timedelta(hours=interval_length))
+    prices_df = pd.DataFrame({"time": times, "prices": prices, "day_count": np.arange(len(prices)) // periods_per_day})
+    optimised_df = pd.DataFrame({"datetime": times, "Trading Profits (£)": results["Trading Profits (£)"]})
+    _, annual_df = calculate_revenues(prices_df, optimised_df=optimised_df,
+                                      trading_volume=battery_params["battery_capacity"],
+                                      battery_power=battery_params["discharge_power"], round_trip_eff=round_trip_eff)
+
+    # MW * interval length in hours = MWh
+    discharge = results["DC Discharging power (MW)"].sum() * interval_length
+    return {**{metric: float(annual_df[metric].iloc[0]) for metric in PATH_METRICS},
+            "optimised_annual_profit": float(annual_df["optimised_annual_profit"].iloc[0]),
+            "cycles": discharge / battery_params["battery_capacity"]}
+
+
+def _value_paths(chunk_args: tuple) -> list[dict]:
+    """
+    Worker function for the process pool, rebuilds and values a chunk of paths from the shared history
+
+    :param chunk_args: Tuple of (seed, path numbers)
+    :return: Annual metrics of every path in the chunk
+    """
+    seed, path_numbers = chunk_args
+    settings = dict(_shared_settings)
+    bootstrap = settings.pop("bootstrap")
+
+    path_metrics = []
+    for path_number in path_numbers:
+        # Each path has its own stream, so a path is the same whichever worker or chunk it lands in
+        rng = np.random.default_rng([seed, path_number])
+        prices = bootstrap_paths(_shared_days, 1, rng, **bootstrap)[0].astype(np.float64)
+        path_metrics.append({"path": path_number, **value_path(prices, **settings)})
+
+    return path_metrics
+
+
+def run_monte_carlo(prices: np.ndarray, n_paths: int = 1000, seed: int = 0, cycles_per_day: float = 1,
+                    battery_params: dict = None, init_soc: float = 0.5, round_trip_eff: float = 0.85,
+                    block_days: int = 7, season_window: int = 14, interval_length: float = 0.5,
+                    start_time: pd.Timestamp | None = None, max_workers: int | None = None, paths_per_task: int = 10,
+                    **solve_kwargs) -> pd.DataFrame:
+    """
+    Value the battery on n_paths bootstrapped years across a process pool
+
+    :param prices: Cleaned prices in time order, starting at midnight, at least one full year
+    :param n_paths: Number of synthetic years
+    :param seed: Seed of the bootstrap, the same seed always gives the same paths
+    :param cycles_per_day: Daily cycle limit
+    :param battery_params: Battery specification, defaults to DEFAULT_BATTERY_PARAMS
+    :param init_soc: Initial state of charge as a fraction of the capacity
+    :param round_trip_eff: Round trip efficiency of the simple strategies, p.u.
+    :param block_days: Number of consecutive historical days kept together in a block
+    :param season_window: A block may start up to this many days either side of its position in the year
+    :param interval_length: Duration of a dispatch period in hours
+    :param start_time: Time of the first price, which lines the history up with the calendar of the paths, None
+                       assumes the history starts on 1 January
+    :param max_workers: Number of worker processes, defaults to the number of CPUs
+    :param paths_per_task: Number of paths sent to a worker at a time
+    :param solve_kwargs: Overrides of FAST_DISPATCH, e.g. horizon_days, time_horizon in periods, backend or mip_rel_gap
+    :return: DataFrame with one row of annual metrics per path
+    """
+    days = daily_matrix(np.asarray(prices, dtype=np.float32), periods_per_day=round(24 / interval_length))
+    # The 31 December of a leap year is taken as the last day of the path year
+    first_day_of_year = 0 if start_time is None else min(pd.Timestamp(start_time).dayofyear - 1, PATH_DAYS - 1)
+    settings = {"battery_params": battery_params or DEFAULT_BATTERY_PARAMS,
+                "cycles_per_day": cycles_per_day,
+                "init_soc": init_soc,
+                "round_trip_eff": round_trip_eff,
+                "interval_length": interval_length,
+                "bootstrap": {"block_days": block_days, "season_window": season_window,
+                              "first_day_of_year": first_day_of_year},
+                **FAST_DISPATCH,
+                **solve_kwargs}
+
+    tasks = [(seed, range(start, min(start + paths_per_task, n_paths))) for start in range(0, n_paths, paths_per_task)]
+    logging.info(f"Valuing {n_paths} price paths across {max_workers or os.cpu_count()} processes")
+
+    path_metrics = []
+    tic = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(days, settings)) as executor:
+        for chunk in executor.map(_value_paths, tasks):
+            path_metrics.extend(chunk)
+            logging.info(f"{len(path_metrics)}/{n_paths} paths valued, {time.perf_counter() - tic:.1f} s elapsed")
+
+    return pd.DataFrame(path_metrics)
+
+
+def percentile_summary(paths_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    :param paths_df: Annual metrics of every path from run_monte_carlo
+    :return: P90, P50 and P10 (exceedance) and the mean of every metric, one row per metric
+    """
+    metrics = PATH_METRICS + ["optimised_annual_profit", "cycles"]
+    summary_df = pd.DataFrame({"P90": paths_df[metrics].quantile(0.1),
+                               "P50": paths_df[metrics].quantile(0.5),
+                               "P10": paths_df[metrics].quantile(0.9),
+                               "mean": paths_df[metrics].mean()})
+    summary_df.index.name = "metric"
+
+    return summary_df
+
+
+if __name__ == "__main__":
+    market_price_df, _ = process_price_data("input_data.csv", time_horizon=48)
+    paths_df = run_monte_carlo(market_price_df["prices"].to_numpy(), n_paths=1000, seed=42,
+                               start_time=market_price_df["time"].iloc[0])
+
+    file_location = os.path.join(os.path.dirname(__file__), "..", "results/").replace('\\', '/')
+    paths_df.to_csv(file_location + "monte_carlo_paths.csv", index=False)
+    percentile_summary(paths_df).to_csv(file_location + "monte_carlo_profit_percentiles.csv")
@@ -1,8 +1,11 @@
 import pandas as pd
 import os
 
+from tools.parquet_sink import read_results
 
-def cycling_limit_revenues(one_cycle_filename: str, two_cycle_filename: str) -> pd.DataFrame:
+
+def cycling_limit_revenues(one_cycle_filename: str, two_cycle_filename: str,
+                           interval_length: float = 0.5) -> pd.DataFrame:
 
     # Get the parent directory
     parent_directory = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
@@ -10,9 +13,10 @@ def cycling_limit_revenues(one_cycle_filename: str, two_cycle_filename: str) ->
     # Define filenames and file locations
     file_location = os.path.join(parent_directory, "results/").replace('\\', '/')
 
-    # Read CSV files into DataFrames
-    one_cycle_df = pd.read_csv(os.path.join(file_location, one_cycle_filename), parse_dates=["datetime"])
-    two_cycle_df = pd.read_csv(os.path.join(file_location, two_cycle_filename), parse_dates=["datetime"])
+    # Read the Parquet datasets (or CSV files) into DataFrames, only loading the columns summed below
+    columns = ["DC Discharging power (MW)", "Trading Profits (£)"]
+    one_cycle_df = read_results(os.path.join(file_location, one_cycle_filename), columns=columns)
+    two_cycle_df = read_results(os.path.join(file_location, two_cycle_filename), columns=columns)
 
     # Group by year and sum relevant columns
     one_cycle_annual = one_cycle_df.groupby(one_cycle_df["datetime"].dt.year)[
@@ -20,9 +24,9 @@ def cycling_limit_revenues(one_cycle_filename: str, two_cycle_filename: str) ->
     two_cycle_annual = two_cycle_df.groupby(two_cycle_df["datetime"].dt.year)[
         ["DC Discharging power (MW)", "Trading Profits (£)"]].sum()
 
-    # Calculate total discharge
-    one_cycle_annual["Total Discharge (MWh)"] = one_cycle_annual["DC Discharging power (MW)"] / 2
-    two_cycle_annual["Total Discharge (MWh)"] = two_cycle_annual["DC Discharging power (MW)"] / 2
+    # Calculate total discharge, MW * interval length in hours = MWh
+    one_cycle_annual["Total Discharge (MWh)"] = one_cycle_annual["DC Discharging power (MW)"] * interval_length
+    two_cycle_annual["Total Discharge (MWh)"] = two_cycle_annual["DC Discharging power (MW)"] * interval_length
 
     battery_power = 100
     one_cycle_annual["£_kW_year"] = one_cycle_annual["Trading Profits (£)"] / (battery_power * 1000)   # MW * 1000 =  kW
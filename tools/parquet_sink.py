@@ -0,0 +1,174 @@
+"""
+Streaming Parquet output for the dispatch results.
+
+Each solved horizon is written to a year/month partitioned Parquet dataset as soon as it completes, so a multi-year
+run never holds more than roughly one month of results in memory. The readers only load the requested columns and
+only open the partitions that overlap the requested date range.
+
+Layout:
+  <root_path>/year=2016/month=1/part-0.parquet
+  <root_path>/year=2016/month=2/part-0.parquet
+  ...
+"""
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pandas as pd
+import numpy as np
+import logging
+import shutil
+import os
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+PARTITION_FIELDS = ["year", "month"]
+
+
+class ParquetResultSink:
+
+    def __init__(self, root_path: str, start_time: str | pd.Timestamp, freq: str = "30T",
+                 row_group_size: int = 48 * 31, overwrite: bool = False):
+        """
+        :param root_path: Directory of the partitioned dataset
+        :param start_time: Timestamp of the first period written to the sink
+        :param freq: Length of a dispatch period, the datetime column is generated from start_time and freq
+        :param row_group_size: Number of periods buffered before a row group is written (one month of HH by default)
+        :param overwrite: Remove an existing dataset at root_path, otherwise an existing non-empty directory is an
+                          error so stale partitions from a previous run can't be mixed in
+        """
+        if os.path.isdir(root_path) and os.listdir(root_path):
+            if not overwrite:
+                raise FileExistsError(f"{root_path} already holds a dataset, pass overwrite=True to replace it")
+            shutil.rmtree(root_path)
+
+        self.root_path = root_path
+        self.start_time = pd.Timestamp(start_time)
+        self.freq = pd.Timedelta(freq)
+        self.row_group_size = row_group_size
+        self.rows_written = 0
+
+        self._partition = None
+        self._writer = None
+        self._pending = []
+        self._pending_rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, columns: dict):
+        """
+        Write the result columns of a solved horizon, it must directly follow the previously written horizon
+        :param columns: Dictionary of result column name to array, as returned by collect_opt_columns
+        :return:
+        """
+        n_rows = len(next(iter(columns.values())))
+        datetime = pd.date_range(start=self.start_time + self.rows_written * self.freq, periods=n_rows,
+                                 freq=self.freq)
+
+        # A horizon can straddle a month end, so split it on every change of partition
+        partition_key = datetime.year.to_numpy() * 100 + datetime.month.to_numpy()
+        boundaries = np.flatnonzero(np.diff(partition_key)) + 1
+
+        for start, end in zip(np.r_[0, boundaries], np.r_[boundaries, n_rows]):
+            table = pa.table({"datetime": datetime[start:end],
+                              **{name: np.asarray(values)[start:end] for name, values in columns.items()}})
+            self._write_partition((datetime[start].year, datetime[start].month), table)
+
+        self.rows_written += n_rows
+
+    def _write_partition(self, partition: tuple, table: pa.Table):
+        """
+        Buffer a table for a partition, opening a new file when the partition changes
+        :param partition: (year, month) of every row of the table
+        :param table: Rows to write
+        :return:
+        """
+        if partition != self._partition:
+            self._close_writer()
+            year, month = partition
+            directory = os.path.join(self.root_path, f"year={year}", f"month={month}")
+            os.makedirs(directory, exist_ok=True)
+            self._writer = pq.ParquetWriter(os.path.join(directory, "part-0.parquet"), table.schema)
+            self._partition = partition
+
+        self._pending.append(table)
+        self._pending_rows += table.num_rows
+        if self._pending_rows >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if self._pending:
+            self._writer.write_table(pa.concat_tables(self._pending), row_group_size=self.row_group_size)
+            self._pending = []
+            self._pending_rows = 0
+
+    def _close_writer(self):
+        if self._writer is not None:
+            self._flush()
+            self._writer.close()
+            self._writer = None
+            self._partition = None
+
+    def close(self):
+        self._close_writer()
+        logging.info(f"Wrote {self.rows_written:,} periods to {self.root_path}")
+
+
+def _partition_filter(start: pd.Timestamp | None, end: pd.Timestamp | None) -> ds.Expression | None:
+    """
+    Build a filter on the datetime column with matching year/month bounds so whole partitions are skipped
+    :param start: Inclusive start of the date range, unbounded if None
+    :param end: Exclusive end of the date range, unbounded if None
+    :return: Dataset filter expression, None if the range is unbounded
+    """
+    year, month, datetime = ds.field("year"), ds.field("month"), ds.field("datetime")
+    expression = None
+
+    if start is not None:
+        lower = ((year > start.year) | ((year == start.year) & (month >= start.month))) & \
+                (datetime >= pa.scalar(start, type=pa.timestamp("ns")))
+        expression = lower
+
+    if end is not None:
+        upper = ((year < end.year) | ((year == end.year) & (month <= end.month))) & \
+                (datetime < pa.scalar(end, type=pa.timestamp("ns")))
+        expression = upper if expression is None else expression & upper
+
+    return expression
+
+
+def read_results(path: str, columns: list | None = None, start: str | pd.Timestamp | None = None,
+                 end: str | pd.Timestamp | None = None) -> pd.DataFrame:
+    """
+    Load dispatch results from a partitioned Parquet dataset, or from a results CSV for older runs
+
+    :param path: Dataset directory written by ParquetResultSink, or a CSV file with a "datetime" column
+    :param columns: Result columns to load, all columns if None. The "datetime" column is always included.
+    :param start: Inclusive start of the date range to load
+    :param end: Exclusive end of the date range to load
+    :return: DataFrame of the requested columns sorted by datetime
+    """
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+
+    if os.path.isdir(path):
+        dataset = ds.dataset(path, format="parquet", partitioning="hive")
+        if columns is None:
+            columns = [name for name in dataset.schema.names if name not in PARTITION_FIELDS + ["datetime"]]
+        table = dataset.to_table(columns=["datetime"] + list(columns), filter=_partition_filter(start, end))
+        results_df = table.to_pandas()
+    else:
+        usecols = None if columns is None else ["datetime"] + list(columns)
+        results_df = pd.read_csv(path, usecols=usecols)
+        results_df["datetime"] = pd.to_datetime(results_df["datetime"], format="%Y-%m-%d %H:%M:%S")
+        if start is not None:
+            results_df = results_df[results_df["datetime"] >= start]
+        if end is not None:
+            results_df = results_df[results_df["datetime"] < end]
+
+    # Fragments are not guaranteed to be read in time order
+    return results_df.sort_values("datetime", ignore_index=True)
@@ -0,0 +1,168 @@
+"""
+This module runs the rolling-horizon dispatch of a portfolio of batteries.
+
+The portfolio is decomposed before anything is built. Only assets behind the same shared connection are coupled, so
+each connection group becomes one PortfolioMatrixModel and every asset with its own connection is solved on its own.
+The groups are independent and are solved across a ProcessPoolExecutor, the prices being handed to every worker once
+through the pool initializer. Within a group the year is solved horizon by horizon like run_serial, with the model
+built once and updated in place, so the largest model ever held is one connection group over one horizon.
+
+Example:
+  assets = [{"name": "site_a", "connection": "gsp_1", **DEFAULT_BATTERY_PARAMS},
+            {"name": "site_b", "connection": "gsp_1", **DEFAULT_BATTERY_PARAMS},
+            {"name": "site_c", **DEFAULT_BATTERY_PARAMS}]
+  results = run_portfolio(prices, assets, connections={"gsp_1": {"import_grid_lim": 150, "export_grid_lim": 150}})
+  results["site_a"].to_frame()
+"""
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import logging
+import math
+import time
+
+from portfolio_model import PortfolioMatrixModel
+from tools.result_buffer import ResultBuffer
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Prices shared by every connection group, set once in each worker process by _init_worker
+_shared_prices = None
+
+
+def connection_groups(assets: list[dict], connections: dict) -> list[list[dict]]:
+    """
+    Split the portfolio into groups that can be solved independently
+
+    :param assets: Asset dictionaries, see PortfolioMatrixModel
+    :param connections: Mapping of shared connection name to its import/export limits
+    :return: One list of assets per shared connection, and one single-asset list per asset without one
+    """
+    unknown = {asset["connection"] for asset in assets if asset.get("connection")} - set(connections)
+    if unknown:
+        raise ValueError(f"Assets refer to connections without limits: {sorted(unknown)}")
+
+    names = [asset["name"] for asset in assets]
+    if len(set(names)) != len(names):
+        raise ValueError("Asset names must be unique")
+
+    groups = {}
+    for asset in assets:
+        groups.setdefault(asset.get("connection") or ("", asset["name"]), []).append(asset)
+
+    return list(groups.values())
+
+
+def _init_worker(prices: np.ndarray):
+    global _shared_prices
+    _shared_prices = prices
+
+
+def run_group(prices: np.ndarray, assets: list[dict], connections: dict, time_horizon: int,
+              cycles_per_time_horizon: float, init_soc: float = 0.5, mip_rel_gap: float = 0.0001,
+              time_limit: float | int = 20, relax_binaries: bool = False, columns: list | None = None,
+              interval_length: float = 0.5) -> dict:
+    """
+    Solve one connection group horizon by horizon, each horizon starting from the previous horizon's final SoC
+
+    :param prices: HH prices for the whole period
+    :param assets: Assets of the group
+    :param connections: Mapping of shared connection name to its import/export limits
+    :param time_horizon: Horizon size in half hours
+    :param cycles_per_time_horizon: Number of cycles each asset is allowed within a horizon
+    :param init_soc: Initial state of charge as a fraction of the capacity, unless the asset sets "init_soc"
+    :param mip_rel_gap: Relative MIP gap tolerance
+    :param time_limit: Solver time limit in seconds
+    :param relax_binaries: Solve as an LP and only add binaries where an asset charges and discharges at once
+    :param columns: Result columns to keep, all columns if None
+    :param interval_length: Duration of a dispatch period in hours
+    :return: Dictionary of asset name to its columnar HH results
+    """
+    n_horizons = math.ceil(len(prices) / time_horizon)
+    results = {asset["name"]: ResultBuffer(capacity=len(prices)) for asset in assets}
+    init_charge = np.array([asset.get("init_soc", init_soc) * asset["battery_capacity"] for asset in assets])
+    portfolio = None
+
+    for day_count in range(1, n_horizons + 1):
+        prices_sliced = prices[(day_count - 1) * time_horizon:day_count * time_horizon]
+
+        # The last horizon can be shorter, which changes the model structure
+        if portfolio is not None and portfolio.n_periods == len(prices_sliced):
+            portfolio.update_horizon(import_rate=prices_sliced, export_rate=prices_sliced, init_charge=init_charge)
+        else:
+            portfolio = PortfolioMatrixModel(assets, import_rate=prices_sliced, export_rate=prices_sliced,
+                                             init_charge=init_charge, interval_length=interval_length)
+            portfolio.add_objective_function()
+            portfolio.add_storage_constraints()
+            portfolio.add_max_cycles_constraint(max_daily_cycles=cycles_per_time_horizon)
+            portfolio.add_connection_constraints(connections)
+
+        portfolio.solve_problem(mip_rel_gap=mip_rel_gap, time_limit=time_limit, relax_binaries=relax_binaries)
+
+        asset_columns = portfolio.collect_asset_columns()
+        for name, horizon_columns in asset_columns.items():
+            results[name].append({col: values for col, values in horizon_columns.items()
+                                  if columns is None or col in columns})
+
+        init_charge = np.array([asset_columns[name]["State of Energy (MWh)"][-1] for name in portfolio.asset_names])
+
+    return results
+
+
+def _run_group(group_args: tuple) -> dict:
+    """
+    Worker function for the process pool, runs one connection group on the shared prices
+
+    :param group_args: Tuple of (group number, assets, run_group keyword args)
+    :return: Dictionary of asset name to its columnar HH results
+    """
+    group_number, assets, group_kwargs = group_args
+
+    tic = time.perf_counter()
+    results = run_group(_shared_prices, assets, **group_kwargs)
+    logging.info(f"Group {group_number} ({len(assets)} assets) solved in {time.perf_counter() - tic:.1f} seconds")
+
+    return results
+
+
+def run_portfolio(prices: np.ndarray, assets: list[dict], connections: dict | None = None,
+                  time_horizon: int = 48 * 7, cycles_per_time_horizon: float = 7, max_workers: int | None = None,
+                  columns: list | None = None, **solve_kwargs) -> dict:
+    """
+    Run the rolling-horizon dispatch of every asset, solving the connection groups across a process pool
+
+    :param prices: HH prices for the whole period
+    :param assets: Asset dictionaries, see PortfolioMatrixModel
+    :param connections: Mapping of shared connection name to {"import_grid_lim": MW, "export_grid_lim": MW}
+    :param time_horizon: Horizon size in half hours
+    :param cycles_per_time_horizon: Number of cycles each asset is allowed within a horizon
+    :param max_workers: Number of worker processes, defaults to the number of CPUs, 1 solves in this process
+    :param columns: Result columns to keep per asset, e.g. ["DC Discharging power (MW)", "Trading Profits (£)"] to
+                    keep the results of a large portfolio small, all columns if None
+    :param solve_kwargs: init_soc, mip_rel_gap, time_limit, relax_binaries and interval_length passed to run_group
+    :return: Dictionary of asset name to its columnar HH results, in the order of assets
+    """
+    if "segment_costs" in solve_kwargs:
+        raise ValueError("Degradation costs are not supported by the portfolio model")
+    if "services" in solve_kwargs:
+        raise ValueError("Ancillary services are not supported by the portfolio model")
+
+    connections = connections or {}
+    groups = connection_groups(assets, connections)
+    group_kwargs = {"connections": connections, "time_horizon": time_horizon,
+                    "cycles_per_time_horizon": cycles_per_time_horizon, "columns": columns, **solve_kwargs}
+    tasks = [(group_number, group, group_kwargs) for group_number, group in enumerate(groups, 1)]
+    logging.info(f"Solving {len(assets)} assets as {len(groups)} independent groups")
+
+    if max_workers == 1:
+        _init_worker(prices)
+        group_results = [_run_group(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(prices,)) as executor:
+            group_results = list(executor.map(_run_group, tasks))
+
+    results = {}
+    for group_result in group_results:
+        results.update(group_result)
+
+    return {asset["name"]: results[asset["name"]] for asset in assets}
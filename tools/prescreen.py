@@ -0,0 +1,69 @@
+"""
+This module runs a coarse pre-screen of the annual value of a battery before a full-resolution run.
+
+The prices are averaged to hourly (or coarser) intervals, which halves the number of periods of the HH model and more
+for 5 and 15-minute markets, and the same rolling-horizon dispatch is solved on them. Averaging smooths the intra-hour
+spreads, so the pre-screen slightly under-states the value of the full-resolution run, but it ranks battery specs and
+cycle limits the same way in a fraction of the time.
+
+Example:
+  prescreen_df = prescreen(cycles_per_day=[1, 2], interval_length=1)
+
+Run from the repository root:
+  $ python -m tools.prescreen
+"""
+import pandas as pd
+import numpy as np
+import logging
+import time
+
+from tools.dispatch_runner import run_serial, DEFAULT_BATTERY_PARAMS
+from tools.price_data_cleaning import process_price_data
+from tools.scenario_sweep import summarise_scenario
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def prescreen(filename: str = "input_data.csv", cycles_per_day: list[float] = (1,), interval_length: float = 1,
+              horizon_days: int = 365, init_soc: float = 0.5, battery_params: dict = None,
+              **solve_kwargs) -> pd.DataFrame:
+    """
+    Estimate the annual value of every daily cycle limit on prices averaged to interval_length
+
+    :param filename: Name of the raw price CSV in the data directory
+    :param cycles_per_day: Daily cycle limits to screen
+    :param interval_length: Interval length of the pre-screen in hours
+    :param horizon_days: Length of each optimised horizon in days
+    :param init_soc: Initial state of charge as a fraction of the capacity
+    :param battery_params: Battery specification, defaults to DEFAULT_BATTERY_PARAMS
+    :param solve_kwargs: backend, relax_binaries, mip_rel_gap and time_limit passed to run_serial
+    :return: Tidy DataFrame with one row per cycle limit and year, in the units of tools.scenario_sweep
+    """
+    battery_params = battery_params or DEFAULT_BATTERY_PARAMS
+    periods_per_day = round(24 / interval_length)
+    time_horizon = periods_per_day * horizon_days
+
+    market_price_df, _ = process_price_data(filename, time_horizon=time_horizon, interval_length=interval_length)
+    prices = market_price_df["prices"].to_numpy(dtype=np.float64)
+    years = market_price_df["time"].dt.year.to_numpy()
+
+    summaries = []
+    for cycles in cycles_per_day:
+        tic = time.perf_counter()
+        results = run_serial(prices, time_horizon=time_horizon, cycles_per_time_horizon=cycles * horizon_days,
+                             init_charge=init_soc * battery_params["battery_capacity"], battery_params=battery_params,
+                             interval_length=interval_length, **solve_kwargs)
+        logging.info(f"{cycles} cycle pre-screen at {interval_length} h solved in {time.perf_counter() - tic:.1f} "
+                     f"seconds")
+
+        summary_df = summarise_scenario(results, years, battery_params, interval_length=interval_length)
+        summary_df.insert(0, "cycles_per_day", cycles)
+        summary_df.insert(1, "interval_length", interval_length)
+        summaries.append(summary_df)
+
+    return pd.concat(summaries, ignore_index=True)
+
+
+if __name__ == "__main__":
+    print(prescreen(cycles_per_day=[1, 2], backend="matrix", relax_binaries=True).to_string(index=False))
@@ -1,5 +1,8 @@
 import pandas as pd
 import numpy as np
+import hashlib
+import shutil
+import json
 import os
 import logging
 import matplotlib.pyplot as plt
@@ -7,122 +10,359 @@ import matplotlib.pyplot as plt
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Quantile thresholds used by replace_outliers_IQR when cleaning the price data
+OUTLIER_Q1_THRESHOLD = 0.005
+OUTLIER_Q3_THRESHOLD = 0.995
 
-def replace_outliers_IQR(df, q1_threshold: float, q3_threshold: float, col: str):
+# Bump when the cleaning steps change so existing caches are no longer used
+CACHE_VERSION = 3
+
+
+def replace_outliers_IQR(prices: np.ndarray, q1_threshold: float, q3_threshold: float) -> int:
     """
-    Replace outliers in a DataFrame based on the IQR method with interpolation.
+    Replace outliers based on the IQR method with interpolation, in place.
 
-    :param df: DataFrame to process.
+    :param prices: Price array to process, modified in place
     :param q1_threshold: Lower threshold for the first quartile.
     :param q3_threshold: Upper threshold for the third quartile.
-    :param col: Column containing the values to process.
-    :return: df_interpolated: DataFrame with outliers replaced by interpolated values.
+    :return: Number of outliers that were interpolated
     """
-    q1 = df[col].quantile(q1_threshold)
-    q3 = df[col].quantile(q3_threshold)
+    q1, q3 = np.nanquantile(prices, [q1_threshold, q3_threshold])
 
     IQR = q3 - q1
 
-    # Identify outliers
-    outliers_mask = (df[col] < (q1 - 1.5 * IQR)) | (df[col] > (q3 + 1.5 * IQR))
+    # Identify outliers and replace them with NaN
+    outliers_mask = (prices < (q1 - 1.5 * IQR)) | (prices > (q3 + 1.5 * IQR))
+    prices[outliers_mask] = np.nan
 
-    # Create a copy of the original DataFrame
-    df_interpolated = df.copy()
+    n_outliers = int(np.count_nonzero(np.isnan(prices)))
+    logging.info(f"A total of {n_outliers} outliers were interpolated")
 
-    # Replace outliers with NaN
-    df_interpolated.loc[outliers_mask, col] = np.nan
+    # Interpolate missing values
+    interpolate_gaps(prices)
 
-    logging.info(f"A total of {len(df_interpolated.loc[df_interpolated[col].isna()])} outliers were interpolated")
+    return n_outliers
 
-    # Interpolate missing values
-    df_interpolated[col] = df_interpolated[col].interpolate()
 
-    return df_interpolated
+def interpolate_gaps(prices: np.ndarray):
+    """
+    Linearly interpolate the NaNs in place, like pandas' interpolate: trailing NaNs take the last price and leading
+    NaNs are left as they are
+
+    :param prices: Price array to process, modified in place
+    :return:
+    """
+    missing = np.isnan(prices)
+    if not missing.any() or missing.all():
+        return
+
+    present = np.flatnonzero(~missing)
+    missing[:present[0]] = False
+    positions = np.flatnonzero(missing)
+    prices[positions] = np.interp(positions, present, prices[present])
 
 
-def missing_data_estimation(df: pd.DataFrame, col: str) -> pd.DataFrame | pd.DataFrame:
+def missing_data_estimation(prices: np.ndarray, time_index: pd.DatetimeIndex) -> np.ndarray:
     """
+    Fill the missing prices with the historical price as many periods earlier as there are missing prices, in place
 
-    :param df: price dataframe including all the rows with missing prices from 10/2020 to 12/2020
-    :param col: column to replace values
-    :return: original dataframe with the missing values replaced with historical data
+    :param prices: Price array including all the missing prices from 10/2020 to 12/2020, modified in place
+    :param time_index: Regular time index of the prices
+    :return: missing_rows: Boolean mask of the prices that were missing
     """
-    missing_rows_df = df[df[col].isna()]
+    missing_rows = np.isnan(prices)
+    positions = np.flatnonzero(missing_rows)
+
+    if len(positions):
+        # The historical rows used to be appended to the prices, sorted by time with an unstable sort and then
+        # deduplicated keeping the last row. A filled row therefore only replaces the missing price when the sort
+        # happened to put it after the original row, the others stay NaN and are interpolated. The same sort is run on
+        # the timestamps so the cleaned prices do not change.
+        times = time_index.to_numpy()
+        order = np.argsort(np.concatenate([times[positions], times]), kind="quicksort")
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        filled = positions[rank[:len(positions)] > rank[len(positions) + positions]]
+
+        # Every filled price is the price len(positions) periods earlier, as it was before any filling
+        source = filled - len(positions)
+        historical = np.full(len(filled), np.nan, dtype=prices.dtype)
+        historical[source >= 0] = prices[source[source >= 0]]
+        prices[filled] = historical
+
+    return missing_rows
+
+
+def parse_times(values: np.ndarray) -> np.ndarray:
+    """
+    Parse "%d/%m/%Y %H:%M" timestamps with vectorised digit arithmetic on the raw bytes, which is far quicker than
+    strptime. Anything that does not match the format falls back to pd.to_datetime, which coerces it to NaT as before.
+
+    :param values: Array of timestamp strings, NaN for blanks
+    :return: datetime64[ns] array
+    """
+    raw = np.asarray(values, dtype="S16")
+    chars = raw.view(np.uint8).reshape(len(raw), 16)
+
+    def number(*columns):
+        # Digits outside 0-9 make the number negative or too large, which the range checks below reject
+        value = np.zeros(len(raw), dtype=np.int64)
+        for column in columns:
+            digit = chars[:, column].astype(np.int64) - ord("0")
+            value = np.where((digit >= 0) & (digit <= 9), value * 10 + digit, -10000)
+        return value
+
+    day, month, year = number(0, 1), number(3, 4), number(6, 7, 8, 9)
+    hour, minute = number(11, 12), number(14, 15)
+    well_formed = ((chars[:, 2] == ord("/")) & (chars[:, 5] == ord("/")) & (chars[:, 10] == ord(" ")) &
+                   (chars[:, 13] == ord(":")) & (year >= 0) & (month >= 1) & (month <= 12) & (day >= 1) &
+                   (hour >= 0) & (hour <= 23) & (minute >= 0) & (minute <= 59))
+
+    months = ((year - 1970) * 12 + month - 1).astype("datetime64[M]")
+    dates = months.astype("datetime64[D]") + (day - 1)
+    # e.g. 31/02 rolls into March
+    well_formed &= dates.astype("datetime64[M]") == months
+
+    times = (dates.astype("datetime64[ns]") + hour * np.timedelta64(1, "h") + minute * np.timedelta64(1, "m"))
+    if not well_formed.all():
+        times[~well_formed] = pd.to_datetime(pd.Series(values[~well_formed], dtype=object), format="%d/%m/%Y %H:%M",
+                                             errors="coerce").to_numpy()
+
+    return times
 
-    # Get the indexes of the missing rows region
-    missing_rows_indexes = df[col].isna()
 
-    if not missing_rows_df.empty:
-        x = len(missing_rows_df)
-        df_filled = missing_rows_df.copy()
-        df_filled[col] = df[col].shift(periods=x)
+def source_interval(times: np.ndarray) -> np.timedelta64:
+    """
+    :param times: Parsed timestamps of the raw prices, in file order
+    :return: Most common step between consecutive timestamps, the resolution the prices were published at
+    """
+    steps = np.diff(times)
+    steps = steps[steps > np.timedelta64(0, "ns")]
+    values, counts = np.unique(steps, return_counts=True)
 
-        # Concatenate the filled and present rows
-        df_combined = pd.concat([df_filled, df], axis=0).sort_index()
+    return values[np.argmax(counts)]
 
-        # Remove duplicate time indexes
-        df_combined = df_combined[~df_combined.index.duplicated(keep='last')]
 
-        return df_combined, missing_rows_indexes
+def resample_prices(time_index: pd.DatetimeIndex, prices: np.ndarray, missing_rows: np.ndarray,
+                    interval_length: float) -> tuple[pd.DatetimeIndex, np.ndarray, np.ndarray]:
+    """
+    Resample gap-free prices to another interval length. Coarser intervals take the mean price of the periods they
+    cover, finer intervals repeat the price of the period they fall in.
+
+    :param time_index: Regular time index of the prices
+    :param prices: Prices on time_index
+    :param missing_rows: Boolean mask of the prices that were filled with historical data
+    :param interval_length: Target interval length in hours, a multiple or a divisor of the source interval
+    :return: time_index, prices, missing_rows on the new intervals, a resampled period is flagged as missing when any
+             period it is made of was
+    """
+    source = time_index[1] - time_index[0]
+    target = pd.Timedelta(hours=interval_length)
+    if target == source:
+        return time_index, prices, missing_rows
+
+    if target > source:
+        if target % source:
+            raise ValueError(f"Interval length {target} is not a multiple of the {source} price interval")
+        # Each price is added to the target interval it falls in
+        buckets = (time_index - time_index[0].floor(target)) // target
+        counts = np.bincount(buckets)
+        resampled = (np.bincount(buckets, weights=prices) / counts).astype(prices.dtype)
+        missing = np.bincount(buckets, weights=missing_rows) > 0
+        start = time_index[0].floor(target)
     else:
-        return df.copy()
+        if source % target:
+            raise ValueError(f"Interval length {target} does not divide the {source} price interval")
+        resampled = np.repeat(prices, source // target)
+        missing = np.repeat(missing_rows, source // target)
+        start = time_index[0]
+
+    return pd.date_range(start=start, periods=len(resampled), freq=target), resampled, missing
 
 
-def process_price_data(filename: str, time_horizon: int) -> pd.DataFrame | pd.Index:
+def read_price_file(file_location: str, chunksize: int | None = None) -> tuple[np.ndarray, np.ndarray]:
     """
+    Read the raw price CSV into a time array and a float32 price array
 
-    :param time_horizon: Time horizon to add as a column
-    :param filename:
+    :param file_location: Path of the raw price CSV
+    :param chunksize: Number of rows parsed at a time, so only one chunk of text is held in memory at once
+    :return: times: datetime64[ns] array of the parsed timestamps, NaT where they could not be parsed
+             prices: float32 array of the prices
+    """
+    reader = pd.read_csv(file_location, usecols=["time", "prices"], skip_blank_lines=True,
+                         dtype={"prices": np.float32}, chunksize=chunksize)
+    chunks = [reader] if chunksize is None else reader
+
+    times, prices = [], []
+    for chunk in chunks:
+        # Need to convert the time column to a datetime format
+        times.append(parse_times(chunk["time"].to_numpy()))
+        prices.append(chunk["prices"].to_numpy(dtype=np.float32))
+
+    return np.concatenate(times), np.concatenate(prices)
+
+
+def _cache_key(file_location: str, time_horizon: int, interval_length: float | None) -> str:
+    """
+    Hash the raw price file together with the cleaning parameters
+
+    :param file_location: Path of the raw price CSV
+    :param time_horizon: Time horizon added as a column
+    :param interval_length: Interval length the prices are resampled to
+    :return: Hex digest identifying the cleaned data
+    """
+    digest = hashlib.sha256()
+    with open(file_location, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+
+    cleaning_params = {"version": CACHE_VERSION,
+                       "time_horizon": time_horizon,
+                       "interval_length": interval_length,
+                       "q1_threshold": OUTLIER_Q1_THRESHOLD,
+                       "q3_threshold": OUTLIER_Q3_THRESHOLD}
+    digest.update(json.dumps(cleaning_params, sort_keys=True).encode())
+
+    return digest.hexdigest()[:20]
+
+
+def _write_cache(cache_path: str, market_price_df: pd.DataFrame, missing_rows_indexes: pd.Series):
+    """
+    Save every column of the cleaned data as a .npy file, written to a temporary directory first so an interrupted
+    write never leaves a partial cache behind
+
+    :param cache_path: Directory of this cache entry
+    :param market_price_df: Cleaned price data
+    :param missing_rows_indexes: Boolean series flagging the rows that were filled with historical data
     :return:
     """
+    temp_path = cache_path + ".tmp"
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+
+    for col in market_price_df.columns:
+        np.save(os.path.join(temp_path, f"{col}.npy"), market_price_df[col].to_numpy())
+    np.save(os.path.join(temp_path, "missing_rows.npy"), missing_rows_indexes.to_numpy())
+    np.save(os.path.join(temp_path, "missing_rows_time.npy"), missing_rows_indexes.index.to_numpy())
+    with open(os.path.join(temp_path, "columns.json"), "w") as file:
+        json.dump(list(market_price_df.columns), file)
+
+    os.replace(temp_path, cache_path)
 
+
+def _read_cache(cache_path: str) -> pd.DataFrame | pd.Series:
+    """
+    Load the cleaned data from the cache. The arrays are memory mapped copy-on-write, so the file is never modified
+    and only the pages that are touched are read from disk.
+
+    :param cache_path: Directory of this cache entry
+    :return: market_price_df, missing_rows_indexes
+    """
+    with open(os.path.join(cache_path, "columns.json")) as file:
+        columns = json.load(file)
+
+    market_price_df = pd.DataFrame({col: np.load(os.path.join(cache_path, f"{col}.npy"), mmap_mode="c")
+                                    for col in columns}, copy=False)
+    missing_rows_indexes = pd.Series(np.load(os.path.join(cache_path, "missing_rows.npy"), mmap_mode="c"),
+                                     index=pd.DatetimeIndex(np.load(os.path.join(cache_path, "missing_rows_time.npy")),
+                                                            name="time"),
+                                     name="prices")
+
+    return market_price_df, missing_rows_indexes
+
+
+def process_price_data(filename: str, time_horizon: int, use_cache: bool = True, chunksize: int | None = None,
+                       interval_length: float | None = 0.5) -> pd.DataFrame | pd.Series:
+    """
+    Load the cleaned price data, from the on-disk cache when the raw file and cleaning parameters are unchanged
+
+    :param filename: Name of the raw price CSV in the data directory
+    :param time_horizon: Time horizon to add as a column
+    :param use_cache: Read and write the cache in data/.cache, keyed by a hash of the file and cleaning parameters
+    :param chunksize: Number of CSV rows parsed at a time when the raw file is cleaned, for files too large to parse
+                      in one go
+    :param interval_length: Interval length of the returned prices in hours, e.g. 0.25, 0.5 or 1, None keeps the
+                            interval the file was published at
+    :return: market_price_df, missing_rows_indexes
+    """
     parent_directory = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
     file_location = os.path.join(parent_directory, "data", filename).replace('\\', '/')
-    price_data = pd.read_csv(file_location, usecols=["time", "prices"], skip_blank_lines=True)
-    market_price_df = pd.DataFrame(price_data)
 
-    logging.info(f"Length of dataframe imported: {len(market_price_df)}")
+    if not use_cache:
+        return clean_price_data(file_location, time_horizon, chunksize=chunksize, interval_length=interval_length)
+
+    cache_key = _cache_key(file_location, time_horizon, interval_length)
+    cache_path = os.path.join(parent_directory, "data", ".cache", f"{os.path.splitext(filename)[0]}_{cache_key}")
+    if os.path.isdir(cache_path):
+        logging.info(f"Loading cleaned price data from {cache_path}")
+        return _read_cache(cache_path)
+
+    market_price_df, missing_rows_indexes = clean_price_data(file_location, time_horizon, chunksize=chunksize,
+                                                             interval_length=interval_length)
+    _write_cache(cache_path, market_price_df, missing_rows_indexes)
+
+    return market_price_df, missing_rows_indexes
+
+
+def clean_price_data(file_location: str, time_horizon: int, chunksize: int | None = None,
+                     interval_length: float | None = 0.5) -> pd.DataFrame | pd.Series:
+    """
+    Clean the raw prices on a single float32 array that every step modifies in place. The prices are cleaned at the
+    interval they were published at and only then resampled to interval_length.
+
+    :param file_location: Path of the raw price CSV
+    :param time_horizon: Time horizon to add as a column
+    :param chunksize: Number of CSV rows parsed at a time, None reads the whole file at once
+    :param interval_length: Interval length of the returned prices in hours, None keeps the published interval
+    :return: market_price_df, missing_rows_indexes
+    """
+    times, raw_prices = read_price_file(file_location, chunksize=chunksize)
+
+    logging.info(f"Length of dataframe imported: {len(times)}")
 
-    # Need to convert the time column to a datetime format
-    market_price_df["time"] = pd.to_datetime(market_price_df["time"], format="%d/%m/%Y %H:%M", errors="coerce")
+    # Rows with an unparseable time are dropped
+    parsed = ~np.isnat(times)
+    times, raw_prices = times[parsed], raw_prices[parsed]
 
     # This is the required datetime range to ensure no gaps in the price data
-    required_range = pd.DataFrame(index=pd.date_range(start=market_price_df["time"].iloc[0],
-                                                      end=market_price_df["time"].iloc[-1], freq="30T"))
+    step = source_interval(times)
+    required_range = pd.date_range(start=times[0], end=times[-1], freq=pd.Timedelta(step))
 
-    # Need to remove duplicate timestamps from the dataframe and keep the first entry
-    market_price_df.drop_duplicates(subset="time", inplace=True, keep="first")
-    market_price_df.set_index('time', inplace=True)
+    # Slot of every row on the regular grid
+    slots = (times - times[0]) // step
 
-    # Resample with the desired frequency to add missing datetime rows
-    market_price_df = market_price_df.resample('30T').asfreq()[1:]
+    # Need to remove duplicate timestamps and keep the first entry, the remaining slots are the missing rows
+    slots, first_rows = np.unique(slots, return_index=True)
+    in_range = (slots >= 0) & (slots < len(required_range))
+    prices = np.full(len(required_range), np.nan, dtype=np.float32)
+    prices[slots[in_range]] = raw_prices[first_rows[in_range]]
+    del raw_prices
 
     # Need to replace the blanks in the prices otherwise a simple interpolation will produce a poor estimation
-    market_price_df, missing_rows_indexes = missing_data_estimation(market_price_df, col="prices")
+    missing_rows = missing_data_estimation(prices, required_range)
 
     # Next if there are any empty rows we need to interpolate between the surrounding prices
-    market_price_df["prices"].interpolate(method="linear", inplace=True)
-    market_price_df.reset_index(inplace=True)
+    interpolate_gaps(prices)
 
     # We need to clean up any anomalous/outlier prices using the IQR method and replace with an interpolation
-    market_price_df = replace_outliers_IQR(market_price_df, col="prices", q1_threshold=0.005, q3_threshold=0.995)
+    replace_outliers_IQR(prices, q1_threshold=OUTLIER_Q1_THRESHOLD, q3_threshold=OUTLIER_Q3_THRESHOLD)
 
-    # Change the prices column to float32 type to halve the memory usage
-    market_price_df.astype({'prices': 'float32'})
+    if interval_length is not None:
+        required_range, prices, missing_rows = resample_prices(required_range, prices, missing_rows, interval_length)
 
-    # Need to add a day index column for the optimisation set - create a boolean mask for rows where time is '00:00'
-    mask = market_price_df['time'].dt.strftime('%H:%M') == '00:00'
-    # Use cumsum on the boolean mask to create a counter
-    market_price_df['day_count'] = mask.cumsum()
-    market_price_df['time_horizon'] = market_price_df.groupby(market_price_df.index // time_horizon).cumcount() + 1
+    # The prices stay float32 to halve the memory usage
+    market_price_df = pd.DataFrame({"time": required_range, "prices": prices}, copy=False)
 
-    logging.info(f"Length of dataframe after cleaning: {len(market_price_df)}")
+    # Need to add a day index column for the optimisation set - the counter steps up on every '00:00' period
+    midnight = (required_range.hour == 0) & (required_range.minute == 0)
+    market_price_df["day_count"] = np.cumsum(midnight, dtype=np.int64)
+    market_price_df["time_horizon"] = np.arange(len(market_price_df)) % time_horizon + 1
 
-    assert len(market_price_df) == len(required_range), logging.error(f"{len(market_price_df)} != {len(required_range)}"
-                                                                      f" - You are missing rows in the price data")
+    missing_rows_indexes = pd.Series(missing_rows, index=pd.DatetimeIndex(required_range, name="time"), name="prices")
 
-    return market_price_df, missing_rows_indexes
+    logging.info(f"Length of dataframe after cleaning: {len(market_price_df)}")
 
+    return market_price_df, missing_rows_indexes
 
 
 # market_price_df, missing_rows_indexes = process_price_data("input_data.csv",
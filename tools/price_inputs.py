@@ -0,0 +1,143 @@
+"""
+Price inputs of the dispatch: the import and export price series plus the optional tariff components, held once as
+contiguous float32 arrays.
+
+Every model is settled on an effective import price (the market price scaled by the loss factor plus the network
+charge) and an effective export price (the market price scaled by the loss factor). They are worked out once for the
+whole period when the inputs are built, so a horizon is a pair of NumPy views into them: no pandas slicing, index
+resetting or dict conversion per horizon. With no export series, export is the same array as import and the tariff
+reduces to the single price of run.py.
+
+For ancillary service stacking the inputs also hold the availability price of every service (£/MW/h) and the
+settlement block of every period (see tools.ancillary_services.efa_blocks), sliced the same way.
+
+Example:
+  price_inputs = PriceInputs.from_frame(market_price_df, export_column="export_prices", network_charge=12.5)
+  import_rate, export_rate = price_inputs.horizon(0, 48)
+"""
+import numpy as np
+import pandas as pd
+
+
+def _as_series(values: np.ndarray | pd.Series | float | None, n_periods: int) -> np.ndarray | None:
+    """
+    :param values: Per-period series or a single value applied to every period
+    :param n_periods: Number of periods of the price series
+    :return: Contiguous float32 array of n_periods values, None if values is None
+    """
+    if values is None:
+        return None
+    if np.ndim(values) == 0:
+        return np.full(n_periods, values, dtype=np.float32)
+    values = np.ascontiguousarray(values, dtype=np.float32)
+    if len(values) != n_periods:
+        raise ValueError(f"Expected {n_periods} periods to match the prices, got {len(values)}")
+    return values
+
+
+class PriceInputs:
+
+    def __init__(self, import_rate: np.ndarray | pd.Series,
+                 export_rate: np.ndarray | pd.Series | None = None,
+                 network_charge: np.ndarray | pd.Series | float | None = None,
+                 loss_factor: np.ndarray | pd.Series | float | None = None,
+                 availability_prices: dict | None = None,
+                 settlement_blocks: np.ndarray | None = None,
+                 ):
+        """
+        :param import_rate: Market price paid for imported energy (£/MWh)
+        :param export_rate: Market price received for exported energy (£/MWh), the import price if None
+        :param network_charge: Optional charge per MWh imported on top of the market price (£/MWh), e.g. DUoS, per
+                               period or one value for every period
+        :param loss_factor: Optional multiplier of the metered volume settled at the market price, e.g. the
+                            transmission loss multiplier, per period or one value for every period
+        :param availability_prices: Optional mapping of service name to its availability price (£/MW/h), per period
+                                    or one value for every period
+        :param settlement_blocks: Settlement block of every period, needed with availability_prices
+        """
+        market_import = np.ascontiguousarray(import_rate, dtype=np.float32)
+        n_periods = len(market_import)
+        market_export = market_import if export_rate is None else _as_series(export_rate, n_periods)
+        self.network_charge = _as_series(network_charge, n_periods)
+        self.loss_factor = _as_series(loss_factor, n_periods)
+
+        if self.loss_factor is not None:
+            market_import = market_import * self.loss_factor
+            market_export = market_import if export_rate is None else market_export * self.loss_factor
+        self.export_rate = market_export
+        self.import_rate = market_import if self.network_charge is None else market_import + self.network_charge
+
+        if availability_prices is not None and settlement_blocks is None:
+            raise ValueError("Availability prices need the settlement block of every period")
+        self.availability_prices = None if availability_prices is None else \
+            {name: _as_series(prices, n_periods) for name, prices in availability_prices.items()}
+        self.settlement_blocks = None if settlement_blocks is None else np.ascontiguousarray(settlement_blocks)
+
+    @classmethod
+    def from_frame(cls, market_price_df: pd.DataFrame, import_column: str = "prices",
+                   export_column: str | None = None, network_charge: np.ndarray | float | str | None = None,
+                   loss_factor: np.ndarray | float | str | None = None) -> "PriceInputs":
+        """
+        :param market_price_df: Cleaned price data from process_price_data
+        :param import_column: Column of the import prices
+        :param export_column: Column of the export prices, the import prices if None
+        :param network_charge: Network charge per MWh imported, a column name, a series or one value
+        :param loss_factor: Loss factor, a column name, a series or one value
+        :return: Price inputs of every period of market_price_df
+        """
+        def column(values):
+            return market_price_df[values].to_numpy() if isinstance(values, str) else values
+
+        return cls(market_price_df[import_column].to_numpy(),
+                   export_rate=column(export_column),
+                   network_charge=column(network_charge),
+                   loss_factor=column(loss_factor))
+
+    def __len__(self) -> int:
+        return len(self.import_rate)
+
+    @property
+    def single_price(self) -> bool:
+        """
+        :return: True when import and export are settled at the same price
+        """
+        return self.export_rate is self.import_rate
+
+    def horizon(self, start: int, stop: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :param start: First period of the horizon
+        :param stop: Period after the last period of the horizon
+        :return: import_rate: View of the effective import prices of the horizon
+                 export_rate: View of the effective export prices of the horizon
+        """
+        return self.import_rate[start:stop], self.export_rate[start:stop]
+
+    def service_horizon(self, start: int, stop: int) -> tuple[dict, np.ndarray]:
+        """
+        :param start: First period of the horizon
+        :param stop: Period after the last period of the horizon
+        :return: availability_prices: Views of the availability prices of every service in the horizon
+                 settlement_blocks: Settlement block of every period in the horizon, counted from the first block
+        """
+        if self.availability_prices is None:
+            raise ValueError("These price inputs hold no availability prices")
+        blocks = self.settlement_blocks[start:stop]
+        return ({name: prices[start:stop] for name, prices in self.availability_prices.items()},
+                blocks - blocks[0])
+
+    def block(self, start: int, stop: int) -> "PriceInputs":
+        """
+        :param start: First period of the block
+        :param stop: Period after the last period of the block
+        :return: Price inputs of the block, viewing the effective prices of this one
+        """
+        block = PriceInputs.__new__(PriceInputs)
+        block.import_rate, block.export_rate = self.horizon(start, stop)
+        block.network_charge = None if self.network_charge is None else self.network_charge[start:stop]
+        block.loss_factor = None if self.loss_factor is None else self.loss_factor[start:stop]
+        block.availability_prices = None if self.availability_prices is None else \
+            {name: prices[start:stop] for name, prices in self.availability_prices.items()}
+        block.settlement_blocks = None if self.settlement_blocks is None else self.settlement_blocks[start:stop]
+        if self.single_price:
+            block.export_rate = block.import_rate
+        return block
@@ -0,0 +1,181 @@
+"""
+Receding-horizon (model predictive control) dispatch.
+
+run_serial optimises non-overlapping windows, so at every window boundary the battery has no reason to hold any
+energy and empties itself. Here every solve optimises a lookahead window (e.g. 48 h) but only the first commit
+periods (e.g. 24 h) are kept before the window rolls forward by commit periods, so the dispatch near the end of each
+committed block still sees the prices that follow it.
+
+Every block of commit periods in a window is capped at the same cycle budget as a fixed window of commit periods, which
+keeps the comparison with run_serial like for like and stops the lookahead from planning on throughput it will not be
+allowed once those periods are committed. The model is built once and updated in place for every window of
+the same length, and with a Pyomo persistent solver the previous solution, shifted forward by commit periods, is used
+as the warm start of the next solve.
+"""
+import numpy as np
+import logging
+import time
+
+from tools.dispatch_runner import build_battery, run_serial, DEFAULT_BATTERY_PARAMS
+from tools.parquet_sink import ParquetResultSink
+from tools.price_inputs import PriceInputs
+from tools.result_buffer import ResultBuffer
+from tools.telemetry import HorizonTelemetry
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def run_receding_horizon(prices: np.ndarray | PriceInputs, lookahead: int, commit: int, cycles_per_day: float,
+                         init_charge: float, battery_params: dict = None, persistent: bool = True,
+                         solver_selection: str | None = None, mip_rel_gap: float = 0.0001, time_limit: float | int = 20,
+                         backend: str = "matrix",
+                         relax_binaries: bool = False, sink: ParquetResultSink | None = None,
+                         telemetry: HorizonTelemetry | None = None, interval_length: float = 0.5,
+                         threads: int | None = None) -> ResultBuffer:
+    """
+    Optimise overlapping lookahead windows and commit the first periods of each one
+
+    :param prices: HH prices for the whole period, or PriceInputs with separate import and export prices
+    :param lookahead: Length of the optimised window in periods
+    :param commit: Number of periods committed from each window before rolling forward, at most lookahead
+    :param cycles_per_day: Cycle budget per day, applied pro rata to the window and to the committed periods
+    :param init_charge: Energy level at the start of the first window (MWh)
+    :param battery_params: Battery specification, defaults to DEFAULT_BATTERY_PARAMS
+    :param persistent: Update the model in place for every window of the same length and warm start from the
+                       shifted previous solution
+    :param solver_selection: Solver name from the registry in solvers.py, e.g. "highs", "cbc" or "cplex". None picks
+                             the backend's default, "highs" on the Pyomo backend and "scipy" on the matrix backend
+    :param mip_rel_gap: Relative MIP gap tolerance
+    :param time_limit: Solver time limit in seconds
+    :param backend: Battery model backend, "pyomo" or "matrix"
+    :param relax_binaries: Solve each window as an LP and only add binaries where it charges and discharges at once
+    :param sink: Optional Parquet sink, the committed periods are streamed to it instead of being kept in memory
+    :param telemetry: Optional telemetry sink that receives one record per window
+    :param interval_length: Duration of a dispatch period in hours
+    :param threads: Number of solver threads, the solver's default if None
+    :return: results: Columnar HH results of the committed periods in time order, empty if a sink is given
+    """
+    if backend not in ("pyomo", "matrix"):
+        raise ValueError(f"The receding horizon needs the 'pyomo' or 'matrix' backend, got '{backend}'")
+    if not 0 < commit <= lookahead:
+        raise ValueError(f"commit must be between 1 and the lookahead of {lookahead} periods, got {commit}")
+
+    battery_params = battery_params or DEFAULT_BATTERY_PARAMS
+    price_inputs = prices if isinstance(prices, PriceInputs) else PriceInputs(prices)
+    periods_per_day = 24 / interval_length
+    window_starts = range(0, len(prices), commit)
+    if telemetry:
+        telemetry.start(len(window_starts))
+
+    results = ResultBuffer(capacity=0 if sink else len(prices))
+    window_init_charge = init_charge
+    battery = None
+
+    for window_number, start in enumerate(window_starts, 1):
+        window_prices, window_export = price_inputs.horizon(start, start + lookahead)
+        commit_periods = min(commit, len(window_prices))
+
+        if not telemetry:
+            print('\n')
+            print('Optimising window {}/{}'.format(window_number, len(window_starts)))
+
+        tic = time.perf_counter()
+        # The windows near the end of the series are shorter, which changes the model structure
+        rebuilt = not (persistent and battery is not None and battery.n_periods == len(window_prices))
+        if not rebuilt:
+            battery.shift_solution(commit)
+            battery.update_horizon(import_rate=window_prices, export_rate=window_export, init_charge=window_init_charge)
+        else:
+            battery = build_battery(window_prices,
+                                    init_charge=window_init_charge,
+                                    battery_params=battery_params,
+                                    max_cycles=cycles_per_day * len(window_prices) / periods_per_day,
+                                    backend=backend,
+                                    persistent=persistent,
+                                    relax_binaries=relax_binaries,
+                                    interval_length=interval_length,
+                                    export_prices=window_export)
+            battery.add_block_cycles_constraint(block_periods=commit,
+                                                max_discharge=cycles_per_day * commit / periods_per_day *
+                                                battery_params["battery_capacity"])
+        build_time = time.perf_counter() - tic
+
+        battery.solve_problem(mip_rel_gap=mip_rel_gap, time_limit=time_limit, day_count=window_number,
+                              solver_selection=solver_selection, threads=threads)
+
+        tic = time.perf_counter()
+        committed = {name: values[:commit_periods] for name, values in battery.collect_opt_columns().items()}
+        if sink:
+            sink.write(committed)
+        else:
+            results.append(committed)
+
+        # The next window starts from the energy level at the end of the committed periods
+        window_init_charge = float(committed["State of Energy (MWh)"][-1])
+
+        if telemetry:
+            telemetry.record(horizon=window_number, n_periods=len(window_prices), build_time_s=build_time,
+                             solve_metrics=battery.metrics, end_soc=window_init_charge,
+                             collect_time_s=time.perf_counter() - tic, rebuilt=rebuilt,
+                             committed_profit=float(committed["Trading Profits (£)"].sum()))
+
+    return results
+
+
+def compare_with_fixed_window(prices: np.ndarray | PriceInputs, lookahead: int, commit: int, cycles_per_day: float,
+                              init_charge: float, battery_params: dict = None, **solve_kwargs) -> dict:
+    """
+    Run the fixed-window dispatch with windows of commit periods and the receding-horizon dispatch with the same cycle
+    budget, and report the profit against the compute time of both
+
+    :param prices: HH prices for the whole period
+    :param lookahead: Length of the receding-horizon window in periods
+    :param commit: Number of periods committed per window, also the length of the fixed windows
+    :param cycles_per_day: Cycle budget per day
+    :param init_charge: Energy level at the start (MWh)
+    :param battery_params: Battery specification, defaults to DEFAULT_BATTERY_PARAMS
+    :param solve_kwargs: persistent, solver_selection, mip_rel_gap, time_limit, backend, relax_binaries and
+                         interval_length
+    :return: Dictionary with the profit, cycles used, number of solves and run time of both approaches
+    """
+    battery_params = battery_params or DEFAULT_BATTERY_PARAMS
+    interval_length = solve_kwargs.get("interval_length", 0.5)
+
+    tic = time.perf_counter()
+    fixed_results = run_serial(prices, time_horizon=commit,
+                               cycles_per_time_horizon=cycles_per_day * commit * interval_length / 24,
+                               init_charge=init_charge, battery_params=battery_params, **solve_kwargs)
+    fixed_time = time.perf_counter() - tic
+
+    tic = time.perf_counter()
+    receding_results = run_receding_horizon(prices, lookahead=lookahead, commit=commit, cycles_per_day=cycles_per_day,
+                                            init_charge=init_charge, battery_params=battery_params, **solve_kwargs)
+    receding_time = time.perf_counter() - tic
+
+    def cycles_used(results):
+        # MW * interval length in hours = MWh
+        return results["DC Discharging power (MW)"].sum() * interval_length / battery_params["battery_capacity"]
+
+    fixed_profit = fixed_results["Trading Profits (£)"].sum()
+    receding_profit = receding_results["Trading Profits (£)"].sum()
+    n_solves = -(-len(prices) // commit)
+
+    comparison = {"fixed_profit": fixed_profit,
+                  "receding_profit": receding_profit,
+                  "profit_uplift_pct": (receding_profit - fixed_profit) / abs(fixed_profit) * 100,
+                  "fixed_cycles": cycles_used(fixed_results),
+                  "receding_cycles": cycles_used(receding_results),
+                  "fixed_time_s": fixed_time,
+                  "receding_time_s": receding_time,
+                  "time_ratio": receding_time / fixed_time,
+                  "n_solves": n_solves,
+                  "fixed_final_soc": fixed_results.last("State of Energy (MWh)"),
+                  "receding_final_soc": receding_results.last("State of Energy (MWh)"),
+                  }
+
+    logging.info(f"Fixed {commit}-period windows: £{fixed_profit:,.0f} in {fixed_time:.1f} s, "
+                 f"Receding {lookahead}/{commit}: £{receding_profit:,.0f} in {receding_time:.1f} s, "
+                 f"Uplift: {comparison['profit_uplift_pct']:.2f}% for {comparison['time_ratio']:.1f}x the compute")
+
+    return comparison
@@ -0,0 +1,87 @@
+"""
+Columnar buffer for the dispatch results.
+
+Each solved horizon is appended as a chunk of NumPy columns into preallocated arrays, instead of extending a list with
+one dict per period. This keeps a multi-year run to a handful of contiguous float arrays and turns the final
+DataFrame construction into a zero-copy wrap of those arrays.
+"""
+import numpy as np
+import pandas as pd
+
+
+class ResultBuffer:
+
+    def __init__(self, capacity: int = 0):
+        """
+        :param capacity: Number of periods to preallocate, the buffer doubles in size if it is exceeded
+        """
+        self.capacity = capacity
+        self.size = 0
+        self.columns = {}
+
+    def __len__(self):
+        return self.size
+
+    def _reserve(self, n_rows: int):
+        """
+        Make room for n_rows more periods
+        :param n_rows: Number of periods about to be appended
+        :return:
+        """
+        required = self.size + n_rows
+        if required <= self.capacity:
+            return
+
+        self.capacity = max(required, 2 * self.capacity)
+        for name, values in self.columns.items():
+            grown = np.empty(self.capacity, dtype=values.dtype)
+            grown[:self.size] = values[:self.size]
+            self.columns[name] = grown
+
+    def append(self, chunk: dict):
+        """
+        Append the result columns of a solved horizon
+        :param chunk: Dictionary of result column name to array, as returned by collect_opt_columns
+        :return:
+        """
+        n_rows = len(next(iter(chunk.values())))
+
+        if not self.columns:
+            self.capacity = max(self.capacity, n_rows)
+            self.columns = {name: np.empty(self.capacity, dtype=np.asarray(values).dtype)
+                            for name, values in chunk.items()}
+        else:
+            self._reserve(n_rows)
+
+        for name, values in chunk.items():
+            self.columns[name][self.size:self.size + n_rows] = values
+        self.size += n_rows
+
+    def extend(self, other: "ResultBuffer"):
+        """
+        Append every period held by another buffer
+        :param other: Buffer to copy the periods from
+        :return:
+        """
+        if len(other):
+            self.append({name: other[name] for name in other.columns})
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        """
+        :param name: Result column name
+        :return: View of the filled part of that column
+        """
+        return self.columns[name][:self.size]
+
+    def last(self, name: str) -> float:
+        """
+        :param name: Result column name
+        :return: Value of that column in the last appended period
+        """
+        return float(self.columns[name][self.size - 1])
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        :return: DataFrame of all the appended periods, wrapping the buffer arrays without copying them
+        """
+        return pd.DataFrame({name: self[name] for name in self.columns}, copy=False)
@@ -0,0 +1,176 @@
+"""
+This module sweeps the battery dispatch over a grid of scenarios, e.g. battery specifications, daily cycle limits
+and horizon lengths, and summarises them in one tidy comparison table.
+
+The prices are loaded and cleaned once in the parent process and handed to every worker process once through the
+pool initializer, so each scenario only ships its own parameters. Each worker runs the serial rolling-horizon
+dispatch and returns the annual summary of its scenario rather than the full HH results.
+
+Example:
+  scenarios = scenario_grid(cycles_per_day=[1, 2], battery_capacity=[100, 200])
+  sweep_df = run_sweep(scenarios, backend="matrix")
+  comparison_table(sweep_df, label_by="cycles_per_day")
+
+The one vs two cycle comparison is written to results/ by running from the repository root:
+  $ python -m tools.scenario_sweep
+"""
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import numpy as np
+import itertools
+import logging
+import time
+import os
+
+from tools.dispatch_runner import run_serial, DEFAULT_BATTERY_PARAMS
+from tools.price_data_cleaning import process_price_data
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Scenario parameters on top of the battery specification, the horizon is in dispatch periods and a year if None
+SCENARIO_DEFAULTS = {"cycles_per_day": 1, "time_horizon": None}
+
+SUMMARY_COLUMNS = ["DC Discharging power (MW)", "Trading Profits (£)"]
+
+# Prices shared by every scenario, set once in each worker process by _init_worker
+_shared_prices = None
+_shared_years = None
+
+
+def scenario_grid(**param_values) -> list[dict]:
+    """
+    Build every combination of the given parameter values
+
+    :param param_values: Lists of values keyed by a DEFAULT_BATTERY_PARAMS key, "cycles_per_day" or "time_horizon"
+    :return: List of scenario dictionaries
+    """
+    unknown = set(param_values) - set(DEFAULT_BATTERY_PARAMS) - set(SCENARIO_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown scenario parameters: {sorted(unknown)}")
+
+    names = list(param_values)
+    return [dict(zip(names, values)) for values in itertools.product(*param_values.values())]
+
+
+def _init_worker(prices: np.ndarray, years: np.ndarray):
+    global _shared_prices, _shared_years
+    _shared_prices = prices
+    _shared_years = years
+
+
+def summarise_scenario(results, years: np.ndarray, battery_params: dict,
+                       interval_length: float = 0.5) -> pd.DataFrame:
+    """
+    Annual discharge, cycles and profit of a scenario, in the same units as tools.number_of_cycles
+
+    :param results: Columnar results from run_serial
+    :param years: Year of every dispatch period
+    :param battery_params: Battery specification of the scenario
+    :param interval_length: Duration of a dispatch period in hours
+    :return: DataFrame with one row per year
+    """
+    annual_df = pd.DataFrame({col: results[col] for col in SUMMARY_COLUMNS}).groupby(years).sum()
+    annual_df.index.name = "year"
+
+    # MW * interval length in hours = MWh
+    annual_df["Total Discharge (MWh)"] = annual_df["DC Discharging power (MW)"] * interval_length
+    annual_df["Cycles"] = annual_df["Total Discharge (MWh)"] / battery_params["battery_capacity"]
+    annual_df["£_kW_year"] = annual_df["Trading Profits (£)"] / (battery_params["discharge_power"] * 1000)
+
+    return annual_df.reset_index()
+
+
+def _run_scenario(scenario_args: tuple) -> pd.DataFrame:
+    """
+    Worker function for the process pool, runs the serial dispatch of one scenario on the shared prices
+
+    :param scenario_args: Tuple of (scenario id, scenario dictionary, initial SoC in p.u., run_serial keyword args)
+    :return: Annual summary of the scenario with the scenario parameters as columns
+    """
+    scenario_id, scenario, init_soc, solve_kwargs = scenario_args
+    battery_params = {**DEFAULT_BATTERY_PARAMS, **{k: v for k, v in scenario.items() if k in DEFAULT_BATTERY_PARAMS}}
+    settings = {**SCENARIO_DEFAULTS, **{k: v for k, v in scenario.items() if k in SCENARIO_DEFAULTS}}
+    interval_length = solve_kwargs["interval_length"]
+    periods_per_day = round(24 / interval_length)
+    time_horizon = settings["time_horizon"] or periods_per_day * 365
+
+    tic = time.perf_counter()
+    results = run_serial(_shared_prices,
+                         time_horizon=time_horizon,
+                         cycles_per_time_horizon=settings["cycles_per_day"] * time_horizon / periods_per_day,
+                         init_charge=init_soc * battery_params["battery_capacity"],
+                         battery_params=battery_params,
+                         **solve_kwargs)
+    logging.info(f"Scenario {scenario_id} {scenario} solved in {time.perf_counter() - tic:.1f} seconds")
+
+    summary_df = summarise_scenario(results, _shared_years, battery_params, interval_length=interval_length)
+    for position, (name, value) in enumerate({"scenario": scenario_id, **scenario}.items()):
+        summary_df.insert(position, name, value)
+
+    return summary_df
+
+
+def run_sweep(scenarios: list[dict], filename: str = "input_data.csv", start: str | None = None,
+              end: str | None = None, init_soc: float = 0.5, max_workers: int | None = None,
+              interval_length: float = 0.5, **solve_kwargs) -> pd.DataFrame:
+    """
+    Run every scenario across a process pool on the same cleaned prices
+
+    :param scenarios: List of scenario dictionaries, e.g. from scenario_grid
+    :param filename: Name of the raw price CSV in the data directory
+    :param start: Optional inclusive start date of the prices to use
+    :param end: Optional exclusive end date of the prices to use
+    :param init_soc: Initial state of charge as a fraction of the capacity
+    :param max_workers: Number of worker processes, defaults to the number of CPUs
+    :param interval_length: Duration of a dispatch period in hours, the prices are resampled to it
+    :param solve_kwargs: persistent, solver_selection, mip_rel_gap, time_limit and backend passed to run_serial
+    :return: Tidy DataFrame with one row per scenario and year
+    """
+    market_price_df, _ = process_price_data(filename, time_horizon=round(24 / interval_length),
+                                            interval_length=interval_length)
+    in_window = np.ones(len(market_price_df), dtype=bool)
+    if start:
+        in_window &= (market_price_df["time"] >= pd.Timestamp(start)).to_numpy()
+    if end:
+        in_window &= (market_price_df["time"] < pd.Timestamp(end)).to_numpy()
+
+    prices = market_price_df["prices"].to_numpy(dtype=np.float64)[in_window]
+    years = market_price_df["time"].dt.year.to_numpy()[in_window]
+
+    solve_kwargs = {**solve_kwargs, "interval_length": interval_length}
+    tasks = [(scenario_id, scenario, init_soc, solve_kwargs) for scenario_id, scenario in enumerate(scenarios)]
+    logging.info(f"Running {len(tasks)} scenarios across {max_workers or os.cpu_count()} processes")
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(prices, years)) as executor:
+        summaries = list(executor.map(_run_scenario, tasks))
+
+    return pd.concat(summaries, ignore_index=True)
+
+
+def comparison_table(sweep_df: pd.DataFrame, label_by: str | list[str]) -> pd.DataFrame:
+    """
+    Pivot the tidy sweep results to one row per year and one column per metric and scenario, in the layout of
+    results/cycling_limit_results.csv
+
+    :param sweep_df: Tidy DataFrame from run_sweep
+    :param label_by: Scenario parameter(s) used to label the columns
+    :return: Wide comparison DataFrame indexed by year
+    """
+    label_by = [label_by] if isinstance(label_by, str) else list(label_by)
+    metrics = SUMMARY_COLUMNS + ["Total Discharge (MWh)", "Cycles", "£_kW_year"]
+
+    labels = sweep_df[label_by].astype(str).apply(lambda row: ", ".join(f"{k}={v}" for k, v in row.items()), axis=1)
+    wide_df = sweep_df.assign(label=labels).pivot(index="year", columns="label", values=metrics)
+    wide_df.columns = [f"{metric} - {label}" for metric, label in wide_df.columns]
+
+    return wide_df
+
+
+if __name__ == "__main__":
+    sweep_df = run_sweep(scenario_grid(cycles_per_day=[1, 2]), backend="matrix")
+
+    file_location = os.path.join(os.path.dirname(__file__), "..", "results/").replace('\\', '/')
+    sweep_df.to_csv(file_location + "scenario_sweep_results.csv", index=False)
+    comparison_table(sweep_df, label_by="cycles_per_day").to_csv(file_location + "scenario_comparison.csv")
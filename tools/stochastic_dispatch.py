@@ -0,0 +1,296 @@
+"""
+This module solves the two-stage stochastic dispatch of stochastic_model.StochasticMatrixModel, either as one extensive
+form or by Benders decomposition across worker processes.
+
+Benders splits the problem at the end of the first stage. The recourse of a scenario only depends on the first-stage
+schedule through two numbers: the energy level the first stage finishes at and the discharge throughput it has used of
+the horizon's cycle budget. The master problem is the first-stage battery on the expected prices plus one variable per
+scenario standing in for that scenario's recourse cost, and every iteration the scenario recourse LPs are solved across
+a ProcessPoolExecutor at the master's end SoC and throughput. The duals of their initial SoC and cycle budget rows are
+the slopes of a cut (multi-cut Benders), which is added to the master until the lower bound of the master and the
+upper bound of the evaluated schedule meet. The recourse is solved as an LP, so it has duals to cut with, with the
+charge and discharge bools fixed as in relax_binaries; with lossy efficiencies charging and discharging at once is
+never profitable, so that rarely changes the answer.
+
+Every worker builds the recourse model of each of its scenarios once and only updates the right-hand sides afterwards.
+
+Example:
+  master, metrics = solve_benders(forecasts, first_stage_periods=48, init_charge=50,
+                                  battery_params=DEFAULT_BATTERY_PARAMS, max_cycles=2)
+  charge, discharge = master.variable_values(CHARGE), master.variable_values(DISCHARGE)
+
+Run from the repository root:
+  $ python -m tools.stochastic_dispatch
+"""
+from concurrent.futures import ProcessPoolExecutor
+from scipy.optimize import linprog
+import scipy.sparse as sp
+import numpy as np
+import logging
+import time
+
+from matrix_model import BatteryMatrixModel, ENERGY, DISCHARGE, CHARGE_BOOL, DISCHARGE_BOOL
+from stochastic_model import StochasticMatrixModel
+from tools.dispatch_runner import DEFAULT_BATTERY_PARAMS
+from tools.price_data_cleaning import process_price_data
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Recourse prices and settings shared by every scenario, set once in each worker process by _init_worker
+_shared_prices = None
+_shared_settings = None
+# Recourse models already built in this worker, keyed by scenario
+_recourse_models = {}
+
+
+def solve_extensive_form(scenario_prices: np.ndarray, first_stage_periods: int, init_charge: float,
+                         battery_params: dict, max_cycles: float | None, probabilities: np.ndarray | None = None,
+                         interval_length: float = 0.5, mip_rel_gap: float = 0.0001, time_limit: float | int = 20,
+                         relax_binaries: bool = True) -> StochasticMatrixModel:
+    """
+    Build and solve every scenario in one model
+
+    :param scenario_prices: (scenarios x periods) array of price forecasts for the horizon
+    :param first_stage_periods: Number of periods committed before the prices are known
+    :param init_charge: Energy level at the start of the horizon (MWh)
+    :param battery_params: Battery specification
+    :param max_cycles: Number of cycles allowed within the horizon in every scenario, None leaves it uncapped
+    :param probabilities: Probability of every scenario, equally likely if None
+    :param interval_length: Duration of a dispatch period in hours
+    :param mip_rel_gap: Relative MIP gap tolerance
+    :param time_limit: Solver time limit in seconds
+    :param relax_binaries: Solve as an LP and only add binaries where a scenario charges and discharges at once
+    :return: The solved model
+    """
+    model = StochasticMatrixModel(battery_params, scenario_prices, first_stage_periods, init_charge,
+                                  probabilities=probabilities, interval_length=interval_length)
+    model.add_objective_function()
+    model.add_storage_constraints()
+    if max_cycles is not None:
+        model.add_max_cycles_constraint(max_daily_cycles=max_cycles)
+    model.add_non_anticipativity_constraints()
+    model.solve_problem(mip_rel_gap=mip_rel_gap, time_limit=time_limit, relax_binaries=relax_binaries)
+
+    return model
+
+
+def _linprog_form(model: BatteryMatrixModel) -> dict:
+    """
+    Split the model's two-sided rows into the equality and upper bound rows linprog expects, with the exclusivity rows
+    dropped and the bools fixed at 1 as in relax_binaries
+
+    :param model: Recourse model with its storage and cycle constraints
+    :return: Dictionary of the static matrices and the row positions needed to update the right-hand sides
+    """
+    A, lower, upper = model._stack_constraints()
+    offsets = np.cumsum([0] + [block[0].shape[0] for block in model.constraint_blocks])
+    keep = np.ones(A.shape[0], dtype=bool)
+    for i in model.exclusive_blocks:
+        keep[offsets[i]:offsets[i + 1]] = False
+
+    equality = keep & (lower == upper)
+    upper_rows = keep & ~equality & np.isfinite(upper)
+    lower_rows = keep & ~equality & np.isfinite(lower)
+
+    bounds = np.column_stack([model.lb, model.ub])
+    for block in (CHARGE_BOOL, DISCHARGE_BOOL):
+        bounds[model._block(block)] = 1
+
+    return {"A_eq": A[equality], "A_ub": sp.vstack([A[upper_rows], -A[lower_rows]], format="csr"),
+            "equality": equality, "upper_rows": upper_rows, "lower_rows": lower_rows, "bounds": bounds,
+            # The initial SoC row is the first row of the SoC balance, the cycle budget the last block
+            "soc_row": int(np.cumsum(equality)[offsets[-3]] - 1),
+            "cycle_row": int(np.cumsum(upper_rows)[offsets[-2]] - 1)}
+
+
+def _recourse_model(prices: np.ndarray, settings: dict) -> tuple[BatteryMatrixModel, dict]:
+    model = BatteryMatrixModel(import_rate=prices, export_rate=prices, init_charge=0.0,
+                               interval_length=settings["interval_length"], **settings["battery_params"])
+    model.add_objective_function()
+    model.add_storage_constraints()
+    # The budget is overwritten before every solve, the row only has to exist
+    model.add_max_cycles_constraint(max_daily_cycles=1, max_discharge=settings["max_discharge"])
+
+    return model, _linprog_form(model)
+
+
+def solve_recourse(model: BatteryMatrixModel, form: dict, init_charge: float,
+                   remaining_discharge: float) -> tuple[float, float, float]:
+    """
+    :param model: Recourse model of a scenario
+    :param form: Its linprog form from _linprog_form
+    :param init_charge: Energy level at the start of the recourse periods (MWh)
+    :param remaining_discharge: Discharge throughput left of the horizon's cycle budget (MWh)
+    :return: value: Recourse cost, the negative trading profit of the recourse periods (£)
+             d_energy: Change of the cost per MWh of initial energy
+             d_throughput: Change of the cost per MWh of throughput used by the first stage
+    """
+    model.soc_rhs[0] = init_charge
+    model.constraint_blocks[-1][2][0] = remaining_discharge
+    _, lower, upper = model._stack_constraints()
+
+    results = linprog(model.c, A_ub=form["A_ub"],
+                      b_ub=np.r_[upper[form["upper_rows"]], -lower[form["lower_rows"]]],
+                      A_eq=form["A_eq"], b_eq=lower[form["equality"]], bounds=form["bounds"], method="highs")
+    if results.status != 0:
+        raise RuntimeError(f"Recourse LP failed: {results.message}")
+
+    # The budget is what is left after the first stage, so using more throughput moves it the other way
+    return results.fun, results.eqlin.marginals[form["soc_row"]], -results.ineqlin.marginals[form["cycle_row"]]
+
+
+def _init_worker(prices: np.ndarray, settings: dict):
+    global _shared_prices, _shared_settings, _recourse_models
+    _shared_prices = prices
+    _shared_settings = settings
+    _recourse_models = {}
+
+
+def _solve_scenarios(task: tuple) -> list[tuple[float, float, float]]:
+    """
+    Worker function for the process pool, solves the recourse of a chunk of scenarios at the same first-stage state
+
+    :param task: Tuple of (scenario numbers, end SoC of the first stage, throughput used by the first stage)
+    :return: Value and slopes of every scenario's recourse, see solve_recourse
+    """
+    scenarios, init_charge, used_discharge = task
+    cuts = []
+    for s in scenarios:
+        if s not in _recourse_models:
+            _recourse_models[s] = _recourse_model(_shared_prices[s], _shared_settings)
+        model, form = _recourse_models[s]
+        cuts.append(solve_recourse(model, form, init_charge,
+                                   max(_shared_settings["max_discharge"] - used_discharge, 0.0)))
+
+    return cuts
+
+
+def solve_benders(scenario_prices: np.ndarray, first_stage_periods: int, init_charge: float, battery_params: dict,
+                  max_cycles: float, probabilities: np.ndarray | None = None, interval_length: float = 0.5,
+                  tolerance: float = 1e-5, max_iterations: int = 100, max_workers: int | None = None,
+                  mip_rel_gap: float = 0.0001, time_limit: float | int = 20) -> tuple[BatteryMatrixModel, dict]:
+    """
+    Solve the two-stage problem by multi-cut Benders decomposition, the scenario recourse LPs across a process pool
+
+    :param scenario_prices: (scenarios x periods) array of price forecasts for the horizon
+    :param first_stage_periods: Number of periods committed before the prices are known, fewer than the horizon
+    :param init_charge: Energy level at the start of the horizon (MWh)
+    :param battery_params: Battery specification
+    :param max_cycles: Number of cycles allowed within the horizon in every scenario
+    :param probabilities: Probability of every scenario, equally likely if None
+    :param interval_length: Duration of a dispatch period in hours
+    :param tolerance: Relative gap between the bounds at which the decomposition stops
+    :param max_iterations: Maximum number of master solves
+    :param max_workers: Number of worker processes, defaults to the number of CPUs, 1 solves in this process
+    :param mip_rel_gap: Relative MIP gap tolerance of the master
+    :param time_limit: Solver time limit of every master solve in seconds
+    :return: master: The solved first-stage model, its columns hold the committed schedule
+             metrics: Expected profit, bounds, number of iterations and run time
+    """
+    scenario_prices = np.atleast_2d(np.asarray(scenario_prices, dtype=np.float64))
+    n_scenarios, n_periods = scenario_prices.shape
+    if not 0 < first_stage_periods < n_periods:
+        raise ValueError(f"first_stage_periods must leave recourse periods in the horizon of {n_periods} periods")
+    probabilities = StochasticMatrixModel._normalise(probabilities, n_scenarios)
+    max_discharge = max_cycles * battery_params["battery_capacity"]
+
+    # The master is the first stage on the expected prices, with one recourse cost column per scenario after it
+    expected_prices = probabilities @ scenario_prices[:, :first_stage_periods]
+    master = BatteryMatrixModel(import_rate=expected_prices, export_rate=expected_prices, init_charge=init_charge,
+                                interval_length=interval_length, **battery_params)
+    master.add_objective_function()
+    master.add_storage_constraints()
+    master.add_max_cycles_constraint(max_daily_cycles=max_cycles)
+    n_first_stage = len(master.c)
+    master.c = np.r_[master.c, probabilities]
+    master.lb = np.r_[master.lb, np.full(n_scenarios, -np.inf)]
+    master.ub = np.r_[master.ub, np.full(n_scenarios, np.inf)]
+    master.integrality = np.r_[master.integrality, np.zeros(n_scenarios)]
+
+    # The linking state: energy at the end of the first stage and its discharge throughput
+    end_energy = master._block(ENERGY).stop - 1
+    throughput = np.zeros(len(master.c))
+    throughput[master._block(DISCHARGE)] = master.M
+
+    settings = {"battery_params": battery_params, "interval_length": interval_length, "max_discharge": max_discharge}
+    chunks = np.array_split(np.arange(n_scenarios), max_workers or n_scenarios)
+    chunks = [chunk for chunk in chunks if len(chunk)]
+
+    def recourse(state: tuple) -> np.ndarray:
+        tasks = [(chunk, *state) for chunk in chunks]
+        results = map(_solve_scenarios, tasks) if executor is None else executor.map(_solve_scenarios, tasks)
+        return np.array([cut for chunk_cuts in results for cut in chunk_cuts])
+
+    tic = time.perf_counter()
+    executor = None
+    if max_workers == 1:
+        _init_worker(scenario_prices[:, first_stage_periods:], settings)
+    else:
+        executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                       initargs=(scenario_prices[:, first_stage_periods:], settings))
+
+    try:
+        state = (float(init_charge), 0.0)
+        upper_bound, best_solution = np.inf, None
+        for iteration in range(1, max_iterations + 1):
+            cuts = recourse(state)
+
+            # The schedule the state came from is feasible, so it bounds the optimum from above
+            if master.solution is not None:
+                candidate = master.c[:n_first_stage] @ master.solution[:n_first_stage] + probabilities @ cuts[:, 0]
+                if candidate < upper_bound:
+                    upper_bound, best_solution = candidate, master.solution.copy()
+
+            # eta_s - dE * E_end - dD * throughput >= V_s - dE * E_k - dD * D_k
+            rows = np.zeros((n_scenarios, len(master.c)))
+            rows[:, end_energy] = -cuts[:, 1]
+            rows -= cuts[:, [2]] * throughput
+            rows[np.arange(n_scenarios), n_first_stage + np.arange(n_scenarios)] = 1
+            rhs = cuts[:, 0] - cuts[:, 1] * state[0] - cuts[:, 2] * state[1]
+            master.constraint_blocks.append((sp.csr_matrix(rows), rhs, np.full(n_scenarios, np.inf)))
+
+            master.solve_problem(mip_rel_gap=mip_rel_gap, time_limit=time_limit, relax_binaries=True)
+            lower_bound = master.c @ master.solution
+            gap = (upper_bound - lower_bound) / max(abs(upper_bound), 1.0) if best_solution is not None else np.inf
+            logging.info(f"Benders iteration {iteration}: expected profit between {-upper_bound:,.2f} and "
+                         f"{-lower_bound:,.2f}")
+            if gap <= tolerance:
+                break
+
+            state = (float(master.solution[end_energy]), float(throughput @ master.solution))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    # Report the best evaluated schedule, whose expected profit is known exactly
+    if best_solution is not None:
+        master.solution = best_solution
+    master.objective_value = -upper_bound
+
+    metrics = {"expected_profit": -upper_bound,
+               "profit_bound": -lower_bound,
+               "gap": gap,
+               "iterations": iteration,
+               "solve_time_s": time.perf_counter() - tic,
+               "n_scenarios": n_scenarios}
+
+    return master, metrics
+
+
+if __name__ == "__main__":
+    market_price_df, _ = process_price_data("input_data.csv", time_horizon=48)
+    prices = market_price_df["prices"].to_numpy(dtype=np.float64)
+
+    # The day-ahead problem of the last two days, with the 50 two-day windows before it as the forecast ensemble
+    n_scenarios, n_periods = 50, 96
+    start = len(prices) - n_periods
+    forecasts = np.stack([prices[start - 48 * (s + 1):start - 48 * (s + 1) + n_periods] for s in range(n_scenarios)])
+
+    extensive_form = solve_extensive_form(forecasts, first_stage_periods=48, init_charge=50,
+                                          battery_params=DEFAULT_BATTERY_PARAMS, max_cycles=2)
+    master, metrics = solve_benders(forecasts, first_stage_periods=48, init_charge=50,
+                                    battery_params=DEFAULT_BATTERY_PARAMS, max_cycles=2)
+    logging.info(f"Expected profit: extensive form {extensive_form.objective_value:,.2f}, Benders "
+                 f"{metrics['expected_profit']:,.2f} in {metrics['iterations']} iterations and "
+                 f"{metrics['solve_time_s']:.1f} seconds")
@@ -0,0 +1,127 @@
+"""
+Per-horizon telemetry for the rolling-horizon dispatch.
+
+run_serial hands every solved horizon to a HorizonTelemetry, which appends one JSON line per horizon with the build
+time, solver wall time, model size, MIP gap reached, termination condition, objective and end SoC. An optional live
+summary logs the throughput in horizons per second with an ETA, and every horizon that did not finish optimal (e.g.
+it hit the time limit) is logged as a warning so slow or time-limited horizons stand out in long backtests.
+
+Load a telemetry file with:
+  pd.read_json("results/telemetry.jsonl", lines=True)
+"""
+import numpy as np
+import datetime
+import logging
+import json
+import time
+import os
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def _to_json(obj):
+    # NumPy scalars from the solved arrays are not JSON serialisable
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class HorizonTelemetry:
+
+    def __init__(self, path: str | None = None, live_summary: bool = True, summary_interval: float = 10.0,
+                 context: dict | None = None):
+        """
+        :param path: JSONL file the records are appended to, records are only kept in memory if None
+        :param live_summary: Log the progress, throughput and ETA while the run is going
+        :param summary_interval: Minimum number of seconds between two live summaries
+        :param context: Extra fields added to every record, e.g. {"block": 3} in a parallel run
+        """
+        self.path = path
+        self.live_summary = live_summary
+        self.summary_interval = summary_interval
+        self.context = context or {}
+        self.records = []
+
+        self.n_horizons = None
+        self._solve_time = 0.0
+        self._start = None
+        self._last_summary = None
+        self._file = None
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._file = open(path, "a", encoding="utf-8")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self, n_horizons: int):
+        """
+        :param n_horizons: Number of horizons in the run, used for the ETA
+        :return:
+        """
+        self.n_horizons = n_horizons
+        self._start = self._last_summary = time.perf_counter()
+
+    def record(self, horizon: int, n_periods: int, build_time_s: float, solve_metrics: dict, end_soc: float,
+               **fields) -> dict:
+        """
+        Record a solved horizon
+
+        :param horizon: Horizon number, starting at 1
+        :param n_periods: Number of periods in the horizon
+        :param build_time_s: Time spent building (or updating) the model
+        :param solve_metrics: The model's metrics after solve_problem
+        :param end_soc: Energy level at the end of the horizon (MWh)
+        :param fields: Any other fields to store, e.g. collect_time_s
+        :return: The record written
+        """
+        if self._start is None:
+            self.start(n_horizons=None)
+
+        record = {"timestamp": datetime.datetime.now().isoformat(timespec="milliseconds"),
+                  "elapsed_s": time.perf_counter() - self._start,
+                  **self.context,
+                  "horizon": horizon,
+                  "n_horizons": self.n_horizons,
+                  "n_periods": n_periods,
+                  "build_time_s": build_time_s,
+                  **solve_metrics,
+                  "end_soc_mwh": end_soc,
+                  **fields,
+                  }
+        self.records.append(record)
+        self._solve_time += record.get("solve_time_s") or 0.0
+
+        if self._file is not None:
+            self._file.write(json.dumps(record, default=_to_json) + "\n")
+            # Flushed every horizon so the file can be followed while a long run is going
+            self._file.flush()
+
+        if record.get("termination", "optimal") != "optimal":
+            logging.warning(f"Horizon {horizon} finished with termination '{record['termination']}' after "
+                            f"{record.get('solve_time_s', float('nan')):.1f} s, MIP gap {record.get('mip_gap')}")
+
+        if self.live_summary and (time.perf_counter() - self._last_summary >= self.summary_interval or
+                                  horizon == self.n_horizons):
+            self._log_summary(horizon)
+
+        return record
+
+    def _log_summary(self, horizon: int):
+        elapsed = max(time.perf_counter() - self._start, 1e-9)
+        rate = len(self.records) / elapsed
+        summary = f"Horizon {horizon}/{self.n_horizons or '?'} - {rate:.2f} horizons/s, " \
+                  f"{self._solve_time / elapsed:.0%} of the time in the solver"
+        if self.n_horizons:
+            summary += f", ETA {datetime.timedelta(seconds=round((self.n_horizons - horizon) / rate))}"
+        logging.info(summary)
+        self._last_summary = time.perf_counter()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None